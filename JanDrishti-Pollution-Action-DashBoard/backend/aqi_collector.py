@@ -9,10 +9,12 @@ import redis
 import requests
 import time
 import logging
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from local_store import get_local_store
+from cache_events import publish_ward_updated, publish_daily_updated
 import threading
 
 load_dotenv()
@@ -39,6 +41,28 @@ REDIS_SSL = os.getenv("REDIS_SSL", "false").lower() == "true"  # Enable SSL for
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
+# IST is a fixed UTC+5:30 offset (no DST), so buckets can be computed with integer math
+IST_OFFSET_SECONDS = 5 * 3600 + 30 * 60
+
+# Hourly readings and derived series live for 2 days in Redis
+HOURLY_TTL_SECONDS = 86400 * 2
+
+POLLUTANT_FIELDS = ("aqi", "pm25", "pm10", "no2", "o3")
+
+# Latest-reading index: one hash field per ward, plus a version bumped on every write
+LATEST_INDEX_KEY = "aqi:latest"
+LATEST_VERSION_KEY = "aqi:latest:version"
+
+
+def ist_bucket(epoch: int) -> Dict:
+    """Return the IST date/hour bucket for a UTC epoch (seconds)"""
+    ist = time.gmtime(epoch + IST_OFFSET_SECONDS)
+    return {
+        "ist_date": f"{ist.tm_year:04d}-{ist.tm_mon:02d}-{ist.tm_mday:02d}",
+        "ist_hour": ist.tm_hour,
+    }
+
+
 class AQICollector:
     def __init__(self):
         """Initialize Redis and Supabase clients"""
@@ -111,8 +135,12 @@ class AQICollector:
         
         self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
         
+        # Local analytical store (None if disabled or unavailable)
+        self.local_store = get_local_store()
+        
         # Load selected wards (cached)
         self.selected_wards = self._load_selected_wards()
+        self.wards_by_no = {w["ward_no"]: w for w in self.selected_wards}
     
     @staticmethod
     def _get_cached_wards() -> Optional[List[Dict]]:
@@ -163,6 +191,10 @@ class AQICollector:
             
             raise FileNotFoundError("Could not find selected_wards.json or Supabase data")
     
+    def get_ward(self, ward_no: str) -> Optional[Dict]:
+        """O(1) lookup of a selected ward by ward number"""
+        return self.wards_by_no.get(ward_no)
+    
     @staticmethod
     def clear_wards_cache():
         """Clear cached selected wards (useful for testing or updates)"""
@@ -236,24 +268,34 @@ class AQICollector:
         self._ensure_redis_connection()
         
         ward_no = ward["ward_no"]
-        now = datetime.utcnow()
+        now = datetime.now(timezone.utc)
         date_str = now.strftime("%Y-%m-%d")
         hour = now.hour
         
+        # Stamp the reading with an integer epoch and its IST bucket at ingest
+        # so the read path never has to parse timestamp strings
+        epoch = int(now.timestamp())
+        aqi_data = {**aqi_data, "epoch": epoch, **ist_bucket(epoch)}
+        
         try:
             # Store individual reading
             key = f"aqi:hourly:{ward_no}:{date_str}:{hour}"
             self.redis_client.setex(
                 key,
-                86400 * 2,  # Expire after 2 days
+                HOURLY_TTL_SECONDS,  # Expire after 2 days
                 json.dumps(aqi_data)
             )
             
             # Add to sorted set for the day (for easy retrieval)
             day_key = f"aqi:hourly:{ward_no}:{date_str}"
-            score = now.timestamp()
-            self.redis_client.zadd(day_key, {json.dumps(aqi_data): score})
-            self.redis_client.expire(day_key, 86400 * 2)  # Expire after 2 days
+            self.redis_client.zadd(day_key, {json.dumps(aqi_data): epoch})
+            self.redis_client.expire(day_key, HOURLY_TTL_SECONDS)  # Expire after 2 days
+            
+            # A new hour was written - drop the formatted series for this ward-day
+            self.redis_client.delete(self._get_series_key(ward_no, date_str))
+            self._update_latest_index(ward, aqi_data)
+            # Let every worker drop cached responses built from this ward's readings
+            publish_ward_updated(self.redis_client, ward_no)
             
             logger.info(f"✓ Stored hourly data for {ward['ward_name']} ({ward_no}) at {now.strftime('%Y-%m-%d %H:00')}")
         except (redis.ConnectionError, redis.TimeoutError, ConnectionResetError, OSError) as e:
@@ -264,17 +306,107 @@ class AQICollector:
                 key = f"aqi:hourly:{ward_no}:{date_str}:{hour}"
                 self.redis_client.setex(
                     key,
-                    86400 * 2,
+                    HOURLY_TTL_SECONDS,
                     json.dumps(aqi_data)
                 )
                 day_key = f"aqi:hourly:{ward_no}:{date_str}"
-                score = now.timestamp()
-                self.redis_client.zadd(day_key, {json.dumps(aqi_data): score})
-                self.redis_client.expire(day_key, 86400 * 2)
+                self.redis_client.zadd(day_key, {json.dumps(aqi_data): epoch})
+                self.redis_client.expire(day_key, HOURLY_TTL_SECONDS)
+                self.redis_client.delete(self._get_series_key(ward_no, date_str))
+                self._update_latest_index(ward, aqi_data)
+                publish_ward_updated(self.redis_client, ward_no)
                 logger.info(f"✓ Stored hourly data for {ward['ward_name']} ({ward_no}) after reconnect")
             except Exception as retry_error:
                 logger.error(f"Failed to write to Redis after reconnect: {retry_error}")
                 raise
+        finally:
+            # Keep full hourly history locally (Redis only keeps 2 days)
+            self._append_to_local_store(ward_no, aqi_data)
+    
+    @staticmethod
+    def _latest_entry(ward: Dict, reading: Dict) -> Dict:
+        """Build a latest-reading index entry for a ward"""
+        entry = {
+            "ward_no": ward["ward_no"],
+            "ward_name": ward.get("ward_name"),
+            "quadrant": ward.get("quadrant"),
+        }
+        for field in POLLUTANT_FIELDS:
+            entry[field] = reading.get(field)
+        entry["timestamp"] = reading.get("fetched_at") or reading.get("timestamp")
+        entry["epoch"] = reading.get("epoch")
+        return entry
+    
+    def _update_latest_index(self, ward: Dict, aqi_data: Dict):
+        """Record a ward's newest reading in the latest-reading index"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(LATEST_INDEX_KEY, ward["ward_no"], json.dumps(self._latest_entry(ward, aqi_data)))
+        pipe.incr(LATEST_VERSION_KEY)
+        pipe.execute()
+    
+    def rebuild_latest_index(self) -> int:
+        """
+        Rebuild the latest-reading index from the hourly sorted sets
+        (one pipelined read for all wards); used when the index is empty.
+        The version is bumped only if the index contents actually change.
+        """
+        today = datetime.now(timezone.utc).date()
+        days = [today.strftime("%Y-%m-%d"), (today - timedelta(days=1)).strftime("%Y-%m-%d")]
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for ward in self.selected_wards:
+            for date_str in days:
+                pipe.zrevrange(f"aqi:hourly:{ward['ward_no']}:{date_str}", 0, 0)
+        pipe.hgetall(LATEST_INDEX_KEY)
+        *results, existing = pipe.execute()
+        
+        entries = {}
+        for i, ward in enumerate(self.selected_wards):
+            for latest in results[i * len(days):(i + 1) * len(days)]:
+                if latest:
+                    entries[ward["ward_no"]] = json.dumps(self._latest_entry(ward, json.loads(latest[0])))
+                    break
+        
+        changed = {ward_no: entry for ward_no, entry in entries.items() if existing.get(ward_no) != entry}
+        if changed:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(LATEST_INDEX_KEY, mapping=changed)
+            pipe.incr(LATEST_VERSION_KEY)
+            pipe.execute()
+        return len(entries)
+    
+    def get_latest_readings(self) -> Dict[str, Dict]:
+        """Get the latest reading of every ward in one read: {ward_no: entry}"""
+        self._ensure_redis_connection()
+        index = self.redis_client.hgetall(LATEST_INDEX_KEY)
+        if not index and self.rebuild_latest_index():
+            index = self.redis_client.hgetall(LATEST_INDEX_KEY)
+        return {ward_no: json.loads(entry) for ward_no, entry in index.items()}
+    
+    def get_latest_ward_data(self, ward_no: str) -> Optional[Dict]:
+        """Get the latest reading of a ward from the latest-reading index"""
+        self._ensure_redis_connection()
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hget(LATEST_INDEX_KEY, ward_no)
+        pipe.hlen(LATEST_INDEX_KEY)
+        entry, indexed = pipe.execute()
+        # Unmonitored wards are simply not indexed; only an empty index is rebuilt
+        if entry is None and indexed == 0 and self.rebuild_latest_index():
+            entry = self.redis_client.hget(LATEST_INDEX_KEY, ward_no)
+        return json.loads(entry) if entry else None
+    
+    def get_latest_version(self) -> int:
+        """Version of the latest-reading index; changes whenever a reading is written"""
+        return int(self.redis_client.get(LATEST_VERSION_KEY) or 0)
+    
+    def _append_to_local_store(self, ward_no: str, aqi_data: Dict):
+        """Append an hourly reading to the local store, never failing the caller"""
+        if not self.local_store:
+            return
+        try:
+            self.local_store.append_hourly(ward_no, aqi_data)
+        except Exception as e:
+            logger.warning(f"Could not write hourly reading to local store: {e}")
     
     def _ensure_redis_connection(self, max_retries=3):
         """Ensure Redis connection is alive, reconnect if needed"""
@@ -379,6 +511,92 @@ class AQICollector:
         
         return result
     
+    @staticmethod
+    def _get_series_key(ward_no: str, date_str: str) -> str:
+        """Get Redis key for the formatted hourly series of a ward-day"""
+        return f"aqi:series:{ward_no}:{date_str}"
+    
+    @staticmethod
+    def format_hourly_reading(reading: Dict, score: float) -> Optional[Dict]:
+        """
+        Format a stored hourly reading for charts.
+        Uses the epoch/IST bucket stamped at ingest; readings written before
+        that fall back to their sorted-set score (the UTC epoch).
+        """
+        epoch = reading.get("epoch")
+        if epoch is None:
+            epoch = int(score)
+        
+        if "ist_date" in reading and "ist_hour" in reading:
+            bucket = {"ist_date": reading["ist_date"], "ist_hour": reading["ist_hour"]}
+        else:
+            bucket = ist_bucket(epoch)
+        
+        formatted = {
+            "time": f"{bucket['ist_hour']:02d}:00",
+            "hour": bucket["ist_hour"],
+            "date": bucket["ist_date"],
+        }
+        for field in POLLUTANT_FIELDS:
+            value = reading.get(field)
+            formatted[field] = round(value, 1) if value is not None else None
+        formatted["timestamp"] = reading.get("fetched_at") or reading.get("timestamp")
+        formatted["epoch"] = epoch
+        return formatted
+    
+    def get_hourly_series(self, ward_no: str, target_date: date) -> List[Dict]:
+        """
+        Get the chart-ready hourly series for a ward-day, oldest first.
+        The formatted series is cached in Redis and only rebuilt after
+        store_hourly_data_in_redis writes a new hour for that ward-day.
+        """
+        date_str = target_date.strftime("%Y-%m-%d")
+        series_key = self._get_series_key(ward_no, date_str)
+        
+        try:
+            cached = self.redis_client.get(series_key)
+            if cached:
+                return json.loads(cached)
+        except (redis.ConnectionError, redis.TimeoutError, ConnectionResetError, OSError) as e:
+            logger.warning(f"Redis read error for hourly series, reconnecting: {e}")
+            self._ensure_redis_connection()
+        except json.JSONDecodeError:
+            pass
+        
+        day_key = f"aqi:hourly:{ward_no}:{date_str}"
+        with self.redis_client.pipeline() as pipe:
+            try:
+                # A reading written between the read and the cache fill changes the
+                # sorted set, which aborts the fill instead of caching a stale series
+                pipe.watch(day_key, series_key)
+                # Sorted set is ordered by epoch score, so no re-sorting is needed
+                readings = pipe.zrange(day_key, 0, -1, withscores=True)
+            except Exception as e:
+                logger.error(f"Failed to read hourly readings for ward {ward_no}: {e}")
+                return []
+            
+            series = []
+            for reading_json, score in readings:
+                try:
+                    reading = json.loads(reading_json)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(reading, dict):
+                    continue
+                series.append(self.format_hourly_reading(reading, score))
+            
+            if series:
+                try:
+                    pipe.multi()
+                    pipe.setex(series_key, HOURLY_TTL_SECONDS, json.dumps(series))
+                    pipe.execute()
+                except redis.WatchError:
+                    logger.debug(f"Hourly series for ward {ward_no} changed while building, not cached")
+                except Exception as e:
+                    logger.warning(f"Could not cache hourly series for ward {ward_no}: {e}")
+        
+        return series
+    
     def calculate_daily_average(self, hourly_readings: List[Dict]) -> Optional[Dict]:
         """
         Calculate daily average from hourly readings
@@ -406,28 +624,33 @@ class AQICollector:
             "hourly_readings_count": len(hourly_readings)
         }
     
+    @staticmethod
+    def build_daily_row(ward: Dict, target_date: date, daily_avg: Dict) -> Dict:
+        """Build a ward_aqi_daily row from a ward and its daily average"""
+        return {
+            "ward_name": ward["ward_name"],
+            "ward_no": ward["ward_no"],
+            "quadrant": ward["quadrant"],
+            "latitude": ward["latitude"],
+            "longitude": ward["longitude"],
+            "date": target_date.isoformat(),
+            "avg_aqi": daily_avg["avg_aqi"],
+            "min_aqi": daily_avg["min_aqi"],
+            "max_aqi": daily_avg["max_aqi"],
+            "avg_pm25": daily_avg.get("avg_pm25"),
+            "avg_pm10": daily_avg.get("avg_pm10"),
+            "avg_no2": daily_avg.get("avg_no2"),
+            "avg_o3": daily_avg.get("avg_o3"),
+            "hourly_readings_count": daily_avg["hourly_readings_count"],
+            "updated_at": datetime.utcnow().isoformat()
+        }
+    
     def store_daily_average_in_supabase(self, ward: Dict, target_date: date, daily_avg: Dict):
         """
         Store or update daily average AQI in Supabase
         """
         try:
-            data = {
-                "ward_name": ward["ward_name"],
-                "ward_no": ward["ward_no"],
-                "quadrant": ward["quadrant"],
-                "latitude": ward["latitude"],
-                "longitude": ward["longitude"],
-                "date": target_date.isoformat(),
-                "avg_aqi": daily_avg["avg_aqi"],
-                "min_aqi": daily_avg["min_aqi"],
-                "max_aqi": daily_avg["max_aqi"],
-                "avg_pm25": daily_avg.get("avg_pm25"),
-                "avg_pm10": daily_avg.get("avg_pm10"),
-                "avg_no2": daily_avg.get("avg_no2"),
-                "avg_o3": daily_avg.get("avg_o3"),
-                "hourly_readings_count": daily_avg["hourly_readings_count"],
-                "updated_at": datetime.utcnow().isoformat()
-            }
+            data = self.build_daily_row(ward, target_date, daily_avg)
             
             # Use upsert to insert or update
             response = self.supabase.table("ward_aqi_daily").upsert(
@@ -436,6 +659,7 @@ class AQICollector:
             ).execute()
             
             print(f"✓ Stored daily average for {ward['ward_name']} ({ward['ward_no']}) for {target_date}")
+            publish_daily_updated(self.redis_client, ward["ward_no"], target_date)
             return response.data
         except Exception as e:
             print(f"Error storing daily average in Supabase: {e}")
@@ -484,8 +708,10 @@ class AQICollector:
         for ward in self.selected_wards:
             print(f"\nProcessing {ward['ward_name']} ({ward['ward_no']})...")
             
-            # Get all hourly readings for the day
+            # Get all hourly readings for the day (local store keeps history past Redis expiry)
             hourly_readings = self.get_hourly_data_from_redis(ward["ward_no"], target_date)
+            if not hourly_readings and self.local_store:
+                hourly_readings = self.local_store.get_hourly_for_day(ward["ward_no"], target_date)
             
             if not hourly_readings:
                 print(f"⚠ No hourly data found for {ward['ward_name']} on {target_date}")
@@ -497,14 +723,44 @@ class AQICollector:
             daily_avg = self.calculate_daily_average(hourly_readings)
             
             if daily_avg:
-                # Store in Supabase
-                self.store_daily_average_in_supabase(ward, target_date, daily_avg)
+                if self.local_store:
+                    # Write locally; Supabase is updated by the batched sync below
+                    self.local_store.upsert_daily(self.build_daily_row(ward, target_date, daily_avg))
+                    publish_daily_updated(self.redis_client, ward["ward_no"], target_date)
+                else:
+                    # Store in Supabase
+                    self.store_daily_average_in_supabase(ward, target_date, daily_avg)
             else:
                 print(f"⚠ Could not calculate daily average for {ward['ward_name']}")
         
+        if self.local_store:
+            self.sync_local_store()
+        
         print(f"\n{'='*70}")
         print("Daily average calculation completed")
         print(f"{'='*70}\n")
+    
+    def sync_local_store(self) -> int:
+        """Push unsynced daily averages from the local store to Supabase, then pull rows other instances wrote"""
+        if not self.local_store:
+            return 0
+        try:
+            pushed = self.local_store.sync_daily_to_supabase(self.supabase)
+        except Exception as e:
+            logger.error(f"Error syncing local store to Supabase (will retry): {e}")
+            return 0
+        self.backfill_local_store()
+        return pushed
+    
+    def backfill_local_store(self) -> int:
+        """Copy Supabase daily rows written since the last pull into the local store"""
+        if not self.local_store:
+            return 0
+        try:
+            return self.local_store.pull_daily_from_supabase(self.supabase)
+        except Exception as e:
+            logger.error(f"Error backfilling local store from Supabase: {e}")
+            return 0
 
 
 if __name__ == "__main__":
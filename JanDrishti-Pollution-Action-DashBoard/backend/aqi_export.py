@@ -0,0 +1,248 @@
+"""
+Bulk AQI Export
+Generators that page through ward history in bounded chunks and encode it as
+CSV, NDJSON or Parquet, optionally gzip-compressed on the fly.
+Memory use is constant regardless of the requested range.
+"""
+import io
+import csv
+import json
+import zlib
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from aqi_collector import HOURLY_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+EXPORT_GRANULARITIES = ("hourly", "daily")
+
+# Rows fetched per page from the store
+EXPORT_CHUNK_SIZE = 1000
+
+# Longest date range (inclusive, in days) a single export may cover
+EXPORT_MAX_DAYS = 366
+
+HOURLY_EXPORT_COLUMNS = (
+    "ward_no", "epoch", "ist_date", "ist_hour",
+    "aqi", "pm25", "pm10", "no2", "o3", "fetched_at",
+)
+
+DAILY_EXPORT_COLUMNS = (
+    "date", "ward_no", "ward_name",
+    "avg_aqi", "min_aqi", "max_aqi",
+    "avg_pm25", "avg_pm10", "avg_no2", "avg_o3",
+    "hourly_readings_count",
+)
+
+# Arrow types for Parquet output; anything not listed is a float column
+STRING_COLUMNS = {"ward_no", "ward_name", "date", "ist_date", "fetched_at"}
+INTEGER_COLUMNS = {"epoch", "ist_hour", "hourly_readings_count"}
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_columns(granularity: str) -> Sequence[str]:
+    """Columns written for a granularity"""
+    return HOURLY_EXPORT_COLUMNS if granularity == "hourly" else DAILY_EXPORT_COLUMNS
+
+
+# ----------------------------------------------------------------------
+# Row sources (each yields lists of at most EXPORT_CHUNK_SIZE row dicts)
+# ----------------------------------------------------------------------
+def _ward_filter(wards: Optional[List[str]]) -> Tuple[str, list]:
+    if not wards:
+        return "", []
+    return f" AND ward_no IN ({', '.join('?' for _ in wards)})", list(wards)
+
+
+def iter_local_hourly(local_store, from_date: date, to_date: date,
+                      wards: Optional[List[str]]) -> Iterator[List[Dict]]:
+    """Hourly readings from the local store, by IST date, oldest first"""
+    ward_sql, ward_params = _ward_filter(wards)
+    sql = (
+        f"SELECT {', '.join(HOURLY_EXPORT_COLUMNS)} FROM hourly_readings "
+        f"WHERE ist_date >= ? AND ist_date <= ?{ward_sql} ORDER BY epoch, ward_no"
+    )
+    params = [from_date.isoformat(), to_date.isoformat()] + ward_params
+    yield from local_store.iter_query(sql, params, chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def iter_local_daily(local_store, from_date: date, to_date: date,
+                     wards: Optional[List[str]]) -> Iterator[List[Dict]]:
+    """Daily averages from the local store, oldest first"""
+    ward_sql, ward_params = _ward_filter(wards)
+    sql = (
+        f"SELECT {', '.join(DAILY_EXPORT_COLUMNS)} FROM daily_averages "
+        f"WHERE date >= ? AND date <= ?{ward_sql} ORDER BY date, ward_no"
+    )
+    params = [from_date.isoformat(), to_date.isoformat()] + ward_params
+    yield from local_store.iter_query(sql, params, chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def iter_supabase_daily(supabase, from_date: date, to_date: date,
+                        wards: Optional[List[str]]) -> Iterator[List[Dict]]:
+    """Daily averages from Supabase, paged by keyset on (date, ward_no), oldest first"""
+    cursor = None
+    while True:
+        query = supabase.table("ward_aqi_daily")\
+            .select(",".join(DAILY_EXPORT_COLUMNS))\
+            .gte("date", from_date.isoformat())\
+            .lte("date", to_date.isoformat())
+        if wards:
+            query = query.in_("ward_no", wards)
+        if cursor:
+            query = query.or_(f"date.gt.{cursor[0]},and(date.eq.{cursor[0]},ward_no.gt.{cursor[1]})")
+        rows = query.order("date").order("ward_no").limit(EXPORT_CHUNK_SIZE).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            break
+        cursor = (rows[-1]["date"], rows[-1]["ward_no"])
+
+
+def iter_redis_hourly(collector, from_date: date, to_date: date,
+                      wards: Optional[List[str]]) -> Iterator[List[Dict]]:
+    """
+    Hourly readings from Redis, one ward-day per chunk.
+    Only the last 2 days are available here; used when there is no local store.
+    The range is clamped to that window and to the monitored wards, so the
+    number of Redis reads is bounded whatever the request asks for.
+    """
+    monitored = [w["ward_no"] for w in collector.selected_wards]
+    requested = set(wards or monitored)
+    ward_nos = [w for w in monitored if w in requested]
+    # Day keys are UTC dates and expire after HOURLY_TTL_SECONDS
+    today = datetime.now(timezone.utc).date()
+    day = max(from_date, today - timedelta(seconds=HOURLY_TTL_SECONDS))
+    to_date = min(to_date, today)
+    while day <= to_date:
+        for ward_no in ward_nos:
+            series = collector.get_hourly_series(ward_no, day)
+            if series:
+                yield [
+                    {
+                        "ward_no": ward_no,
+                        "epoch": reading["epoch"],
+                        "ist_date": reading["date"],
+                        "ist_hour": reading["hour"],
+                        "aqi": reading["aqi"],
+                        "pm25": reading["pm25"],
+                        "pm10": reading["pm10"],
+                        "no2": reading["no2"],
+                        "o3": reading["o3"],
+                        "fetched_at": reading["timestamp"],
+                    }
+                    for reading in series
+                ]
+        day += timedelta(days=1)
+
+
+# ----------------------------------------------------------------------
+# Encoders
+# ----------------------------------------------------------------------
+def encode_csv(chunks: Iterable[List[Dict]], columns: Sequence[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow([row.get(c) for c in columns])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_ndjson(chunks: Iterable[List[Dict]], columns: Sequence[str]) -> Iterator[bytes]:
+    for rows in chunks:
+        yield "".join(
+            json.dumps({c: row.get(c) for c in columns}, separators=(",", ":")) + "\n"
+            for row in rows
+        ).encode()
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose contents can be drained between row groups"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema(columns: Sequence[str]):
+    import pyarrow as pa
+
+    def column_type(column):
+        if column in STRING_COLUMNS:
+            return pa.string()
+        if column in INTEGER_COLUMNS:
+            return pa.int64()
+        return pa.float64()
+
+    return pa.schema([(c, column_type(c)) for c in columns])
+
+
+def encode_parquet(chunks: Iterable[List[Dict]], columns: Sequence[str]) -> Iterator[bytes]:
+    """Write one Parquet row group per chunk (requires pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(columns)
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in chunks:
+            table = pa.Table.from_pylist([{c: row.get(c) for c in columns} for row in rows], schema=schema)
+            writer.write_table(table)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "ndjson": encode_ndjson,
+    "parquet": encode_parquet,
+}
+
+
+def gzip_stream(stream: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip-compress a byte stream on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for data in stream:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
@@ -1,11 +1,14 @@
 """
 AQI Data Collection Scheduler
-Runs background tasks to fetch hourly AQI data and calculate daily averages
+Runs background tasks to fetch hourly AQI data, calculate daily averages and precompute forecasts
 """
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from aqi_collector import AQICollector
 from aqi_collector_singleton import get_collector
+import forecasting
 import atexit
 import logging
 
@@ -54,11 +57,32 @@ class AQIScheduler:
                 replace_existing=True
             )
             
+            # Job 3: Push daily averages from the local store to Supabase (retries failed syncs)
+            # and pull the rows other instances wrote
+            self.scheduler.add_job(
+                func=self._sync_local_store,
+                trigger=IntervalTrigger(minutes=15),
+                id='sync_local_store',
+                name='Sync Local AQI Store to Supabase',
+                replace_existing=True
+            )
+            
+            # One-off: backfill the local store with Supabase daily history
+            self.scheduler.add_job(
+                func=self._backfill_local_store,
+                trigger=DateTrigger(),
+                id='backfill_local_store',
+                name='Backfill Local AQI Store',
+                replace_existing=True
+            )
+            
             self.scheduler.start()
             self.is_running = True
             logger.info("AQI Scheduler started successfully")
             logger.info("  - Hourly data collection: Every hour at :00 IST")
             logger.info("  - Daily average calculation: Every day at 12:00 AM IST (midnight)")
+            logger.info("  - Local store sync with Supabase: Every 15 minutes")
+            logger.info("  - Forecast precomputation: 24h after each collection, all periods after daily averages")
             
             # Register shutdown handler
             atexit.register(lambda: self.shutdown())
@@ -75,6 +99,9 @@ class AQIScheduler:
             logger.info("Hourly AQI data collection completed")
         except Exception as e:
             logger.error(f"Error in hourly data collection: {e}")
+        
+        # 24h forecasts depend on the latest hour, so refresh them after every collection
+        self._precompute_forecasts(periods=("24h",))
     
     def _calculate_daily_averages(self):
         """Wrapper for daily average calculation"""
@@ -84,6 +111,32 @@ class AQIScheduler:
             logger.info("Daily average calculation completed")
         except Exception as e:
             logger.error(f"Error in daily average calculation: {e}")
+        
+        # Nightly forecast table, built from the averages just written
+        self._precompute_forecasts()
+    
+    def _precompute_forecasts(self, periods=forecasting.PERIODS):
+        """Wrapper for forecast precomputation"""
+        try:
+            logger.info(f"Starting forecast precomputation ({', '.join(periods)})...")
+            count = forecasting.precompute_forecasts(self.collector, periods)
+            logger.info(f"Forecast precomputation completed ({count} forecasts)")
+        except Exception as e:
+            logger.error(f"Error in forecast precomputation: {e}")
+    
+    def _sync_local_store(self):
+        """Wrapper for local store sync"""
+        try:
+            self.collector.sync_local_store()
+        except Exception as e:
+            logger.error(f"Error in local store sync: {e}")
+    
+    def _backfill_local_store(self):
+        """Wrapper for local store backfill"""
+        try:
+            self.collector.backfill_local_store()
+        except Exception as e:
+            logger.error(f"Error in local store backfill: {e}")
     
     def shutdown(self):
         """Shutdown the scheduler"""
@@ -107,6 +160,12 @@ class AQIScheduler:
         if not self.collector:
             self.collector = get_collector()
         self._calculate_daily_averages()
+    
+    def trigger_forecast_precompute(self):
+        """Manually trigger forecast precomputation"""
+        if not self.collector:
+            self.collector = get_collector()
+        self._precompute_forecasts()
 
 
 # Global scheduler instance
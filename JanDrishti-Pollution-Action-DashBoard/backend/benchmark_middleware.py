@@ -0,0 +1,122 @@
+"""
+Middleware Benchmark
+Compares requests/sec and p99 latency of an AQI read endpoint behind the
+middleware stack main.py used to mount (the BaseHTTPMiddleware CORS middleware
+only) and the stack it mounts now (response cache, conditional requests, rate
+limiter and pure-ASGI CORS), in-process (no network). The current stack needs
+the Redis settings used by chat_cache; --cors-only skips it and compares the
+two CORS implementations alone.
+
+Usage: python benchmark_middleware.py [--requests 5000] [--concurrency 50] [--cors-only]
+"""
+import argparse
+import asyncio
+import time
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+from middleware.cors import CORSHeaderMiddleware, ALLOW_METHODS
+from middleware.cache import CacheMiddleware
+from middleware.conditional import ConditionalRequestMiddleware
+from middleware.rate_limiter import RATE_LIMIT_POLICIES, RateLimitMiddleware
+
+# Middleware mounted by main.py, in its add_middleware order (innermost first)
+MOUNTED_MIDDLEWARE = [CacheMiddleware, ConditionalRequestMiddleware, RateLimitMiddleware, CORSHeaderMiddleware]
+
+
+class LegacyCORSHeaderMiddleware(BaseHTTPMiddleware):
+    """The previous BaseHTTPMiddleware implementation, kept for comparison"""
+    async def dispatch(self, request, call_next):
+        origin = request.headers.get("origin")
+        if request.method == "OPTIONS":
+            return Response(status_code=200, headers={"Access-Control-Allow-Origin": origin or "*"})
+
+        response = await call_next(request)
+        if origin:
+            response.headers["Access-Control-Allow-Origin"] = origin
+            response.headers["Access-Control-Allow-Credentials"] = "true"
+        else:
+            response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = ALLOW_METHODS
+        response.headers["Access-Control-Allow-Headers"] = "*"
+        response.headers["Access-Control-Expose-Headers"] = "*"
+        return response
+
+
+def build_app(middlewares) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    @app.get("/api/aqi/wards")
+    async def wards():
+        return {"wards": [{"ward_no": str(i), "aqi": 100 + i} for i in range(50)]}
+
+    for middleware in middlewares:
+        app.add_middleware(middleware)
+    return app
+
+
+async def run(app: FastAPI, path: str, total: int, concurrency: int) -> dict:
+    latencies = []
+    transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 12345))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm up
+        for _ in range(50):
+            await client.get(path, headers={"Origin": "http://localhost:3000"})
+
+        queue = asyncio.Queue()
+        for _ in range(total):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                started = time.perf_counter()
+                response = await client.get(path, headers={"Origin": "http://localhost:3000"})
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--cors-only", action="store_true", help="compare the CORS middleware alone (no Redis needed)")
+    args = parser.parse_args()
+
+    if args.cors_only:
+        stacks = [
+            ("BaseHTTPMiddleware CORS", [LegacyCORSHeaderMiddleware], "/api/ping"),
+            ("pure ASGI CORS", [CORSHeaderMiddleware], "/api/ping"),
+        ]
+    else:
+        # The benchmark client must not be throttled
+        RATE_LIMIT_POLICIES.default = {"requests": 10 ** 6, "window": 60}
+        stacks = [
+            ("previous stack (BaseHTTPMiddleware CORS)", [LegacyCORSHeaderMiddleware], "/api/aqi/wards"),
+            ("mounted stack (cache, conditional, rate limit, CORS)", MOUNTED_MIDDLEWARE, "/api/aqi/wards"),
+        ]
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}")
+    for name, middlewares, path in stacks:
+        result = asyncio.run(run(build_app(middlewares), path, args.requests, args.concurrency))
+        print(f"  {name:55s} {result['rps']:8.0f} req/s   p50 {result['p50_ms']:6.2f} ms   p99 {result['p99_ms']:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Cache Events
+Redis pub/sub channel announcing data changes to every worker.
+Writers publish "ward X updated" or "snapshot N published" with the tags of
+the data that changed; each process runs one subscriber thread that hands
+those tags to its listeners (the in-process response cache), so only the
+cached responses depending on that data are dropped.
+The last change time of every tag is also kept in Redis, so cached entries
+can be checked against it by workers that missed the event.
+"""
+import json
+import time
+import threading
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+from chat_cache import get_chat_cache
+
+logger = logging.getLogger(__name__)
+
+# Pub/sub channel for invalidation events
+CHANNEL = "cache:events"
+
+# Hash of tag -> epoch of its last change
+TAG_CHANGES_KEY = "cache:tag_changes"
+
+# Tag of the latest published AQI snapshot (the recompute job's aqi_cache record)
+SNAPSHOT_TAG = "snapshot"
+
+# Tag of the daily averages as a whole (any ward, any date)
+DAILY_TAG = "daily"
+
+# Tag of the citizen reports table
+REPORTS_TAG = "reports"
+
+# Seconds the subscriber waits before polling again after a connection error
+RECONNECT_DELAY = 1.0
+
+
+def ward_tag(ward_no) -> str:
+    """Tag of a ward's readings"""
+    return f"ward:{ward_no}"
+
+
+def daily_tag(ward_no) -> str:
+    """Tag of a ward's daily averages"""
+    return f"daily:{ward_no}"
+
+
+def date_tag(day) -> str:
+    """Tag of the daily averages of a date (date or YYYY-MM-DD)"""
+    return f"date:{day.isoformat() if hasattr(day, 'isoformat') else day}"
+
+
+def publish(redis_client, tags: Iterable[str], **info) -> bool:
+    """Record the change time of tags and publish an invalidation event; never fails the writer"""
+    tags = list(tags)
+    changed_at = time.time()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(TAG_CHANGES_KEY, mapping={tag: repr(changed_at) for tag in tags})
+        pipe.publish(CHANNEL, json.dumps({"tags": tags, "changed_at": changed_at, **info}))
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Could not publish cache event for {tags}: {e}")
+        return False
+
+
+def get_tag_changes(redis_client, tags: Iterable[str]) -> Dict[str, float]:
+    """Last change time of each tag that has changed: {tag: epoch}"""
+    tags = list(tags)
+    if not tags:
+        return {}
+    values = redis_client.hmget(TAG_CHANGES_KEY, tags)
+    return {tag: float(value) for tag, value in zip(tags, values) if value is not None}
+
+
+def publish_ward_updated(redis_client, ward_no) -> bool:
+    """Announce a new reading for a ward"""
+    return publish(redis_client, [ward_tag(ward_no)], event="ward_updated", ward_no=ward_no)
+
+
+def publish_daily_updated(redis_client, ward_no, day) -> bool:
+    """Announce a new or updated daily average for a ward and date"""
+    day = day.isoformat() if hasattr(day, "isoformat") else str(day)
+    return publish(
+        redis_client,
+        [DAILY_TAG, daily_tag(ward_no), date_tag(day)],
+        event="daily_updated",
+        ward_no=ward_no,
+        date=day
+    )
+
+
+def publish_reports_changed(redis_client, report_id) -> bool:
+    """Announce a created or updated report"""
+    return publish(redis_client, [REPORTS_TAG], event="report_changed", report_id=report_id)
+
+
+def publish_snapshot(redis_client, version) -> bool:
+    """Announce a newly published AQI snapshot"""
+    return publish(redis_client, [SNAPSHOT_TAG], event="snapshot_published", version=version)
+
+
+# Listener signature: listener(tags, event); tags is None when events may have been
+# missed (subscriber connection lost) and every cached entry should be dropped; the
+# reset sent after reconnecting carries the last change time of every tag as "changes"
+Listener = Callable[[Optional[List[str]], Dict], None]
+
+
+class CacheEventSubscriber:
+    def __init__(self, redis_client):
+        """Subscribe to the cache event channel on a Redis client"""
+        self.redis_client = redis_client
+        self._listeners: List[Listener] = []
+        self._lock = threading.Lock()
+        self._thread = None
+        # Set while subscribed; events may be missed while it is clear
+        self._connected = threading.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def add_listener(self, listener: Listener):
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def start(self):
+        """Start the subscriber thread once per process (raises if Redis is unreachable)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{CHANNEL: self._handle})
+            self._thread = pubsub.run_in_thread(
+                sleep_time=1.0,
+                daemon=True,
+                exception_handler=self._handle_error
+            )
+            self._connected.set()
+
+    def _dispatch(self, tags: Optional[List[str]], event: Dict):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(tags, event)
+            except Exception as e:
+                logger.warning(f"Cache event listener failed: {e}")
+
+    def _handle(self, message: Dict):
+        try:
+            event = json.loads(message["data"])
+            tags = [str(tag) for tag in event.get("tags", [])]
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Ignoring malformed cache event: {e}")
+            return
+        self._dispatch(tags, event)
+
+    def _handle_error(self, error: Exception, pubsub, thread):
+        # Events published while disconnected are lost: listeners stop caching until
+        # the subscription is back, then drop everything again and pick up the
+        # change times recorded while the connection was down
+        logger.warning(f"Cache event subscriber error: {error}")
+        self._connected.clear()
+        self._dispatch(None, {"event": "reset"})
+        time.sleep(RECONNECT_DELAY)
+        try:
+            # Reconnecting re-subscribes the channel before the PING is sent
+            pubsub.ping()
+            changes = {
+                tag: float(changed_at)
+                for tag, changed_at in self.redis_client.hgetall(TAG_CHANGES_KEY).items()
+            }
+        except Exception as e:
+            # Still down: the next poll fails and retries
+            logger.warning(f"Cache event subscriber could not reconnect: {e}")
+            return
+        self._dispatch(None, {"event": "reset", "changes": changes})
+        self._connected.set()
+        logger.info("Cache event subscriber reconnected")
+
+
+# Global instance
+_subscriber_instance = None
+
+def get_cache_event_subscriber() -> CacheEventSubscriber:
+    """Get or create the global cache event subscriber (on the chat cache Redis server)"""
+    global _subscriber_instance
+    if _subscriber_instance is None:
+        _subscriber_instance = CacheEventSubscriber(get_chat_cache().redis_client)
+    return _subscriber_instance
@@ -3,11 +3,14 @@ Redis-based Chat Cache and Optimization
 Provides fast chat history retrieval, session management, and rate limiting
 """
 import os
+import re
 import json
+import hashlib
 import redis
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
+from rate_limit import RateLimiter
 
 load_dotenv()
 
@@ -21,6 +24,25 @@ REDIS_USERNAME = os.getenv("REDIS_USERNAME", "default")  # Redis Cloud default u
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
 REDIS_SSL = os.getenv("REDIS_SSL", "false").lower() == "true"  # Enable SSL for Redis Cloud
 
+# Words dropped when normalizing questions for the answer cache
+QUESTION_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "be", "am", "i", "me", "my", "we", "you", "your",
+    "what", "whats", "how", "hows", "in", "at", "on", "of", "for", "to", "near", "around",
+    "please", "tell", "can", "could", "would", "do", "does", "current", "currently", "right", "now",
+    "like", "s", "today", "todays",
+}
+
+# Negation and modal words; they flip or change the meaning of a question, so they
+# are kept out of the similarity score and must match exactly
+QUESTION_POLARITY = {
+    "not", "no", "never", "nor", "without", "t", "dont", "don", "doesnt", "doesn", "isnt", "isn",
+    "arent", "aren", "cant", "cannot", "wont", "won", "shouldnt", "shouldn", "should", "must",
+    "may", "might", "shall", "need", "ought",
+}
+
+# Questions that refer back to the conversation are never answered from the cache
+QUESTION_ANAPHORA = {"that", "this", "there", "they", "them", "those", "these", "above", "previous", "earlier", "again", "else"}
+
 class ChatCache:
     def __init__(self):
         """Initialize Redis client for chat caching"""
@@ -85,15 +107,39 @@ class ChatCache:
         
         # Configuration
         self.CACHE_TTL = 3600 * 24  # 24 hours
-        self.RECENT_MESSAGES_COUNT = 50  # Cache last 50 messages
+        self.RECENT_MESSAGES_COUNT = 200  # Cache last 200 messages (one contiguous window per user)
+        self.HISTORY_TIE_SLACK = 10  # extra entries read to order messages sharing a timestamp
         self.SESSION_TTL = 3600 * 2  # 2 hours for active sessions
         self.RATE_LIMIT_WINDOW = 60  # 1 minute
         self.RATE_LIMIT_MAX = 10  # 10 messages per minute
+        self.ANSWER_TTL = 3600  # cached answers never outlive the hourly AQI ingest
+        self.ANSWER_RECENT_COUNT = 50  # recent answers per bucket checked for similar questions
+        self.ANSWER_SIMILARITY = 0.8  # trigram Jaccard similarity needed to reuse an answer
+        
+        # Atomic GCRA limiter shared with the HTTP rate limit middleware
+        self.rate_limiter = RateLimiter(self.redis_client)
+        
+        self._binary_client = None
+    
+    @property
+    def binary_client(self) -> redis.Redis:
+        """Redis client on the same server that returns raw bytes (for cached response bodies)"""
+        if self._binary_client is None:
+            pool = self.redis_client.connection_pool
+            self._binary_client = redis.Redis(connection_pool=redis.ConnectionPool(
+                connection_class=pool.connection_class,
+                **{**pool.connection_kwargs, "decode_responses": False}
+            ))
+        return self._binary_client
     
     def _get_user_chat_key(self, user_id: str) -> str:
         """Get Redis key for user's chat history"""
         return f"chat:history:{user_id}"
     
+    def _get_history_start_key(self, user_id: str) -> str:
+        """Get Redis key marking that the cached history reaches the user's first message"""
+        return f"chat:history_start:{user_id}"
+    
     def _get_user_session_key(self, user_id: str) -> str:
         """Get Redis key for user's active session"""
         return f"chat:session:{user_id}"
@@ -102,91 +148,150 @@ class ChatCache:
         """Get Redis key for rate limiting"""
         return f"chat:ratelimit:{user_id}"
     
-    def _get_message_key(self, message_id: str) -> str:
-        """Get Redis key for individual message"""
-        return f"chat:message:{message_id}"
-    
     def _get_conversation_summary_key(self, user_id: str) -> str:
         """Get Redis key for conversation summary"""
         return f"chat:summary:{user_id}"
     
+    def _get_answer_key(self, bucket: str, question: str) -> str:
+        """Get Redis key for a cached answer"""
+        return f"chat:answer:{bucket}:{hashlib.md5(question.encode()).hexdigest()}"
+    
+    def _get_answer_index_key(self, bucket: str) -> str:
+        """Get Redis key for the recent answers of a bucket"""
+        return f"chat:answers:{bucket}"
+    
+    @staticmethod
+    def _message_score(message: Dict) -> float:
+        """Sorted-set score of a message (its created_at timestamp)"""
+        return datetime.fromisoformat(message.get("created_at", datetime.now().isoformat())).timestamp()
+    
+    @classmethod
+    def message_cursor(cls, message: Dict) -> Tuple[float, str]:
+        """(score, id) position of a message; history is ordered by it, newest first"""
+        return cls._message_score(message), str(message.get("id", ""))
+    
     def cache_message(self, user_id: str, message: Dict):
+        """Cache a single message in the user's recent messages sorted set"""
+        return self.cache_messages_batch(user_id, [message])
+    
+    def get_cached_messages(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
         """
-        Cache a single message in Redis
-        Also adds to user's recent messages list
+        Get cached messages for a user
+        Returns messages sorted by timestamp (newest first), skipping the newest `offset`
         """
         try:
-            message_id = message.get("id", str(datetime.now().timestamp()))
-            message_key = self._get_message_key(message_id)
-            
-            # Store individual message
-            self.redis_client.setex(
-                message_key,
-                self.CACHE_TTL,
-                json.dumps(message)
-            )
-            
-            # Add to user's recent messages list (sorted set by timestamp)
             user_chat_key = self._get_user_chat_key(user_id)
-            timestamp = datetime.fromisoformat(message.get("created_at", datetime.now().isoformat())).timestamp()
-            
-            self.redis_client.zadd(
-                user_chat_key,
-                {json.dumps(message): timestamp}
-            )
             
-            # Keep only recent N messages in cache
-            self.redis_client.zremrangebyrank(
+            # Get recent messages (sorted by timestamp, descending)
+            messages_json = self.redis_client.zrevrange(
                 user_chat_key,
-                0,
-                -(self.RECENT_MESSAGES_COUNT + 1)
+                offset,
+                offset + limit - 1
             )
             
-            # Set expiry on the sorted set
-            self.redis_client.expire(user_chat_key, self.CACHE_TTL)
+            messages = []
+            for msg_json in messages_json:
+                try:
+                    messages.append(json.loads(msg_json))
+                except json.JSONDecodeError:
+                    continue
             
-            return True
+            return messages
         except Exception as e:
-            print(f"Error caching message: {e}")
-            return False
+            print(f"Error getting cached messages: {e}")
+            return []
     
-    def get_cached_messages(self, user_id: str, limit: int = 50) -> List[Dict]:
+    def get_messages_before(
+        self,
+        user_id: str,
+        limit: int = 50,
+        before: Optional[Tuple[float, str]] = None
+    ) -> Tuple[List[Dict], Optional[Tuple[float, str]], bool]:
         """
-        Get cached messages for a user
-        Returns messages sorted by timestamp (newest first)
+        Get cached messages older than a (score, id) cursor, newest first.
+        Also returns the cursor of the oldest cached message and whether the cache
+        reaches the user's first message, so callers know which range it covers:
+        the cached set holds every message newer than its oldest one.
         """
         try:
             user_chat_key = self._get_user_chat_key(user_id)
             
-            # Get recent messages (sorted by timestamp, descending)
-            messages_json = self.redis_client.zrevrange(
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.zrevrangebyscore(
                 user_chat_key,
-                0,
-                limit - 1
+                before[0] if before else "+inf",
+                "-inf",
+                start=0,
+                num=limit + self.HISTORY_TIE_SLACK,
+                withscores=True
             )
+            pipe.zrange(user_chat_key, 0, 0, withscores=True)
+            pipe.exists(self._get_history_start_key(user_id))
+            page, oldest, has_start = pipe.execute()
             
-            messages = []
-            for msg_json in messages_json:
+            entries = []
+            for msg_json, score in page:
                 try:
-                    messages.append(json.loads(msg_json))
+                    message = json.loads(msg_json)
                 except json.JSONDecodeError:
                     continue
+                cursor = (score, str(message.get("id", "")))
+                # Messages sharing the cursor's timestamp are ordered by id
+                if before is None or cursor < before:
+                    entries.append((cursor, message))
+            entries.sort(key=lambda entry: entry[0], reverse=True)
             
-            return messages
+            floor = None
+            if oldest:
+                oldest_json, oldest_score = oldest[0]
+                floor = (oldest_score, str(json.loads(oldest_json).get("id", "")))
+            
+            return [message for _, message in entries[:limit]], floor, bool(has_start)
         except Exception as e:
             print(f"Error getting cached messages: {e}")
-            return []
+            return [], None, False
     
-    def cache_messages_batch(self, user_id: str, messages: List[Dict]):
-        """Cache multiple messages at once"""
-        for message in messages:
-            self.cache_message(user_id, message)
+    def cache_messages_batch(self, user_id: str, messages: List[Dict], reached_start: bool = False):
+        """
+        Cache multiple messages at once
+        The whole page is written in one pipeline (ZADD, trim, EXPIRE).
+        Pages must be contiguous with the cached window (newer messages or the
+        page right below it); reached_start marks that the page ends at the
+        user's first message.
+        """
+        try:
+            user_chat_key = self._get_user_chat_key(user_id)
+            start_key = self._get_history_start_key(user_id)
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            if messages:
+                pipe.zadd(
+                    user_chat_key,
+                    {json.dumps(message): self._message_score(message) for message in messages}
+                )
+            if reached_start:
+                pipe.set(start_key, 1)
+            # Keep only recent N messages in cache
+            pipe.zremrangebyrank(user_chat_key, 0, -(self.RECENT_MESSAGES_COUNT + 1))
+            pipe.expire(user_chat_key, self.CACHE_TTL)
+            pipe.expire(start_key, self.CACHE_TTL)
+            results = pipe.execute()
+            
+            # Trimming drops the oldest messages, so the cache no longer reaches the first one
+            if results[-3]:
+                self.redis_client.delete(start_key)
+            
+            return True
+        except Exception as e:
+            print(f"Error caching messages: {e}")
+            return False
     
     def invalidate_user_cache(self, user_id: str):
         """Clear all cached data for a user"""
         try:
             keys_to_delete = [
                 self._get_user_chat_key(user_id),
+                self._get_history_start_key(user_id),
                 self._get_user_session_key(user_id),
                 self._get_conversation_summary_key(user_id),
             ]
@@ -232,38 +337,34 @@ class ChatCache:
             print(f"Error getting session: {e}")
             return None
     
-    def check_rate_limit(self, user_id: str) -> Tuple[bool, int]:
+    def check_rate_limit(self, user_id: str, consume: bool = True) -> Tuple[bool, int]:
         """
-        Check if user has exceeded rate limit
-        Returns (is_allowed, remaining_requests)
+        Check if user has exceeded rate limit (one atomic Redis call)
+        Returns (is_allowed, remaining_requests); consume=False only reports the status
         """
         try:
-            rate_limit_key = self._get_rate_limit_key(user_id)
-            current_count = self.redis_client.get(rate_limit_key)
-            
-            if current_count is None:
-                # First request in this window
-                self.redis_client.setex(rate_limit_key, self.RATE_LIMIT_WINDOW, "1")
-                return True, self.RATE_LIMIT_MAX - 1
-            else:
-                count = int(current_count)
-                if count >= self.RATE_LIMIT_MAX:
-                    return False, 0
-                else:
-                    # Increment counter
-                    self.redis_client.incr(rate_limit_key)
-                    return True, self.RATE_LIMIT_MAX - count - 1
+            result = self.rate_limiter.check(
+                self._get_rate_limit_key(user_id),
+                self.RATE_LIMIT_MAX,
+                self.RATE_LIMIT_WINDOW,
+                cost=1 if consume else 0
+            )
+            return result.allowed, result.remaining
         except Exception as e:
             print(f"Error checking rate limit: {e}")
             # On error, allow the request
             return True, self.RATE_LIMIT_MAX
     
-    def cache_conversation_summary(self, user_id: str, summary: str):
-        """Cache a summary of the conversation for context"""
+    def cache_conversation_summary(self, user_id: str, summary: str, through: Optional[float] = None):
+        """
+        Cache a summary of the conversation for context
+        through: timestamp of the newest message the summary covers
+        """
         try:
             summary_key = self._get_conversation_summary_key(user_id)
             summary_data = {
                 "summary": summary,
+                "through": through,
                 "updated_at": datetime.now().isoformat()
             }
             
@@ -280,18 +381,97 @@ class ChatCache:
     
     def get_conversation_summary(self, user_id: str) -> Optional[str]:
         """Get cached conversation summary"""
+        data = self.get_conversation_summary_data(user_id)
+        return data.get("summary") if data else None
+    
+    def get_conversation_summary_data(self, user_id: str) -> Optional[Dict]:
+        """Get cached conversation summary with its metadata (summary, through, updated_at)"""
         try:
             summary_key = self._get_conversation_summary_key(user_id)
             summary_json = self.redis_client.get(summary_key)
             
             if summary_json:
-                data = json.loads(summary_json)
-                return data.get("summary")
+                return json.loads(summary_json)
             return None
         except Exception as e:
             print(f"Error getting summary: {e}")
             return None
     
+    @staticmethod
+    def normalize_question(message: str, exclude_tokens=()) -> Optional[str]:
+        """
+        Normalize a question for the answer cache: lowercase, drop punctuation,
+        stopwords and excluded tokens (e.g. the ward name), sort the rest.
+        Returns None for questions that should not be cached.
+        """
+        tokens = re.sub(r"[^a-z0-9]+", " ", message.lower()).split()
+        if any(token in QUESTION_ANAPHORA for token in tokens):
+            return None
+        excluded = set(exclude_tokens)
+        tokens = sorted({t for t in tokens if t not in QUESTION_STOPWORDS and t not in excluded})
+        if not tokens or len(" ".join(tokens)) < 3:
+            return None
+        return " ".join(tokens)
+    
+    @staticmethod
+    def _split_polarity(question: str) -> Tuple[frozenset, str]:
+        """Negation/modal words of a normalized question and the rest of it"""
+        tokens = question.split()
+        polarity = frozenset(t for t in tokens if t in QUESTION_POLARITY)
+        return polarity, " ".join(t for t in tokens if t not in QUESTION_POLARITY)
+    
+    @staticmethod
+    def _trigrams(text: str) -> set:
+        padded = f"  {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def get_cached_answer(self, bucket: str, question: str) -> Optional[str]:
+        """
+        Get a cached answer for a normalized question in a bucket
+        (ward + AQI band + data version). Falls back to the most similar
+        recent question in the bucket by trigram similarity; negation and modal
+        words are not scored and must be the same in both questions.
+        """
+        try:
+            answer = self.redis_client.get(self._get_answer_key(bucket, question))
+            if answer is not None:
+                return answer
+            
+            polarity, content = self._split_polarity(question)
+            question_trigrams = self._trigrams(content)
+            best_score, best_answer = 0.0, None
+            for entry_json in self.redis_client.lrange(self._get_answer_index_key(bucket), 0, -1):
+                entry = json.loads(entry_json)
+                entry_polarity, entry_content = self._split_polarity(entry["question"])
+                if entry_polarity != polarity:
+                    continue
+                trigrams = self._trigrams(entry_content)
+                score = len(question_trigrams & trigrams) / len(question_trigrams | trigrams)
+                if score > best_score:
+                    best_score, best_answer = score, entry["answer"]
+            
+            return best_answer if best_score >= self.ANSWER_SIMILARITY else None
+        except Exception as e:
+            print(f"Error getting cached answer: {e}")
+            return None
+    
+    def cache_answer(self, bucket: str, question: str, answer: str, ttl: Optional[int] = None):
+        """Cache an answer for a normalized question in a bucket"""
+        try:
+            ttl = max(1, min(ttl or self.ANSWER_TTL, self.ANSWER_TTL))
+            index_key = self._get_answer_index_key(bucket)
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.setex(self._get_answer_key(bucket, question), ttl, answer)
+            pipe.lpush(index_key, json.dumps({"question": question, "answer": answer}))
+            pipe.ltrim(index_key, 0, self.ANSWER_RECENT_COUNT - 1)
+            pipe.expire(index_key, ttl)
+            pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Error caching answer: {e}")
+            return False
+    
     def get_conversation_context(self, user_id: str, max_messages: int = 10) -> List[Dict]:
         """
         Get recent conversation context for AI
@@ -0,0 +1,81 @@
+"""
+Chatbot AQI Context
+Renders the real-time AQI block of chatbot prompts from the collector's
+latest-reading index: one bulk Redis read, no WAQI calls inline.
+Rendered blocks are cached per index version, so they are rebuilt only after
+new readings are written.
+"""
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cap on wards listed when a question does not name one
+MAX_CONTEXT_WARDS = 50
+
+REAL_DATA_NOTE = "Use this REAL data to answer the user's question. Do NOT say you don't have access to real-time data."
+
+_cache: Dict[Tuple, str] = {}
+_cache_version: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def _cached(collector, key: Tuple, render) -> str:
+    """Return the block for key at the current index version, rendering it on a miss"""
+    global _cache_version
+    version = collector.get_latest_version()
+    with _cache_lock:
+        if version != _cache_version:
+            _cache.clear()
+            _cache_version = version
+        if key in _cache:
+            return _cache[key]
+
+    text = render()
+    with _cache_lock:
+        if version == _cache_version:
+            _cache[key] = text
+    return text
+
+
+def _render_ward(reading: Dict) -> str:
+    return f"""
+REAL-TIME AQI DATA FOR {reading.get('ward_name') or 'WARD'} (Ward {reading.get('ward_no')}):
+- Current AQI: {reading.get('aqi', 'N/A')}
+- PM2.5: {reading.get('pm25', 'N/A')} µg/m³
+- PM10: {reading.get('pm10', 'N/A')} µg/m³
+- NO2: {reading.get('no2', 'N/A')} µg/m³
+- O3: {reading.get('o3', 'N/A')} µg/m³
+- Last Updated: {reading.get('timestamp', 'Unknown')}
+- Data Source: Redis (hourly data)
+
+{REAL_DATA_NOTE}
+"""
+
+
+def build_ward_context(collector, ward_no: str) -> str:
+    """AQI block for one ward, or an empty string if it has no recent reading"""
+    def render():
+        reading = collector.get_latest_ward_data(ward_no)
+        return _render_ward(reading) if reading else ""
+    return _cached(collector, ("ward", ward_no), render)
+
+
+def build_all_wards_context(collector, max_wards: int = MAX_CONTEXT_WARDS) -> str:
+    """AQI block listing the monitored wards, or an empty string if there are no readings"""
+    def render():
+        readings = collector.get_latest_readings()
+        lines = []
+        for ward in collector.selected_wards[:max_wards]:
+            reading = readings.get(ward.get("ward_no"))
+            if reading:
+                lines.append(
+                    f"- {reading.get('ward_name')} (Ward {reading.get('ward_no')}): AQI {reading.get('aqi', 'N/A')} | "
+                    f"PM2.5: {reading.get('pm25', 'N/A')} | PM10: {reading.get('pm10', 'N/A')} | "
+                    f"NO2: {reading.get('no2', 'N/A')} | O3: {reading.get('o3', 'N/A')} µg/m³"
+                )
+        if not lines:
+            return ""
+        return "\nREAL-TIME AQI DATA FOR ALL MONITORED WARDS:\n" + "\n".join(lines) + f"\n\n{REAL_DATA_NOTE}\n"
+    return _cached(collector, ("all", max_wards), render)
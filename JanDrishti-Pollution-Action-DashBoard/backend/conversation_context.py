@@ -0,0 +1,149 @@
+"""
+Conversation Context
+Token-budgeted chat history for chatbot prompts.
+The newest turns are sent verbatim while they fit the budget; older turns are
+folded into a rolling summary stored under the chat cache's summary key.
+The summary is refreshed in the background after replies, never inline.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Token budget for history (summary + verbatim turns) per request
+HISTORY_TOKEN_BUDGET = 800
+# Most recent messages considered for verbatim history
+RECENT_MESSAGES = 10
+# Messages read when refreshing the summary: the verbatim window plus older turns not yet folded in
+SUMMARY_FETCH_MESSAGES = RECENT_MESSAGES + 20
+# Length cap for the rolling summary
+SUMMARY_MAX_TOKENS = 200
+# Rough characters per token for English text
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and JanDrishti's air quality assistant.
+Update the existing summary with the new turns. Keep facts the assistant may need later: wards and places the user asked about,
+their health concerns, plans and preferences, and key answers given. Write at most 120 words of plain prose, no preamble."""
+
+_refreshing: Set[str] = set()
+_tasks: Set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Approximate token count of a text"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+def _turn_tokens(message: Dict) -> int:
+    # A few tokens of per-message overhead for the role wrappers
+    return estimate_tokens(message.get("user_message")) + estimate_tokens(message.get("bot_response")) + 8
+
+
+def _message_timestamp(message: Dict) -> float:
+    try:
+        return datetime.fromisoformat(str(message.get("created_at")).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _truncate(text: Optional[str], max_tokens: int) -> Optional[str]:
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(0, max_tokens * CHARS_PER_TOKEN - 3)] + "..."
+
+
+def _split_history(messages: List[Dict], budget: int, max_recent: int = RECENT_MESSAGES) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Split chronological messages into (older, recent) where recent is the
+    longest suffix of at most max_recent messages that fits the budget.
+    The newest turn is always kept, truncated if it alone exceeds the budget.
+    """
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, max(-1, len(messages) - 1 - max_recent), -1):
+        tokens = _turn_tokens(messages[i])
+        if used + tokens > budget:
+            break
+        used += tokens
+        start = i
+
+    if start == len(messages) and messages:
+        newest = dict(messages[-1])
+        half = max(1, budget // 2)
+        newest["user_message"] = _truncate(newest.get("user_message"), half)
+        newest["bot_response"] = _truncate(newest.get("bot_response"), half)
+        return messages[:-1], [newest]
+    return messages[:start], messages[start:]
+
+
+def build_history(chat_cache, user_id: str, budget: int = HISTORY_TOKEN_BUDGET) -> Tuple[Optional[str], List[Dict]]:
+    """
+    History for a prompt as (summary, recent messages oldest first).
+    The summary's tokens count against the budget; the remainder goes to verbatim turns.
+    """
+    messages = chat_cache.get_conversation_context(user_id, max_messages=RECENT_MESSAGES)
+    summary = chat_cache.get_conversation_summary(user_id)
+    summary = _truncate(summary, SUMMARY_MAX_TOKENS)
+
+    _, recent = _split_history(messages, max(0, budget - estimate_tokens(summary)))
+    return summary, recent
+
+
+async def refresh_summary(llm_gateway, chat_cache, user_id: str, budget: int = HISTORY_TOKEN_BUDGET) -> bool:
+    """
+    Fold turns that no longer fit the verbatim window (by message count or tokens)
+    into the rolling summary. Returns True if the summary was updated.
+    """
+    messages = chat_cache.get_conversation_context(user_id, max_messages=SUMMARY_FETCH_MESSAGES)
+    state = chat_cache.get_conversation_summary_data(user_id) or {}
+    summary = state.get("summary") or ""
+    through = state.get("through") or 0.0
+
+    # Leave room for the summary itself so the next prompt still fits the budget
+    older, _ = _split_history(messages, max(0, budget - SUMMARY_MAX_TOKENS))
+    pending = [m for m in older if _message_timestamp(m) > through]
+    if not pending:
+        return False
+
+    turns = "\n".join(
+        f"User: {_truncate(m.get('user_message'), 150)}\nAssistant: {_truncate(m.get('bot_response'), 150)}"
+        for m in pending
+    )
+    updated = await llm_gateway.complete(
+        [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew turns:\n{turns}"},
+        ],
+        temperature=0.2,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        use_cache=False,
+    )
+    if not updated:
+        return False
+
+    chat_cache.cache_conversation_summary(
+        user_id, updated.strip(), through=max(_message_timestamp(m) for m in pending)
+    )
+    return True
+
+
+def schedule_summary_refresh(llm_gateway, chat_cache, user_id: str):
+    """Refresh the user's summary in the background (at most one refresh per user at a time)"""
+    if not user_id or user_id in _refreshing:
+        return
+
+    async def run():
+        try:
+            await refresh_summary(llm_gateway, chat_cache, user_id)
+        except Exception as e:
+            logger.warning(f"Conversation summary refresh failed for {user_id}: {e}")
+        finally:
+            _refreshing.discard(user_id)
+
+    _refreshing.add(user_id)
+    # Keep a reference so the task is not garbage collected mid-run
+    task = asyncio.get_running_loop().create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
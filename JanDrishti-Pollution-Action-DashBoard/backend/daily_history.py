@@ -0,0 +1,260 @@
+"""
+Daily AQI History Service
+Reads ward_aqi_daily with column projection, keyset pagination on (date, ward_no)
+and an in-process cache keyed by the normalized query.
+Served from the local analytical store when it covers the requested range.
+Closed days never change, so their pages are cached indefinitely (LRU-bounded);
+pages that can still include the open day get a short TTL.
+"""
+import os
+import re
+import base64
+import time
+import threading
+import logging
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from local_store import get_local_store, DAILY_COLUMNS as LOCAL_DAILY_COLUMNS
+from cache_events import DAILY_TAG, get_cache_event_subscriber
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# Columns returned by default - what the charts actually use
+DEFAULT_COLUMNS = (
+    "ward_no", "ward_name", "date",
+    "avg_aqi", "min_aqi", "max_aqi",
+    "avg_pm25", "avg_pm10", "avg_no2", "avg_o3",
+    "hourly_readings_count",
+)
+
+# Columns that may be requested explicitly via `fields`
+ALLOWED_COLUMNS = DEFAULT_COLUMNS + (
+    "id", "quadrant", "latitude", "longitude", "created_at", "updated_at",
+)
+
+# Keyset columns are always selected so a next cursor can be built
+KEYSET_COLUMNS = ("date", "ward_no")
+
+# Ward numbers accepted in cursors
+WARD_NO_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+
+class DailyHistoryService:
+    def __init__(self):
+        """Initialize Supabase client and the query cache"""
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set")
+
+        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+        # Configuration
+        self.OPEN_DAY_TTL = 60  # 1 minute for pages that may include the open day
+        self.MAX_CACHE_ENTRIES = 1024
+        self.MAX_PAGE_SIZE = 1000
+
+        self._cache: "OrderedDict[Tuple, Tuple[Optional[float], Dict]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Query normalization
+    # ------------------------------------------------------------------
+    @staticmethod
+    def parse_columns(fields: Optional[str]) -> Tuple[str, ...]:
+        """Parse a comma-separated `fields` parameter into a validated column tuple"""
+        if not fields:
+            return DEFAULT_COLUMNS
+
+        columns = []
+        for column in fields.split(","):
+            column = column.strip()
+            if not column:
+                continue
+            if column not in ALLOWED_COLUMNS:
+                raise ValueError(f"Unknown field '{column}'. Allowed fields: {', '.join(ALLOWED_COLUMNS)}")
+            if column not in columns:
+                columns.append(column)
+        return tuple(columns) or DEFAULT_COLUMNS
+
+    @staticmethod
+    def encode_cursor(row: Dict) -> str:
+        """Encode the keyset position of a row as an opaque cursor"""
+        raw = f"{row['date']}|{row['ward_no']}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        """Decode a cursor into its (date, ward_no) keyset position"""
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            cursor_date, ward_no = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+            # Both parts end up in a PostgREST filter, so only well-formed values are accepted
+            cursor_date = date.fromisoformat(cursor_date).isoformat()
+            if not WARD_NO_PATTERN.fullmatch(ward_no):
+                raise ValueError(ward_no)
+            return cursor_date, ward_no
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def _latest_open_date() -> date:
+        """
+        Earliest date that can still change.
+        Yesterday's averages are written by the midnight job, so it counts as open too.
+        """
+        return date.today() - timedelta(days=1)
+
+    def _is_closed(self, start_date: Optional[str], end_date: Optional[str],
+                   cursor_date: Optional[str]) -> bool:
+        """Whether every row a query can return belongs to a closed (immutable) day"""
+        upper_bounds = [d for d in (end_date, cursor_date) if d]
+        if not upper_bounds:
+            return False
+        upper = min(date.fromisoformat(d) for d in upper_bounds)
+        return upper < self._latest_open_date()
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+    def _cache_get(self, key: Tuple) -> Optional[Dict]:
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return result
+
+    def _cache_set(self, key: Tuple, result: Dict, ttl: Optional[int]):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._cache_lock:
+            self._cache[key] = (expires_at, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.MAX_CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        """Drop all cached pages"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def handle_cache_event(self, tags: Optional[List[str]], event: Dict):
+        """Drop cached pages when a daily average is written (or events may have been missed)"""
+        if tags is None or DAILY_TAG in tags:
+            self.clear_cache()
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def _query_supabase(self, select_columns, ward_no, start_date, end_date,
+                        limit, cursor_date, cursor_ward) -> List[Dict]:
+        """Run the history query against ward_aqi_daily in Supabase"""
+        query = self.supabase.table("ward_aqi_daily").select(",".join(select_columns))
+
+        if ward_no:
+            query = query.eq("ward_no", ward_no)
+        if start_date:
+            query = query.gte("date", start_date)
+        if end_date:
+            query = query.lte("date", end_date)
+        if cursor_date:
+            # Keyset: rows strictly after (cursor_date, cursor_ward) in (date DESC, ward_no ASC) order
+            query = query.or_(
+                f'date.lt."{cursor_date}",and(date.eq."{cursor_date}",ward_no.gt."{cursor_ward}")'
+            )
+
+        query = query.order("date", desc=True).order("ward_no")
+        if limit is not None:
+            query = query.limit(limit)
+
+        return query.execute().data or []
+
+    def query(
+        self,
+        ward_no: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        columns: Sequence[str] = DEFAULT_COLUMNS,
+        limit: Optional[int] = 100,
+        cursor: Optional[str] = None,
+    ) -> Dict:
+        """
+        Get daily history rows ordered by (date DESC, ward_no ASC).
+        Returns {"rows": [...], "next_cursor": str | None}.
+        Pass the returned cursor back to continue after the last row of a page.
+        """
+        for value in (start_date, end_date):
+            if value:
+                date.fromisoformat(value)  # raises ValueError on bad input
+
+        if limit is not None:
+            limit = max(1, min(int(limit), self.MAX_PAGE_SIZE))
+
+        columns = tuple(columns)
+        cursor_date, cursor_ward = self.decode_cursor(cursor) if cursor else (None, None)
+
+        key = (ward_no, start_date, end_date, columns, limit, cursor_date, cursor_ward)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        select_columns = list(columns) + [c for c in KEYSET_COLUMNS if c not in columns]
+        
+        local_store = get_local_store()
+        if (local_store and all(c in LOCAL_DAILY_COLUMNS for c in select_columns)
+                and local_store.covers_daily(self.supabase)):
+            rows = local_store.query_daily(
+                select_columns,
+                ward_no=ward_no,
+                start_date=start_date,
+                end_date=end_date,
+                limit=limit,
+                cursor=(cursor_date, cursor_ward) if cursor_date else None
+            )
+        else:
+            rows = self._query_supabase(select_columns, ward_no, start_date, end_date, limit, cursor_date, cursor_ward)
+
+        next_cursor = None
+        if limit is not None and len(rows) == limit:
+            next_cursor = self.encode_cursor(rows[-1])
+
+        # Drop keyset columns that were only selected for the cursor
+        extra = [c for c in KEYSET_COLUMNS if c not in columns]
+        if extra:
+            rows = [{k: v for k, v in row.items() if k not in extra} for row in rows]
+
+        result = {"rows": rows, "next_cursor": next_cursor}
+        ttl = None if self._is_closed(start_date, end_date, cursor_date) else self.OPEN_DAY_TTL
+        self._cache_set(key, result, ttl)
+        return result
+
+
+# Global instance
+_daily_history_instance = None
+_daily_history_lock = threading.Lock()
+
+def get_daily_history_service() -> DailyHistoryService:
+    """Get or create the global daily history service instance"""
+    global _daily_history_instance
+    if _daily_history_instance is None:
+        with _daily_history_lock:
+            if _daily_history_instance is None:
+                _daily_history_instance = DailyHistoryService()
+                # Cached responses built from these pages are refreshed on the same events
+                try:
+                    subscriber = get_cache_event_subscriber()
+                    subscriber.add_listener(_daily_history_instance.handle_cache_event)
+                    subscriber.start()
+                except Exception as e:
+                    logger.warning(f"Daily history cache not subscribed to cache events: {e}")
+    return _daily_history_instance
@@ -0,0 +1,484 @@
+"""
+Statistical AQI Forecasting
+Seasonal-naive and damped Holt-Winters (additive ETS) models in NumPy, with an
+empirical quantile band for confidence. Hourly history uses daily seasonality
+(24 hours); daily history uses weekly seasonality (7 days).
+Models run on a matrix of series at once, so every ward x metric of a period
+that covers the same span is fitted in one pass. Forecasts are precomputed by the scheduler and stored in
+Redis and Supabase; the endpoint serves the stored result.
+"""
+import json
+import time
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import aqi_export
+from daily_history import get_daily_history_service
+
+logger = logging.getLogger(__name__)
+
+IST_OFFSET_SECONDS = 5 * 3600 + 30 * 60
+
+PERIODS = ("24h", "7d", "30d")
+METRICS = ("aqi", "pm25", "pm10", "no2", "o3")
+
+PERIOD_CONFIG = {
+    "24h": {"horizon": 24, "season": 24, "granularity": "hourly"},
+    "7d": {"horizon": 7, "season": 7, "granularity": "daily"},
+    "30d": {"horizon": 30, "season": 7, "granularity": "daily"},
+}
+
+# Small smoothing grid - enough to adapt to each ward without slow fitting
+ALPHAS = (0.2, 0.5, 0.8)
+BETAS = (0.0, 0.1)
+GAMMAS = (0.1, 0.3)
+PHI = 0.9  # trend damping keeps 30-day forecasts from running away
+
+# Prediction band quantiles
+LOWER_QUANTILE = 0.1
+UPPER_QUANTILE = 0.9
+
+# History window fed to the models, per period
+HISTORY_DAYS = {"24h": 7, "7d": 30, "30d": 90}
+
+# Precomputed forecasts: 24h is refreshed hourly, 7d/30d nightly
+FORECAST_TABLE = "ward_aqi_forecasts"
+FORECAST_MAX_AGE = {"24h": 3 * 3600, "7d": 2 * 86400, "30d": 2 * 86400}
+
+DAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+# ----------------------------------------------------------------------
+# History
+# ----------------------------------------------------------------------
+def load_forecast_history(collector, ward_no: str, period: str) -> List[Dict]:
+    """
+    Load the history a period is forecast from.
+    24h uses hourly readings (local store, then Redis); 7d/30d use daily averages
+    (history service, then daily averages rebuilt from Redis hourly data).
+    """
+    days = HISTORY_DAYS[period]
+    today = date.today()
+
+    if PERIOD_CONFIG[period]["granularity"] == "hourly":
+        history = []
+        if collector.local_store:
+            since_epoch = int(time.time()) - days * 86400
+            history = collector.local_store.get_hourly_range(ward_no, since_epoch)
+        if not history:
+            for i in range(days):
+                history.extend(collector.get_hourly_data_from_redis(ward_no, today - timedelta(days=i)))
+        return history
+
+    try:
+        return get_daily_history_service().query(ward_no=ward_no, limit=days)["rows"]
+    except Exception as e:
+        logger.warning(f"Could not fetch daily history for ward {ward_no}: {e}")
+
+    history = []
+    for i in range(days):
+        target_date = today - timedelta(days=i)
+        daily_avg = collector.calculate_daily_average(collector.get_hourly_data_from_redis(ward_no, target_date))
+        if daily_avg:
+            history.append({"date": target_date.isoformat(), **daily_avg})
+    return history
+
+
+def load_forecast_histories(collector, period: str) -> Dict[str, List[Dict]]:
+    """
+    Load the history of every ward for a period with bulk, paged reads.
+    Returns {ward_no: rows}.
+    """
+    to_date = date.today()
+    from_date = to_date - timedelta(days=HISTORY_DAYS[period])
+    local_store = collector.local_store
+
+    if PERIOD_CONFIG[period]["granularity"] == "hourly":
+        if local_store:
+            chunks = aqi_export.iter_local_hourly(local_store, from_date, to_date, None)
+        else:
+            # Redis only keeps the last 2 days of hourly data
+            chunks = aqi_export.iter_redis_hourly(collector, to_date - timedelta(days=1), to_date, None)
+    elif local_store and local_store.covers_daily(collector.supabase):
+        chunks = aqi_export.iter_local_daily(local_store, from_date, to_date, None)
+    else:
+        chunks = aqi_export.iter_supabase_daily(collector.supabase, from_date, to_date, None)
+
+    histories: Dict[str, List[Dict]] = {}
+    for rows in chunks:
+        for row in rows:
+            histories.setdefault(str(row["ward_no"]), []).append(row)
+    return histories
+
+
+# ----------------------------------------------------------------------
+# Input preparation
+# ----------------------------------------------------------------------
+def _metric_value(row: Dict, metric: str) -> Optional[float]:
+    """Read a metric from an hourly reading (aqi) or a daily row (avg_aqi)"""
+    value = row.get(metric)
+    if value is None:
+        value = row.get(f"avg_{metric}")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _series_points(history: Iterable[Dict], metric: str, granularity: str) -> Dict[int, float]:
+    """
+    Map a history onto integer steps: hour buckets (epoch // 3600) for hourly
+    readings, date ordinals for daily rows. The latest reading wins within a step.
+    """
+    points: Dict[int, float] = {}
+    for row in history:
+        value = _metric_value(row, metric)
+        if value is None:
+            continue
+        if granularity == "hourly":
+            if row.get("epoch") is None:
+                continue
+            points[int(row["epoch"]) // 3600] = value
+        else:
+            if not row.get("date"):
+                continue
+            points[date.fromisoformat(str(row["date"])[:10]).toordinal()] = value
+    return points
+
+
+def _on_grid(points: Dict[int, float], grid: np.ndarray) -> np.ndarray:
+    """Place points on a regular grid, interpolating gaps and holding the edge values"""
+    steps = np.array(sorted(points))
+    return np.interp(grid, steps, [points[s] for s in steps])
+
+
+def _last_step_labels(granularity: str, last_step: int) -> Tuple[Optional[int], Optional[date]]:
+    if granularity == "hourly":
+        return last_step * 3600, None
+    return None, date.fromordinal(last_step)
+
+
+# ----------------------------------------------------------------------
+# Models (Y is a matrix of series: one row per series, oldest value first)
+# ----------------------------------------------------------------------
+def seasonal_naive(Y: np.ndarray, season: int, horizon: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Repeat the last season. Returns (forecast, one-step in-sample residuals)."""
+    if Y.shape[1] <= season:
+        season = 1
+    forecast = Y[:, [Y.shape[1] - season + (h % season) for h in range(horizon)]]
+    residuals = Y[:, season:] - Y[:, :-season]
+    return forecast, residuals
+
+
+def holt_winters_grid(Y: np.ndarray, season: int, horizon: int,
+                      phi: float = PHI) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Damped additive Holt-Winters, fitted for every (alpha, beta, gamma) in the
+    smoothing grid at once. Returns (forecast, residuals) shaped
+    (grid, series, horizon) and (grid, series, time - season).
+    """
+    grid = np.array([(a, b, g) for a in ALPHAS for b in BETAS for g in GAMMAS])
+    alpha, beta, gamma = (grid[:, i:i + 1] for i in range(3))  # (grid, 1) broadcasts over series
+
+    n = Y.shape[1]
+    level = np.broadcast_to(Y[:, :season].mean(axis=1), (len(grid), Y.shape[0])).copy()
+    trend = np.broadcast_to((Y[:, season:2 * season].mean(axis=1) - level[0]) / season, level.shape).copy()
+    seasonal = [np.broadcast_to(Y[:, i] - level[0], level.shape) for i in range(season)]
+
+    residuals = np.empty(level.shape + (n - season,))
+    for t in range(season, n):
+        s = seasonal[t - season]
+        residuals[:, :, t - season] = Y[:, t] - (level + phi * trend + s)
+
+        previous_level = level
+        level = alpha * (Y[:, t] - s) + (1 - alpha) * (level + phi * trend)
+        trend = beta * (level - previous_level) + (1 - beta) * phi * trend
+        seasonal.append(gamma * (Y[:, t] - level) + (1 - gamma) * s)
+
+    damping = np.cumsum(phi ** np.arange(1, horizon + 1))
+    forecast = np.stack([
+        level + damping[h] * trend + seasonal[n - season + (h % season)]
+        for h in range(horizon)
+    ], axis=-1)
+    return forecast, residuals
+
+
+def simple_exponential_smoothing(Y: np.ndarray, horizon: int, alpha: float = 0.5) -> Tuple[np.ndarray, np.ndarray]:
+    """Level-only smoothing for series shorter than two seasons"""
+    level = Y[:, 0].copy()
+    residuals = np.empty((Y.shape[0], Y.shape[1] - 1))
+    for t in range(1, Y.shape[1]):
+        residuals[:, t - 1] = Y[:, t] - level
+        level = alpha * Y[:, t] + (1 - alpha) * level
+    return np.repeat(level[:, None], horizon, axis=1), residuals
+
+
+def _candidates(Y: np.ndarray, season: int, horizon: int):
+    """Yield (model name, forecast, residuals) for every model the series length supports"""
+    n = Y.shape[1]
+    if n >= 2 * season:
+        forecasts, residuals = holt_winters_grid(Y, season, horizon)
+        for g in range(len(forecasts)):
+            yield "holt_winters", forecasts[g], residuals[g]
+        yield ("seasonal_naive",) + seasonal_naive(Y, season, horizon)
+    elif n >= 2:
+        yield ("exponential_smoothing",) + simple_exponential_smoothing(Y, horizon)
+        if n > season:
+            yield ("seasonal_naive",) + seasonal_naive(Y, season, horizon)
+    else:
+        yield "naive", np.repeat(Y[:, -1:], horizon, axis=1), np.empty((Y.shape[0], 0))
+
+
+def forecast_matrix(Y: np.ndarray, season: int, horizon: int) -> Dict:
+    """
+    Forecast every row of Y with its best-fitting model.
+    Holt-Winters parameters are chosen per series by in-sample one-step MAE and
+    compared against seasonal-naive; the band comes from the chosen model's
+    residual quantiles. Returns arrays shaped (series, horizon) and model names.
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    if Y.shape[1] == 0:
+        raise ValueError("Cannot forecast an empty series")
+
+    names, forecasts, errors, quantiles = [], [], [], []
+    for name, forecast, residuals in _candidates(Y, season, horizon):
+        names.append(name)
+        forecasts.append(forecast)
+        if residuals.shape[1] >= 2:
+            errors.append(np.abs(residuals).mean(axis=1))
+            quantiles.append(np.quantile(residuals, [LOWER_QUANTILE, UPPER_QUANTILE], axis=1))
+        else:
+            spread = 0.1 * np.abs(forecast.mean(axis=1))
+            errors.append(np.full(Y.shape[0], np.inf))
+            quantiles.append(np.stack([-spread, spread]))
+
+    rows = np.arange(Y.shape[0])
+    best = np.argmin(np.stack(errors), axis=0)
+    forecast = np.stack(forecasts)[best, rows]
+    band = np.stack(quantiles)[best, :, rows]  # (series, 2)
+
+    # Biased residuals can put both quantiles on one side; keep the point forecast inside the band
+    low_q = np.minimum(band[:, 0], 0.0)[:, None]
+    high_q = np.maximum(band[:, 1], 0.0)[:, None]
+    # Uncertainty widens with the forecast step
+    widen = np.sqrt(np.arange(1, horizon + 1))
+
+    forecast = np.clip(forecast, 0, None)
+    return {
+        "model": [names[i] for i in best],
+        "mean": forecast,
+        "lower": np.clip(forecast + low_q * widen, 0, None),
+        "upper": np.clip(forecast + high_q * widen, 0, None),
+    }
+
+
+# ----------------------------------------------------------------------
+# Response building
+# ----------------------------------------------------------------------
+def _confidence(mean: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Map relative band width to a 50-99% confidence score"""
+    relative_width = (upper - lower) / np.maximum(mean, 1.0)
+    return np.clip(100.0 * (1.0 - relative_width / 2.0), 50.0, 99.0)
+
+
+def _trend(y: np.ndarray, season: int) -> str:
+    """Compare the latest season with the one before it"""
+    if len(y) < 2:
+        return "stable"
+    window = min(season, len(y) // 2) or 1
+    recent = y[-window:].mean()
+    previous = y[-2 * window:-window].mean()
+    if previous == 0 or abs(recent - previous) / abs(previous) < 0.05:
+        return "stable"
+    return "increasing" if recent > previous else "decreasing"
+
+
+def _labels(period: str, horizon: int, last_epoch: Optional[int], last_date: Optional[date]) -> List[Dict]:
+    if period == "24h":
+        start = last_epoch if last_epoch is not None else int(time.time()) // 3600 * 3600
+        labels = []
+        for h in range(1, horizon + 1):
+            ist = time.gmtime(start + h * 3600 + IST_OFFSET_SECONDS)
+            labels.append({
+                "time": f"{ist.tm_hour:02d}:00",
+                "day": DAY_NAMES[ist.tm_wday],
+                "date": f"{ist.tm_year:04d}-{ist.tm_mon:02d}-{ist.tm_mday:02d}",
+            })
+        return labels
+
+    start = last_date or date.today()
+    labels = []
+    for d in range(1, horizon + 1):
+        target = start + timedelta(days=d)
+        day_name = DAY_NAMES[target.weekday()]
+        labels.append({
+            "time": day_name if period == "7d" else target.strftime("%d %b"),
+            "day": day_name,
+            "date": target.isoformat(),
+        })
+    return labels
+
+
+def _render(metric: str, season: int, y: np.ndarray, result: Dict, row: int, labels: List[Dict]) -> Dict:
+    """Turn one row of a forecast_matrix result into the forecast payload"""
+    mean, lower, upper = result["mean"][row], result["lower"][row], result["upper"][row]
+    confidence = _confidence(mean, lower, upper)
+
+    points = []
+    for i, label in enumerate(labels):
+        points.append({
+            **label,
+            metric: round(float(mean[i]), 1),
+            "lower": round(float(lower[i]), 1),
+            "upper": round(float(upper[i]), 1),
+            "confidence": round(float(confidence[i]), 1),
+        })
+
+    return {
+        "forecast": points,
+        "confidence": round(float(confidence.mean()), 1),
+        "historical_data_points": int(len(y)),
+        "trend": _trend(y, season),
+        "model": result["model"][row],
+        "stats": {
+            "average": round(float(y.mean()), 1),
+            "minimum": round(float(y.min()), 1),
+            "maximum": round(float(y.max()), 1),
+        },
+    }
+
+
+def build_forecast(period: str, metric: str, history: List[Dict]) -> Optional[Dict]:
+    """
+    Forecast a ward metric from hourly readings (24h) or daily rows (7d/30d).
+    Returns the forecast points and summary fields, or None if there is no usable history.
+    """
+    return build_forecasts(period, {"": history}, metrics=(metric,)).get("", {}).get(metric)
+
+
+def build_forecasts(period: str, histories: Dict[str, List[Dict]],
+                    metrics: Sequence[str] = METRICS) -> Dict[str, Dict[str, Dict]]:
+    """
+    Forecast every ward x metric of a period.
+    Series are grouped by their own first and last step and each group is
+    fitted as one matrix, so a short or stale series is never padded with
+    held edge values (which would flatten its residuals and band) and is
+    forecast from its own last step. Returns {ward_no: {metric: forecast}}.
+    """
+    config = PERIOD_CONFIG[period]
+    horizon, season, granularity = config["horizon"], config["season"], config["granularity"]
+
+    keys, series_points = [], []
+    for ward_no, history in histories.items():
+        for metric in metrics:
+            points = _series_points(history, metric, granularity)
+            if points:
+                keys.append((ward_no, metric))
+                series_points.append(points)
+    if not keys:
+        return {}
+
+    # Monitored wards normally share one span, so this is usually a single group
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for i, points in enumerate(series_points):
+        groups.setdefault((min(points), max(points)), []).append(i)
+
+    forecasts: Dict[str, Dict[str, Dict]] = {}
+    for (first, last), members in groups.items():
+        grid = np.arange(first, last + 1)
+        Y = np.stack([_on_grid(series_points[i], grid) for i in members])
+        result = forecast_matrix(Y, season, horizon)
+        labels = _labels(period, horizon, *_last_step_labels(granularity, int(last)))
+        for row, i in enumerate(members):
+            ward_no, metric = keys[i]
+            forecasts.setdefault(ward_no, {})[metric] = _render(metric, season, Y[row], result, row, labels)
+    return forecasts
+
+
+# ----------------------------------------------------------------------
+# Precomputed forecasts
+# ----------------------------------------------------------------------
+def _forecast_key(ward_no: str, period: str, metric: str) -> str:
+    return f"aqi:forecast:{ward_no}:{period}:{metric}"
+
+
+def _is_fresh(payload: Dict, period: str) -> bool:
+    try:
+        generated_at = datetime.fromisoformat(payload["generated_at"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return (datetime.utcnow() - generated_at).total_seconds() <= FORECAST_MAX_AGE[period]
+
+
+def store_forecasts(collector, period: str, forecasts: Dict[str, Dict[str, Dict]], generated_at: str) -> int:
+    """Write forecasts to Redis (one pipeline) and Supabase (one batch upsert)"""
+    rows = []
+    pipe = collector.redis_client.pipeline(transaction=False)
+    for ward_no, by_metric in forecasts.items():
+        for metric, forecast in by_metric.items():
+            payload = {**forecast, "generated_at": generated_at}
+            pipe.set(_forecast_key(ward_no, period, metric), json.dumps(payload), ex=FORECAST_MAX_AGE[period])
+            rows.append({
+                "ward_no": ward_no,
+                "period": period,
+                "metric": metric,
+                "forecast": payload,
+                "generated_at": generated_at,
+            })
+    if not rows:
+        return 0
+
+    try:
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not cache {period} forecasts in Redis: {e}")
+    try:
+        collector.supabase.table(FORECAST_TABLE).upsert(rows, on_conflict="ward_no,period,metric").execute()
+    except Exception as e:
+        logger.warning(f"Could not store {period} forecasts in Supabase: {e}")
+    return len(rows)
+
+
+def precompute_forecasts(collector, periods: Sequence[str] = PERIODS) -> int:
+    """Compute and store forecasts for every ward x metric of the given periods"""
+    total = 0
+    for period in periods:
+        started = time.perf_counter()
+        histories = load_forecast_histories(collector, period)
+        forecasts = build_forecasts(period, histories)
+        total += store_forecasts(collector, period, forecasts, datetime.utcnow().isoformat())
+        logger.info(f"Precomputed {period} forecasts for {len(forecasts)} wards in {time.perf_counter() - started:.2f}s")
+    return total
+
+
+def get_precomputed_forecast(collector, ward_no: str, period: str, metric: str) -> Optional[Dict]:
+    """Read a stored forecast (Redis first, then Supabase). Returns None if missing or stale."""
+    key = _forecast_key(ward_no, period, metric)
+    try:
+        cached = collector.redis_client.get(key)
+        if cached:
+            return json.loads(cached)
+    except Exception as e:
+        logger.warning(f"Could not read forecast from Redis: {e}")
+
+    try:
+        rows = collector.supabase.table(FORECAST_TABLE)\
+            .select("forecast")\
+            .eq("ward_no", ward_no)\
+            .eq("period", period)\
+            .eq("metric", metric)\
+            .limit(1)\
+            .execute().data
+    except Exception as e:
+        logger.warning(f"Could not read forecast from Supabase: {e}")
+        return None
+
+    if not rows or not _is_fresh(rows[0]["forecast"], period):
+        return None
+    payload = rows[0]["forecast"]
+    try:
+        collector.redis_client.set(key, json.dumps(payload), ex=FORECAST_MAX_AGE[period])
+    except Exception:
+        pass
+    return payload
@@ -0,0 +1,346 @@
+"""
+LLM Gateway
+Async access to Groq chat completions for the API handlers.
+Provides per-model concurrency limits and timeouts, single-flight coalescing of
+identical in-flight prompts, a response cache, a circuit breaker and
+token/latency accounting.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from groq import AsyncGroq
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GROQ_API_KEY = os.getenv("GROQ_API")
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+
+
+class LLMUnavailableError(Exception):
+    """Raised when a completion cannot be produced (circuit open, timeout or API error)"""
+    pass
+
+
+class LLMGateway:
+    def __init__(self):
+        """Initialize the async Groq client, limits and caches"""
+        if not GROQ_API_KEY:
+            raise ValueError("GROQ_API must be set in environment variables")
+
+        # Retries are left to the circuit breaker so a degraded API fails fast
+        self.client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
+
+        # Configuration
+        self.MODEL_CONCURRENCY = {DEFAULT_MODEL: 8}  # concurrent requests per model
+        self.DEFAULT_CONCURRENCY = 4
+        self.TIMEOUT_SECONDS = 20
+        self.CACHE_TTL = 600  # 10 minutes
+        self.MAX_CACHE_ENTRIES = 512
+        self.FAILURE_THRESHOLD = 5  # consecutive failures before the circuit opens
+        self.COOLDOWN_SECONDS = 30  # how long the circuit stays open
+
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+
+        # Circuit breaker state
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+        self._stats: Dict[str, Dict] = {}
+
+    # ------------------------------------------------------------------
+    # Keys and caching
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    def _cache_key(self, messages: List[Dict], model: str, temperature: float, max_tokens: int) -> str:
+        normalized = [(m["role"], self._normalize(m["content"])) for m in messages]
+        raw = json.dumps([normalized, model, round(temperature, 2), max_tokens], separators=(",", ":"))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return result
+
+    def _cache_set(self, key: str, result: Dict):
+        self._cache[key] = (time.monotonic() + self.CACHE_TTL, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.MAX_CACHE_ENTRIES:
+            self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        """Drop all cached completions"""
+        self._cache.clear()
+
+    # ------------------------------------------------------------------
+    # Circuit breaker and accounting
+    # ------------------------------------------------------------------
+    def is_available(self) -> bool:
+        """False while the circuit is open"""
+        return time.monotonic() >= self._open_until
+
+    def _allow_request(self) -> bool:
+        """Check the circuit; after the cooldown one trial request is let through"""
+        now = time.monotonic()
+        if now < self._open_until:
+            return False
+        if self._consecutive_failures >= self.FAILURE_THRESHOLD:
+            # Half-open: this request is the trial, hold the others back until it finishes
+            self._open_until = now + self.COOLDOWN_SECONDS
+        return True
+
+    def _record_success(self):
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+    def _record_failure(self):
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.FAILURE_THRESHOLD:
+            self._open_until = time.monotonic() + self.COOLDOWN_SECONDS
+            logger.warning(f"LLM circuit open for {self.COOLDOWN_SECONDS}s after {self._consecutive_failures} failures")
+
+    def _model_stats(self, model: str) -> Dict:
+        return self._stats.setdefault(model, {
+            "requests": 0,
+            "completions": 0,
+            "cache_hits": 0,
+            "coalesced": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_latency_ms": 0.0,
+        })
+
+    def get_stats(self) -> Dict:
+        """Per-model request, token and latency counters plus circuit state"""
+        models = {}
+        for model, stats in self._stats.items():
+            completions = stats["completions"]
+            models[model] = {
+                **stats,
+                "total_latency_ms": round(stats["total_latency_ms"], 1),
+                "avg_latency_ms": round(stats["total_latency_ms"] / completions, 1) if completions else None,
+            }
+        return {
+            "circuit_open": not self.is_available(),
+            "consecutive_failures": self._consecutive_failures,
+            "cached_responses": len(self._cache),
+            "in_flight": len(self._in_flight),
+            "models": models,
+        }
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(
+                self.MODEL_CONCURRENCY.get(model, self.DEFAULT_CONCURRENCY)
+            )
+        return self._semaphores[model]
+
+    # ------------------------------------------------------------------
+    # Completions
+    # ------------------------------------------------------------------
+    async def _call(self, messages: List[Dict], model: str, temperature: float, max_tokens: int) -> Dict:
+        stats = self._model_stats(model)
+        started = time.perf_counter()
+        try:
+            async with self._semaphore(model):
+                completion = await asyncio.wait_for(
+                    self.client.chat.completions.create(
+                        messages=messages,
+                        model=model,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    ),
+                    timeout=self.TIMEOUT_SECONDS
+                )
+        except Exception as e:
+            stats["failures"] += 1
+            self._record_failure()
+            raise LLMUnavailableError(f"Completion failed: {e}") from e
+
+        return self._record_completion(
+            stats, model, completion.choices[0].message.content or "",
+            started, getattr(completion, "usage", None)
+        )
+
+    def _record_completion(self, stats: Dict, model: str, content: str, started: float, usage) -> Dict:
+        latency_ms = (time.perf_counter() - started) * 1000
+        self._record_success()
+
+        stats["completions"] += 1
+        stats["total_latency_ms"] += latency_ms
+        stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+        return {
+            "content": content,
+            "model": model,
+            "latency_ms": round(latency_ms, 1),
+        }
+
+    async def complete(
+        self,
+        messages: List[Dict],
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.7,
+        max_tokens: int = 500,
+        use_cache: bool = True,
+    ) -> str:
+        """
+        Get a chat completion's text.
+        Identical prompts share one in-flight request and, if use_cache is set,
+        a cached response. Raises LLMUnavailableError when the circuit is open
+        or the call fails, so callers can return their fallback text immediately.
+        """
+        stats = self._model_stats(model)
+        stats["requests"] += 1
+
+        key = self._cache_key(messages, model, temperature, max_tokens)
+        if use_cache:
+            cached = self._cache_get(key)
+            if cached is not None:
+                stats["cache_hits"] += 1
+                return cached["content"]
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            stats["coalesced"] += 1
+            result = await asyncio.shield(in_flight)
+            return result["content"]
+
+        if not self._allow_request():
+            stats["short_circuited"] += 1
+            raise LLMUnavailableError("LLM circuit is open")
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._call(messages, model, temperature, max_tokens)
+            if use_cache:
+                self._cache_set(key, result)
+            future.set_result(result)
+            return result["content"]
+        except BaseException as e:
+            # Waiters must not hang if this request is cancelled (client disconnect)
+            future.set_exception(e if isinstance(e, Exception) else LLMUnavailableError("Completion cancelled"))
+            # Mark retrieved so waiter-less futures don't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def stream(
+        self,
+        messages: List[Dict],
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.7,
+        max_tokens: int = 500,
+        use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        """
+        Stream a chat completion's text as Groq produces it.
+        Cached responses and identical in-flight prompts are yielded whole.
+        Raises LLMUnavailableError like complete(); a failure mid-stream is raised
+        after the tokens already yielded.
+        """
+        stats = self._model_stats(model)
+        stats["requests"] += 1
+
+        key = self._cache_key(messages, model, temperature, max_tokens)
+        if use_cache:
+            cached = self._cache_get(key)
+            if cached is not None:
+                stats["cache_hits"] += 1
+                yield cached["content"]
+                return
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            stats["coalesced"] += 1
+            result = await asyncio.shield(in_flight)
+            yield result["content"]
+            return
+
+        if not self._allow_request():
+            stats["short_circuited"] += 1
+            raise LLMUnavailableError("LLM circuit is open")
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        started = time.perf_counter()
+        parts: List[str] = []
+        usage = None
+        try:
+            try:
+                async with self._semaphore(model):
+                    response = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            messages=messages,
+                            model=model,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            stream=True,
+                        ),
+                        timeout=self.TIMEOUT_SECONDS
+                    )
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            # The timeout applies per chunk, so long answers are not cut off
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.TIMEOUT_SECONDS)
+                        except StopAsyncIteration:
+                            break
+                        x_groq = getattr(chunk, "x_groq", None)
+                        if getattr(x_groq, "usage", None) is not None:
+                            usage = x_groq.usage
+                        token = chunk.choices[0].delta.content if chunk.choices else None
+                        if token:
+                            parts.append(token)
+                            yield token
+            except Exception as e:
+                stats["failures"] += 1
+                self._record_failure()
+                raise LLMUnavailableError(f"Completion stream failed: {e}") from e
+
+            result = self._record_completion(stats, model, "".join(parts), started, usage)
+            if use_cache:
+                self._cache_set(key, result)
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else LLMUnavailableError("Completion cancelled"))
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+
+# Global instance
+_llm_gateway_instance = None
+
+def get_llm_gateway() -> LLMGateway:
+    """Get or create the global LLM gateway instance"""
+    global _llm_gateway_instance
+    if _llm_gateway_instance is None:
+        _llm_gateway_instance = LLMGateway()
+    return _llm_gateway_instance
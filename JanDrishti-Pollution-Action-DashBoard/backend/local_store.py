@@ -0,0 +1,388 @@
+"""
+Local Analytical Store for Ward AQI History
+Embedded SQLite database written by the collector. Keeps full hourly history
+per ward (Redis only keeps 2 days) and the daily averages, so history reads,
+forecast inputs and exports are answered locally.
+Supabase stays the system of record: daily rows are written here first and
+pushed to ward_aqi_daily asynchronously by sync_daily_to_supabase(); rows
+other instances write are pulled back by pull_daily_from_supabase(), and daily
+reads are only served locally while the store holds Supabase's newest date.
+"""
+import os
+import time
+import sqlite3
+import threading
+import logging
+from datetime import datetime, date, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Store configuration
+LOCAL_STORE_ENABLED = os.getenv("LOCAL_STORE_ENABLED", "true").lower() == "true"
+LOCAL_STORE_PATH = os.getenv(
+    "LOCAL_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "aqi_history.db")
+)
+
+HOURLY_COLUMNS = (
+    "ward_no", "epoch", "utc_date", "ist_date", "ist_hour",
+    "aqi", "pm25", "pm10", "no2", "o3", "timestamp", "fetched_at",
+)
+
+DAILY_COLUMNS = (
+    "ward_no", "ward_name", "quadrant", "latitude", "longitude", "date",
+    "avg_aqi", "min_aqi", "max_aqi", "avg_pm25", "avg_pm10", "avg_no2", "avg_o3",
+    "hourly_readings_count", "updated_at",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hourly_readings (
+    ward_no TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    utc_date TEXT NOT NULL,
+    ist_date TEXT NOT NULL,
+    ist_hour INTEGER NOT NULL,
+    aqi REAL,
+    pm25 REAL,
+    pm10 REAL,
+    no2 REAL,
+    o3 REAL,
+    timestamp TEXT,
+    fetched_at TEXT,
+    PRIMARY KEY (ward_no, epoch)
+);
+CREATE INDEX IF NOT EXISTS idx_hourly_utc_date ON hourly_readings(utc_date, ward_no);
+CREATE INDEX IF NOT EXISTS idx_hourly_epoch ON hourly_readings(epoch);
+CREATE INDEX IF NOT EXISTS idx_hourly_ist_date ON hourly_readings(ist_date, ward_no);
+
+CREATE TABLE IF NOT EXISTS daily_averages (
+    ward_no TEXT NOT NULL,
+    ward_name TEXT,
+    quadrant TEXT,
+    latitude REAL,
+    longitude REAL,
+    date TEXT NOT NULL,
+    avg_aqi REAL NOT NULL,
+    min_aqi REAL,
+    max_aqi REAL,
+    avg_pm25 REAL,
+    avg_pm10 REAL,
+    avg_no2 REAL,
+    avg_o3 REAL,
+    hourly_readings_count INTEGER DEFAULT 0,
+    updated_at TEXT,
+    synced INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ward_no, date)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_date ON daily_averages(date DESC, ward_no);
+CREATE INDEX IF NOT EXISTS idx_daily_unsynced ON daily_averages(synced) WHERE synced = 0;
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class LocalAQIStore:
+    def __init__(self, path: str = LOCAL_STORE_PATH):
+        """Open (or create) the local SQLite store"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+        # Configuration
+        self.SYNC_BATCH_SIZE = 500
+        self.BACKFILL_PAGE_SIZE = 1000
+        self.REMOTE_CHECK_TTL = 60  # seconds Supabase's newest daily date is reused
+
+        self._remote_newest: Tuple[float, Optional[str]] = (float("-inf"), None)
+
+    # ------------------------------------------------------------------
+    # Meta
+    # ------------------------------------------------------------------
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO store_meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+            self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def append_hourly(self, ward_no: str, reading: Dict):
+        """
+        Append an hourly reading (append-only; a reading for the same
+        ward and epoch is ignored). Expects the epoch/IST fields stamped at ingest.
+        """
+        epoch = int(reading["epoch"])
+        utc_date = datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%d")
+        values = (
+            ward_no, epoch, utc_date, reading["ist_date"], reading["ist_hour"],
+            reading.get("aqi"), reading.get("pm25"), reading.get("pm10"),
+            reading.get("no2"), reading.get("o3"),
+            reading.get("timestamp"), reading.get("fetched_at"),
+        )
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR IGNORE INTO hourly_readings ({', '.join(HOURLY_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in HOURLY_COLUMNS)})",
+                values
+            )
+            self._conn.commit()
+
+    def upsert_daily(self, row: Dict, synced: bool = False):
+        """Insert or replace a daily average row (marked unsynced unless stated otherwise)"""
+        self.upsert_daily_many([row], synced=synced)
+
+    def upsert_daily_many(self, rows: Sequence[Dict], synced: bool = False):
+        """
+        Insert or replace daily average rows.
+        Rows coming from Supabase (synced=True) never overwrite local rows
+        that have not been pushed yet.
+        """
+        if not rows:
+            return
+        columns = DAILY_COLUMNS + ("synced",)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in ("ward_no", "date"))
+        sql = (
+            f"INSERT INTO daily_averages ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(ward_no, date) DO UPDATE SET {updates}"
+        )
+        if synced:
+            sql += " WHERE daily_averages.synced = 1"
+
+        values = [tuple(row.get(c) for c in DAILY_COLUMNS) + (1 if synced else 0,) for row in rows]
+        with self._lock:
+            self._conn.executemany(sql, values)
+            self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def get_hourly_for_day(self, ward_no: str, utc_date: date) -> List[Dict]:
+        """Get all hourly readings for a ward on a UTC date, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM hourly_readings WHERE ward_no = ? AND utc_date = ? ORDER BY epoch",
+                (ward_no, utc_date.isoformat())
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_hourly_range(self, ward_no: str, start_epoch: int, end_epoch: Optional[int] = None) -> List[Dict]:
+        """Get hourly readings for a ward within [start_epoch, end_epoch], oldest first"""
+        sql = "SELECT * FROM hourly_readings WHERE ward_no = ? AND epoch >= ?"
+        params: List = [ward_no, start_epoch]
+        if end_epoch is not None:
+            sql += " AND epoch <= ?"
+            params.append(end_epoch)
+        sql += " ORDER BY epoch"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def query_daily(
+        self,
+        columns: Sequence[str],
+        ward_no: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[Tuple[str, str]] = None,
+    ) -> List[Dict]:
+        """
+        Query daily averages ordered by (date DESC, ward_no ASC), with the same
+        keyset semantics as DailyHistoryService: rows strictly after cursor.
+        """
+        unknown = [c for c in columns if c not in DAILY_COLUMNS]
+        if unknown:
+            raise ValueError(f"Columns not available in local store: {', '.join(unknown)}")
+
+        sql = f"SELECT {', '.join(columns)} FROM daily_averages WHERE 1 = 1"
+        params: List = []
+        if ward_no:
+            sql += " AND ward_no = ?"
+            params.append(ward_no)
+        if start_date:
+            sql += " AND date >= ?"
+            params.append(start_date)
+        if end_date:
+            sql += " AND date <= ?"
+            params.append(end_date)
+        if cursor:
+            sql += " AND (date < ? OR (date = ? AND ward_no > ?))"
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        sql += " ORDER BY date DESC, ward_no ASC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_query(self, sql: str, params: Sequence = (), chunk_size: int = 1000) -> Iterator[List[Dict]]:
+        """Run a read-only query on a dedicated connection and yield rows in bounded chunks"""
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def newest_synced_date(self) -> Optional[str]:
+        """Newest date of the daily rows known to be in Supabase (pulled from or pushed to it)"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(date) AS max_date FROM daily_averages WHERE synced = 1").fetchone()
+        return row["max_date"] if row else None
+
+    def _remote_newest_date(self, supabase) -> Optional[str]:
+        checked_at, newest = self._remote_newest
+        now = time.monotonic()
+        if now - checked_at < self.REMOTE_CHECK_TTL:
+            return newest
+        response = supabase.table("ward_aqi_daily").select("date").order("date", desc=True).limit(1).execute()
+        newest = response.data[0]["date"] if response.data else None
+        self._remote_newest = (now, newest)
+        return newest
+
+    def covers_daily(self, supabase) -> bool:
+        """
+        Whether the local daily table can answer daily queries: Supabase history
+        has been pulled and no instance has written a newer date to Supabase since.
+        """
+        if self.get_meta("daily_backfilled") != "1":
+            return False
+        try:
+            remote_newest = self._remote_newest_date(supabase)
+        except Exception as e:
+            logger.warning(f"Could not check Supabase daily history, reading it remotely: {e}")
+            return False
+        if remote_newest is None:
+            return True
+        local_newest = self.newest_synced_date()
+        return local_newest is not None and str(remote_newest) <= local_newest
+
+    # ------------------------------------------------------------------
+    # Supabase sync
+    # ------------------------------------------------------------------
+    def sync_daily_to_supabase(self, supabase) -> int:
+        """Push unsynced daily rows to ward_aqi_daily in batches. Returns rows synced."""
+        total = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(DAILY_COLUMNS)} FROM daily_averages WHERE synced = 0 LIMIT ?",
+                    (self.SYNC_BATCH_SIZE,)
+                ).fetchall()
+            if not rows:
+                break
+
+            batch = [dict(row) for row in rows]
+            supabase.table("ward_aqi_daily").upsert(batch, on_conflict="ward_no,date").execute()
+
+            with self._lock:
+                # Only mark rows that were not rewritten while the upsert was in flight
+                self._conn.executemany(
+                    "UPDATE daily_averages SET synced = 1 WHERE ward_no = ? AND date = ? AND updated_at IS ?",
+                    [(row["ward_no"], row["date"], row["updated_at"]) for row in batch]
+                )
+                self._conn.commit()
+            total += len(batch)
+            if len(batch) < self.SYNC_BATCH_SIZE:
+                break
+
+        if total:
+            logger.info(f"Synced {total} daily rows from local store to Supabase")
+        return total
+
+    def pull_daily_from_supabase(self, supabase) -> int:
+        """
+        Copy ward_aqi_daily rows written since the last pull (all of them the first
+        time) into the local store, so rows other instances write are picked up
+        """
+        watermark = self.get_meta("daily_pulled_updated_at")
+        newest = watermark
+        total = 0
+        offset = 0
+        while True:
+            query = supabase.table("ward_aqi_daily").select(",".join(DAILY_COLUMNS))
+            if watermark:
+                # Rows stamped at the watermark itself are read again rather than missed
+                query = query.gte("updated_at", watermark)
+            response = query\
+                .order("updated_at")\
+                .order("ward_no")\
+                .order("date")\
+                .range(offset, offset + self.BACKFILL_PAGE_SIZE - 1)\
+                .execute()
+            rows = response.data or []
+            self.upsert_daily_many(rows, synced=True)
+            for row in rows:
+                if row.get("updated_at") and (newest is None or row["updated_at"] > newest):
+                    newest = row["updated_at"]
+            total += len(rows)
+            if len(rows) < self.BACKFILL_PAGE_SIZE:
+                break
+            offset += self.BACKFILL_PAGE_SIZE
+
+        if newest:
+            self.set_meta("daily_pulled_updated_at", newest)
+        self.set_meta("daily_backfilled", "1")
+        if total:
+            logger.info(f"Pulled {total} daily rows from Supabase into local store")
+        return total
+
+
+# Global instance
+_local_store_instance = None
+_local_store_lock = threading.Lock()
+_local_store_failed = False
+
+def get_local_store() -> Optional[LocalAQIStore]:
+    """
+    Get or create the global local store.
+    Returns None if the store is disabled or cannot be opened
+    (e.g. read-only filesystem), so callers fall back to Redis/Supabase.
+    """
+    global _local_store_instance, _local_store_failed
+    if not LOCAL_STORE_ENABLED or _local_store_failed:
+        return None
+
+    if _local_store_instance is None:
+        with _local_store_lock:
+            if _local_store_instance is None and not _local_store_failed:
+                try:
+                    _local_store_instance = LocalAQIStore()
+                except Exception as e:
+                    logger.warning(f"Local AQI store unavailable, falling back to remote reads: {e}")
+                    _local_store_failed = True
+    return _local_store_instance
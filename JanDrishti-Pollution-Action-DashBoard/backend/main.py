@@ -1,9 +1,9 @@
 from fastapi import FastAPI, HTTPException, Depends, status, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from datetime import datetime, date, timedelta
 import os
 import traceback
@@ -11,22 +11,38 @@ import requests
 import time
 import json
 import re
+import uuid
 import logging
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from jose import JWTError, jwt
-from groq import Groq
 from aqi_scheduler import get_scheduler
-from chat_cache import get_chat_cache
-from aqi_collector import AQICollector
+from token_verifier import get_token_verifier, TokenVerificationError, TokenKeyUnavailableError
+from profile_repository import get_profile_repository
+from llm_gateway import get_llm_gateway, LLMUnavailableError
+from chat_cache import get_chat_cache, ChatCache
+from cache_events import publish_snapshot, publish_reports_changed
+from aqi_collector import AQICollector, IST_OFFSET_SECONDS
 from aqi_collector_singleton import get_collector
 from middleware.error_handler import AppException
+from middleware.cors import CORSHeaderMiddleware
+from middleware.conditional import ConditionalRequestMiddleware
+from middleware.cache import CacheMiddleware
+from middleware.rate_limiter import RateLimitMiddleware
 from twilio_service import get_twilio_service
 from whatsapp_scheduler import get_whatsapp_scheduler
 from email_service import get_email_service
 from email_scheduler import get_email_scheduler
 from auto_sandbox_helper import get_sandbox_helper
+from response_formats import validate_format, format_rows, to_columnar, to_arrow_response
+from daily_history import get_daily_history_service
+from local_store import get_local_store
+import aqi_export
+import chat_context
+from conversation_context import build_history, schedule_summary_refresh
+from ward_gazetteer import get_ward_gazetteer, normalize as normalize_ward_text
+import forecasting
 import geopandas as gpd
 import pandas as pd
 from shapely.geometry import Point
@@ -89,43 +105,20 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(title="JanDrishti API", version="1.0.0", lifespan=lifespan)
 
-# CORS Configuration - Simplified and reliable
-# Handle CORS with a simple middleware that works on Vercel
-class CORSHeaderMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        # Get origin from request
-        origin = request.headers.get("origin")
-        
-        # Handle preflight OPTIONS requests
-        if request.method == "OPTIONS":
-            return Response(
-                status_code=200,
-                headers={
-                    "Access-Control-Allow-Origin": origin if origin else "*",
-                    "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS, PATCH, HEAD",
-                    "Access-Control-Allow-Headers": "*",
-                    "Access-Control-Allow-Credentials": "true" if origin else "false",
-                    "Access-Control-Max-Age": "3600",
-                }
-            )
-        
-        # Process the request
-        response = await call_next(request)
-        
-        # Add CORS headers to the response
-        if origin:
-            response.headers["Access-Control-Allow-Origin"] = origin
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-        else:
-            # Allow all origins if no origin header (but can't use credentials)
-            response.headers["Access-Control-Allow-Origin"] = "*"
-        
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH, HEAD"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-        response.headers["Access-Control-Expose-Headers"] = "*"
-        
-        return response
+# Response cache for AQI reads; added first (innermost) so CORS and validator
+# headers are never stored in cache entries
+app.add_middleware(CacheMiddleware)
+
+# ETag/Last-Modified validators for read endpoints (added before CORS so 304s get CORS headers too)
+app.add_middleware(ConditionalRequestMiddleware)
 
+# Per-client rate limits (inside CORS so 429s get CORS headers too). Clients are keyed by IP:
+# behind a reverse proxy (Vercel, nginx) set TRUSTED_PROXY_HOPS to the number of proxies,
+# otherwise every user shares the proxy's address and one bucket
+app.add_middleware(RateLimitMiddleware)
+
+# CORS Configuration - Simplified and reliable
+# Handle CORS with a simple pure-ASGI middleware that works on Vercel
 # Add CORS middleware - must be first
 app.add_middleware(CORSHeaderMiddleware)
 
@@ -139,13 +132,11 @@ if not supabase_url or not supabase_key:
 
 supabase: Client = create_client(supabase_url, supabase_key)
 supabase_admin: Client = create_client(supabase_url, supabase_service_key) if supabase_service_key else supabase
+token_verifier = get_token_verifier()
+profile_repository = get_profile_repository(supabase)
 
-# Groq Client
-groq_api_key = os.getenv("GROQ_API")
-if not groq_api_key:
-    raise ValueError("GROQ_API must be set in environment variables")
-
-groq_client = Groq(api_key=groq_api_key)
+# Groq access goes through the async LLM gateway (raises if GROQ_API is not set)
+llm_gateway = get_llm_gateway()
 
 # Security
 security = HTTPBearer()
@@ -257,9 +248,25 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     """Verify JWT token and return user"""
     token = credentials.credentials
     
+    try:
+        # Verify locally (signature, expiry, audience, issuer); recently verified tokens are cached
+        user = token_verifier.get_cached_user(token)
+        if user is None:
+            user = await run_in_threadpool(token_verifier.verify, token)
+        return user
+    except TokenKeyUnavailableError:
+        # No local key for this token - fall back to Supabase Auth
+        pass
+    except TokenVerificationError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
     try:
         # Verify token with Supabase
-        user = supabase.auth.get_user(token)
+        user = await run_in_threadpool(supabase.auth.get_user, token)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -275,205 +282,164 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
 
 # AI Helper Functions
-async def fetch_aqi_data_for_ward(ward_name: str = None, ward_no: str = None) -> dict:
-    """Fetch current AQI data for a specific ward from Redis or API"""
+async def detect_ward_from_message(message: str) -> tuple:
+    """Detect ward name or number from user message (all Delhi wards, fuzzy-matched)"""
     try:
-        # Use singleton instance to avoid creating new connections
         collector = get_collector()
-        
-        # If ward_name provided, find ward_no
-        if ward_name and not ward_no:
-            wards = collector.selected_wards
-            ward = next((w for w in wards if ward_name.upper() in w.get("ward_name", "").upper()), None)
-            if ward:
-                ward_no = ward.get("ward_no")
-        
-        if not ward_no:
+        return get_ward_gazetteer(collector.selected_wards).detect(message)
+    except Exception as e:
+        print(f"Error detecting ward: {e}")
+        return None, None
+
+async def chat_answer_slot(user_message: str, ward: tuple) -> Optional[tuple]:
+    """
+    Answer-cache slot for a message as (bucket, normalized question, ttl), or None if it should not be cached.
+    ward is the (ward_name, ward_no) detected in the message.
+    The bucket combines the detected ward, its current AQI band and the latest-reading version,
+    so cached answers are never served across hourly data updates.
+    """
+    try:
+        collector = get_collector()
+        ward_name, ward_no = ward
+        # The ward is part of the bucket, so its name is left out of the question
+        exclude_tokens = []
+        if ward_no:
+            exclude_tokens = normalize_ward_text(ward_name).split() + ["ward", str(ward_no).lower()]
+        question = ChatCache.normalize_question(user_message, exclude_tokens)
+        if not question:
             return None
         
-        # Try to get latest hourly data from Redis
-        today = date.today()
-        hourly_data = collector.get_hourly_data_from_redis(ward_no, today)
-        
-        if hourly_data and len(hourly_data) > 0:
-            latest = hourly_data[-1]
-            return {
-                "ward_no": ward_no,
-                "ward_name": next((w.get("ward_name") for w in collector.selected_wards if w.get("ward_no") == ward_no), "Unknown"),
-                "aqi": latest.get("aqi"),
-                "pm25": latest.get("pm25"),
-                "pm10": latest.get("pm10"),
-                "no2": latest.get("no2"),
-                "o3": latest.get("o3"),
-                "timestamp": latest.get("fetched_at", latest.get("timestamp")),
-                "source": "Redis (hourly data)"
-            }
-        
-        # Fallback to feed API
-        ward = next((w for w in collector.selected_wards if w.get("ward_no") == ward_no), None)
-        if ward:
-            aqi_data = collector.fetch_aqi_for_ward(ward.get("latitude"), ward.get("longitude"))
-            if aqi_data:
-                return {
-                    "ward_no": ward_no,
-                    "ward_name": ward.get("ward_name"),
-                    "aqi": aqi_data.get("aqi"),
-                    "pm25": aqi_data.get("pm25"),
-                    "pm10": aqi_data.get("pm10"),
-                    "no2": aqi_data.get("no2"),
-                    "o3": aqi_data.get("o3"),
-                    "timestamp": aqi_data.get("fetched_at"),
-                    "source": "WAQI API (real-time)"
-                }
-        
-        return None
+        band = "all"
+        if ward_no:
+            reading = collector.get_latest_ward_data(ward_no) or {}
+            aqi = reading.get("aqi")
+            band = get_aqi_category(int(float(aqi)))["category"] if isinstance(aqi, (int, float)) else "none"
+        bucket = f"{ward_no or 'all'}:{band}:{collector.get_latest_version()}"
+        
+        # Expire shortly after the next hourly ingest (runs at :00 IST)
+        ttl = 3600 - int(time.time() + IST_OFFSET_SECONDS) % 3600 + 300
+        return bucket, question, ttl
     except Exception as e:
-        print(f"Error fetching AQI data: {e}")
+        print(f"Error building chat answer slot: {e}")
         return None
 
-async def detect_ward_from_message(message: str) -> tuple:
-    """Detect ward name or number from user message"""
-    message_lower = message.lower()
-    
-    # Ward names mapping
-    ward_names = {
-        "model town": "72",
-        "begumpur": "27",
-        "hauz rani": "162",
-        "nangli sakravati": "134",
-        "nangli": "134",
-        "sakravati": "134"
-    }
-    
-    # Check for ward names
-    for ward_name, ward_no in ward_names.items():
-        if ward_name in message_lower:
-            return ward_name.title(), ward_no
-    
-    # Check for ward numbers
-    import re
-    ward_no_match = re.search(r'ward\s*[:\-]?\s*(\d+)', message_lower)
-    if ward_no_match:
-        ward_no = ward_no_match.group(1)
-        try:
-            # Use singleton instance
-            collector = get_collector()
-            ward_name = next((w.get("ward_name") for w in collector.selected_wards if w.get("ward_no") == ward_no), None)
-            return ward_name or f"Ward {ward_no}", ward_no
-        except:
-            return f"Ward {ward_no}", ward_no
-    
-    return None, None
+def chat_fallback_response(user_message: str) -> str:
+    """Reply used when the AI service is unavailable"""
+    return f"I understand you're asking about: {user_message}. I'm having trouble connecting to my AI service right now, but I'm here to help with pollution monitoring, air quality questions, and health recommendations. Please try again in a moment, or contact our support team for immediate assistance."
 
 async def generate_ai_response(user_message: str, user_id: str = None, user_context: dict = None) -> str:
     """Generate AI response using Groq API with conversation context from Redis and real-time AQI data"""
     try:
+        # Answer cache: same question about the same ward, AQI band and data version
         chat_cache = get_chat_cache()
-        
-        # Get conversation context from Redis (last 5 messages for context)
-        conversation_context = []
-        if user_id:
-            conversation_context = chat_cache.get_conversation_context(user_id, max_messages=5)
-        
-        # Detect if user is asking about AQI/ward and fetch real data
-        aqi_context = ""
-        message_lower = user_message.lower()
-        is_aqi_question = any(keyword in message_lower for keyword in [
-            "aqi", "air quality", "pollution", "pm25", "pm10", "no2", "o3", 
-            "ward", "model town", "begumpur", "hauz rani", "nangli sakravati"
-        ])
-        
-        if is_aqi_question:
-            ward_name, ward_no = await detect_ward_from_message(user_message)
-            
-            if ward_no:
-                aqi_data = await fetch_aqi_data_for_ward(ward_name, ward_no)
-                if aqi_data:
-                    aqi_context = f"""
-REAL-TIME AQI DATA FOR {aqi_data.get('ward_name', 'WARD')} (Ward {aqi_data.get('ward_no')}):
-- Current AQI: {aqi_data.get('aqi', 'N/A')}
-- PM2.5: {aqi_data.get('pm25', 'N/A')} µg/m³
-- PM10: {aqi_data.get('pm10', 'N/A')} µg/m³
-- NO2: {aqi_data.get('no2', 'N/A')} µg/m³
-- O3: {aqi_data.get('o3', 'N/A')} µg/m³
-- Last Updated: {aqi_data.get('timestamp', 'Unknown')}
-- Data Source: {aqi_data.get('source', 'Unknown')}
-
-Use this REAL data to answer the user's question. Do NOT say you don't have access to real-time data.
-"""
-            else:
-                # Fetch data for all wards if no specific ward mentioned
-                try:
-                    # Use singleton instance
-                    collector = get_collector()
-                    all_wards_data = []
-                    for ward in collector.selected_wards[:50]:  # Limit to 50 wards
-                        ward_data = await fetch_aqi_data_for_ward(None, ward.get("ward_no"))
-                        if ward_data:
-                            all_wards_data.append(ward_data)
-                    
-                    if all_wards_data:
-                        aqi_context = "\nREAL-TIME AQI DATA FOR ALL MONITORED WARDS:\n"
-                        for ward_data in all_wards_data:
-                            aqi_context += f"""
-- {ward_data.get('ward_name')} (Ward {ward_data.get('ward_no')}): AQI {ward_data.get('aqi', 'N/A')} | PM2.5: {ward_data.get('pm25', 'N/A')} | PM10: {ward_data.get('pm10', 'N/A')} | NO2: {ward_data.get('no2', 'N/A')} | O3: {ward_data.get('o3', 'N/A')} µg/m³
-"""
-                        aqi_context += "\nUse this REAL data to answer the user's question. Do NOT say you don't have access to real-time data.\n"
-                except Exception as e:
-                    print(f"Error fetching all wards data: {e}")
-        
-        # Create a context-aware system prompt for pollution monitoring
-        system_prompt = """You are an AI assistant for JanDrishti, a pollution monitoring and environmental intelligence platform. 
-        You help users understand air quality data, provide health recommendations, explain government policies, and offer guidance on pollution-related issues.
-        
-        Key areas you can help with:
-        - Air Quality Index (AQI) interpretation and current levels
-        - Health recommendations based on pollution levels
-        - Government regulations and policies
-        - Best times for outdoor activities
-        - Pollution sources and mitigation strategies
-        - Emergency contacts and helplines
-        - Environmental health tips
-        
-        IMPORTANT: When you have real-time AQI data provided in the context, USE IT to answer questions accurately. 
-        Do NOT say you don't have access to real-time data if it's provided below.
-        Always provide accurate, helpful, and actionable information based on the data available.
-        Keep responses concise but informative, and always prioritize user health and safety."""
-        
-        # Add user context if available
-        context_info = ""
-        if user_context:
-            context_info = f"\nUser context: {user_context.get('location', 'Unknown location')}"
-        
-        # Build messages array with conversation history
-        messages = [{"role": "system", "content": system_prompt + context_info + aqi_context}]
-        
-        # Add conversation context from Redis
-        for msg in conversation_context:
-            if msg.get("user_message"):
-                messages.append({"role": "user", "content": msg["user_message"]})
-            if msg.get("bot_response"):
-                messages.append({"role": "assistant", "content": msg["bot_response"]})
-        
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
-        
-        # Create the chat completion
-        chat_completion = groq_client.chat.completions.create(
-            messages=messages,
+        ward = await detect_ward_from_message(user_message)
+        slot = await chat_answer_slot(user_message, ward)
+        if slot:
+            cached_answer = chat_cache.get_cached_answer(slot[0], slot[1])
+            if cached_answer:
+                return cached_answer
+        
+        messages, personal = await build_chat_messages(user_message, user_id, user_context, ward=ward)
+        
+        # Create the chat completion (async; identical in-flight prompts share one call)
+        answer = await llm_gateway.complete(
+            messages,
             model="llama-3.3-70b-versatile",
             temperature=0.7,
-            max_tokens=500,
-            top_p=1,
-            stream=False
+            max_tokens=500
         )
         
-        return chat_completion.choices[0].message.content
+        # Answers built from the user's own history are not shared with other users
+        if slot and answer and not personal:
+            chat_cache.cache_answer(slot[0], slot[1], answer, ttl=slot[2])
+        return answer
         
     except Exception as e:
         print(f"Error generating AI response: {e}")
         # Fallback response
-        return f"I understand you're asking about: {user_message}. I'm having trouble connecting to my AI service right now, but I'm here to help with pollution monitoring, air quality questions, and health recommendations. Please try again in a moment, or contact our support team for immediate assistance."
+        return chat_fallback_response(user_message)
+
+async def build_chat_messages(
+    user_message: str,
+    user_id: str = None,
+    user_context: dict = None,
+    ward: Optional[tuple] = None
+) -> Tuple[List[dict], bool]:
+    """
+    Build the chat prompt: system prompt with real-time AQI data, Redis conversation context and the new message.
+    ward is the (ward_name, ward_no) already detected in the message, if any.
+    Returns (messages, personal); personal is True when the prompt carries the user's
+    conversation history, summary or location, so the answer must not be shared.
+    """
+    chat_cache = get_chat_cache()
+    
+    # Get conversation context from Redis: rolling summary + newest turns within the token budget
+    conversation_summary, conversation_context = None, []
+    if user_id:
+        conversation_summary, conversation_context = build_history(chat_cache, user_id)
+    
+    # Detect if user is asking about AQI/ward and fetch real data
+    aqi_context = ""
+    message_lower = user_message.lower()
+    ward_name, ward_no = ward if ward is not None else await detect_ward_from_message(user_message)
+    is_aqi_question = ward_no is not None or any(keyword in message_lower for keyword in [
+        "aqi", "air quality", "pollution", "pm25", "pm10", "no2", "o3", "ward"
+    ])
+    
+    if is_aqi_question:
+        try:
+            # Latest readings come from the collector's index (one Redis read, never WAQI)
+            collector = get_collector()
+            if ward_no:
+                aqi_context = chat_context.build_ward_context(collector, ward_no)
+            else:
+                # No specific ward mentioned - list all monitored wards
+                aqi_context = chat_context.build_all_wards_context(collector)
+        except Exception as e:
+            print(f"Error building AQI context: {e}")
+    
+    # Create a context-aware system prompt for pollution monitoring
+    system_prompt = """You are an AI assistant for JanDrishti, a pollution monitoring and environmental intelligence platform. 
+    You help users understand air quality data, provide health recommendations, explain government policies, and offer guidance on pollution-related issues.
+    
+    Key areas you can help with:
+    - Air Quality Index (AQI) interpretation and current levels
+    - Health recommendations based on pollution levels
+    - Government regulations and policies
+    - Best times for outdoor activities
+    - Pollution sources and mitigation strategies
+    - Emergency contacts and helplines
+    - Environmental health tips
+    
+    IMPORTANT: When you have real-time AQI data provided in the context, USE IT to answer questions accurately. 
+    Do NOT say you don't have access to real-time data if it's provided below.
+    Always provide accurate, helpful, and actionable information based on the data available.
+    Keep responses concise but informative, and always prioritize user health and safety."""
+    
+    # Add user context if available
+    context_info = ""
+    location = "Unknown location"
+    if user_context:
+        location = user_context.get('location', 'Unknown location')
+        context_info = f"\nUser context: {location}"
+    if conversation_summary:
+        context_info += f"\nSummary of the earlier conversation: {conversation_summary}"
+    
+    # Build messages array with conversation history
+    messages = [{"role": "system", "content": system_prompt + context_info + aqi_context}]
+    
+    # Add conversation context from Redis
+    for msg in conversation_context:
+        if msg.get("user_message"):
+            messages.append({"role": "user", "content": msg["user_message"]})
+        if msg.get("bot_response"):
+            messages.append({"role": "assistant", "content": msg["bot_response"]})
+    
+    # Add current user message
+    messages.append({"role": "user", "content": user_message})
+    
+    personal = bool(conversation_summary or conversation_context) or location != "Unknown location"
+    return messages, personal
 
 def get_aqi_category(aqi: int) -> str:
     """Get AQI category and color"""
@@ -630,6 +596,20 @@ def heavy_aqi_processing():
         "summary": summary
     }
 
+def announce_reports_changed(report_id):
+    """Tell every worker a report was written so the reports validators change"""
+    try:
+        publish_reports_changed(get_chat_cache().redis_client, report_id)
+    except Exception as e:
+        logging.warning(f"Could not announce report change {report_id}: {e}")
+
+def announce_snapshot(record_id):
+    """Tell every worker a new AQI snapshot was published so cached copies are dropped"""
+    try:
+        publish_snapshot(get_chat_cache().redis_client, record_id)
+    except Exception as e:
+        logging.warning(f"Could not announce AQI snapshot {record_id}: {e}")
+
 #save cache to supabase
 def save_cache_to_db(data: dict):
     """
@@ -692,6 +672,7 @@ def save_cache_to_db(data: dict):
             if result and len(result) > 0:
                 record_id = result[0].get('id')
                 print(f"✅ Cache saved successfully! New record id={record_id}")
+                announce_snapshot(record_id)
                 return result
             else:
                 raise Exception("Insert succeeded but no data returned")
@@ -716,6 +697,7 @@ def save_cache_to_db(data: dict):
                     "generated_at": datetime.utcnow().isoformat()
                 }).eq("id", record_id).execute()
                 print(f"✅ Cache updated successfully in existing record id={record_id}")
+                announce_snapshot(record_id)
                 return response.data
             else:
                 print("No existing record found for update fallback.")
@@ -847,6 +829,9 @@ async def signup(user_data: UserSignup):
             # Don't fail signup if profile update fails - we'll sync on login
             # But log it so we can debug
         
+        # The profile was (re)written above
+        profile_repository.invalidate(response.user.id)
+        
         # Check if email confirmation is required
         email_confirmation_required = not response.session
         
@@ -892,9 +877,9 @@ async def login(credentials: UserLogin):
         
         # Get user profile and metadata
         try:
-            profile = supabase.table("profiles").select("*").eq("id", response.user.id).single().execute()
-            full_name = profile.data.get("full_name") if profile.data else None
-            phone_from_profile = profile.data.get("phone") if profile.data else None
+            profile = profile_repository.get(response.user.id)
+            full_name = profile.get("full_name") if profile else None
+            phone_from_profile = profile.get("phone") if profile else None
         except Exception as profile_error:
             # Profile might not exist yet, that's okay
             print(f"DEBUG: Profile fetch error (non-critical): {profile_error}")
@@ -915,6 +900,7 @@ async def login(credentials: UserLogin):
                     "phone": phone_from_metadata,
                     "updated_at": datetime.utcnow().isoformat()
                 }).eq("id", response.user.id).execute()
+                profile_repository.invalidate(response.user.id)
                 logger.info(f"Updated phone number in profile for user {response.user.id}")
             except Exception as update_error:
                 logger.warning(f"Could not update phone in profile: {update_error}")
@@ -966,10 +952,12 @@ async def login(credentials: UserLogin):
 async def get_current_user_info(current_user = Depends(get_current_user)):
     """Get current authenticated user information"""
     try:
-        profile = supabase.table("profiles").select("*").eq("id", current_user.id).single().execute()
+        profile = profile_repository.get(current_user.id)
+        if not profile:
+            raise HTTPException(status_code=404, detail="User profile not found")
         
         # Get phone number from profile table (phone field)
-        phone_number = profile.data.get("phone") if profile.data else None
+        phone_number = profile.get("phone")
         
         # Fallback to user metadata if not in profile
         if not phone_number:
@@ -979,7 +967,7 @@ async def get_current_user_info(current_user = Depends(get_current_user)):
         return {
             "id": current_user.id,
             "email": current_user.email,
-            "full_name": profile.data.get("full_name") if profile.data else None,
+            "full_name": profile.get("full_name"),
             "phone_number": phone_number
         }
     except Exception as e:
@@ -1030,6 +1018,7 @@ async def create_report(report: ReportCreate, current_user = Depends(get_current
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create report")
         
+        announce_reports_changed(response.data[0].get("id"))
         return response.data[0]
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1068,6 +1057,7 @@ async def update_report(
         }
         
         response = supabase.table("reports").update(report_data).eq("id", report_id).execute()
+        announce_reports_changed(report_id)
         return response.data[0]
     except HTTPException:
         raise
@@ -1084,51 +1074,101 @@ async def upvote_report(report_id: str, current_user = Depends(get_current_user)
         
         # Increment upvotes
         response = supabase.table("reports").update({"upvotes": current_upvotes + 1}).eq("id", report_id).execute()
+        announce_reports_changed(report_id)
         return {"upvotes": response.data[0]["upvotes"]}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 # Chat Endpoints
+def parse_chat_cursor(before: str) -> dict:
+    """Parse a `<created_at>,<id>` history cursor into a {created_at, id} position (id must be a UUID)"""
+    try:
+        created_at, message_id = before.rsplit(",", 1)
+        position = {"created_at": created_at, "id": str(uuid.UUID(message_id))}
+        ChatCache.message_cursor(position)  # validates the timestamp
+        return position
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor. Use before=<created_at>,<id> of the last message received.")
+
+def load_chat_history(user_id: str, limit: int, before: Optional[str] = None) -> List[dict]:
+    """
+    Page of chat history older than the cursor, newest first.
+    Served from the Redis window when it covers the range; otherwise the rest is
+    read from Supabase and cached if it extends the window contiguously.
+    """
+    chat_cache = get_chat_cache()
+    position = parse_chat_cursor(before) if before else None
+    cursor = ChatCache.message_cursor(position) if position else None
+    
+    messages, floor, has_start = chat_cache.get_messages_before(user_id, limit=limit, before=cursor)
+    
+    # The window holds every message newer than its oldest one, so it covers the cursor's range
+    in_window = floor is not None and (cursor is None or cursor >= floor)
+    if not in_window:
+        messages = []
+    elif len(messages) >= limit or has_start:
+        return messages
+    
+    # Continue in Supabase right below the last message we have
+    query_cursor = messages[-1] if messages else position
+    remaining = limit - len(messages)
+    query = supabase.table("chat_messages")\
+        .select("*")\
+        .eq("user_id", user_id)
+    if query_cursor:
+        created_at, message_id = query_cursor["created_at"], query_cursor["id"]
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{message_id}")')
+    page = query\
+        .order("created_at", desc=True)\
+        .order("id", desc=True)\
+        .limit(remaining)\
+        .execute().data or []
+    
+    # Cache the page only if it is contiguous with the window (or starts it from the newest message)
+    if in_window or (floor is None and cursor is None):
+        chat_cache.cache_messages_batch(user_id, page, reached_start=len(page) < remaining)
+    
+    return messages + page
+
 @app.get("/api/chat/messages", response_model=List[ChatMessageResponse])
 async def get_chat_messages(
     limit: int = 50,
     offset: int = 0,
+    before: Optional[str] = Query(None, description="Cursor `<created_at>,<id>` of the oldest message already received"),
     current_user = Depends(get_current_user)
 ):
     """
     Get chat message history (requires authentication)
-    Uses Redis cache for fast retrieval, falls back to Supabase if cache miss
+    Page with `before` (cursor of the last message received); `offset` is still accepted.
+    Uses Redis cache for fast retrieval, falls back to Supabase for ranges beyond the cached window
     """
     try:
         chat_cache = get_chat_cache()
         
-        # Try to get from Redis cache first
-        cached_messages = chat_cache.get_cached_messages(current_user.id, limit=limit + offset)
-        
-        if cached_messages and len(cached_messages) >= limit:
-            # Return cached messages (already sorted by newest first)
-            return cached_messages[:limit]
-        
-        # Cache miss or insufficient data - fetch from Supabase
-        response = supabase.table("chat_messages")\
-            .select("*")\
-            .eq("user_id", current_user.id)\
-            .order("created_at", desc=True)\
-            .limit(limit + offset)\
-            .execute()
-        
-        messages = response.data
-        
-        # Cache the messages in Redis for future requests
-        if messages:
-            chat_cache.cache_messages_batch(current_user.id, messages)
+        if offset > 0 and not before:
+            # Offset paging: served from the cache when it holds the page
+            messages = chat_cache.get_cached_messages(current_user.id, limit=limit, offset=offset)
+            if len(messages) < limit:
+                response = await run_in_threadpool(
+                    lambda: supabase.table("chat_messages")
+                    .select("*")
+                    .eq("user_id", current_user.id)
+                    .order("created_at", desc=True)
+                    .order("id", desc=True)
+                    .range(offset, offset + limit - 1)
+                    .execute()
+                )
+                messages = response.data
+        else:
+            messages = await run_in_threadpool(load_chat_history, current_user.id, limit, before)
         
         # Update user session
         chat_cache.update_session(current_user.id)
         
-        # Return requested slice
-        return messages[offset:offset + limit] if offset > 0 else messages[:limit]
+        return messages
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting chat messages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1178,6 +1218,9 @@ async def create_chat_message(
         # Cache in Redis immediately for fast retrieval
         chat_cache.cache_message(current_user.id, saved_message)
         
+        # Fold turns that left the context window into the rolling summary (background)
+        schedule_summary_refresh(llm_gateway, chat_cache, current_user.id)
+        
         # Return the saved data
         return saved_message
         
@@ -1188,18 +1231,116 @@ async def create_chat_message(
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=str(e))
 
+def format_sse(event: str, data: dict) -> str:
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/chat/messages/stream")
+async def stream_chat_message(
+    message: ChatMessageCreate,
+    current_user = Depends(get_current_user)
+):
+    """
+    Send a chat message and stream the reply as Server-Sent Events (requires authentication)
+    Events: `token` ({"content"}) as Groq produces text, then `done` with the saved message
+    (same shape as POST /api/chat/messages) or `error`.
+    The message is saved to Supabase and cached in Redis after the stream completes;
+    a reply interrupted midway ends with `error` and is not saved.
+    """
+    chat_cache = get_chat_cache()
+    
+    # Check rate limit before the stream starts so it is a real 429
+    is_allowed, remaining = chat_cache.check_rate_limit(current_user.id)
+    if not is_allowed:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded. Please wait before sending another message. You can send {remaining} more messages."
+        )
+    
+    # Update user session
+    chat_cache.update_session(current_user.id)
+    
+    user_id = current_user.id
+    ward = await detect_ward_from_message(message.message)
+    slot = await chat_answer_slot(message.message, ward)
+    cached_answer = chat_cache.get_cached_answer(slot[0], slot[1]) if slot else None
+    prompt_messages, personal = None, True
+    if not cached_answer:
+        prompt_messages, personal = await build_chat_messages(
+            user_message=message.message,
+            user_id=user_id,
+            user_context={"location": "Unknown location"},
+            ward=ward
+        )
+    
+    async def event_stream():
+        parts = []
+        if cached_answer:
+            parts.append(cached_answer)
+            yield format_sse("token", {"content": cached_answer})
+        else:
+            try:
+                async for token in llm_gateway.stream(
+                    prompt_messages,
+                    model="llama-3.3-70b-versatile",
+                    temperature=0.7,
+                    max_tokens=500
+                ):
+                    parts.append(token)
+                    yield format_sse("token", {"content": token})
+                if slot and parts and not personal:
+                    chat_cache.cache_answer(slot[0], slot[1], "".join(parts), ttl=slot[2])
+            except LLMUnavailableError as e:
+                print(f"Error streaming AI response: {e}")
+                if parts:
+                    # Failed midway: the partial reply is not saved as if it were a complete answer
+                    yield format_sse("error", {"detail": "The reply was interrupted. Please try again."})
+                    return
+                fallback = chat_fallback_response(message.message)
+                parts.append(fallback)
+                yield format_sse("token", {"content": fallback})
+        
+        message_data = {
+            "user_id": user_id,
+            "user_message": message.message,
+            "bot_response": "".join(parts),
+            "created_at": datetime.utcnow().isoformat()
+        }
+        
+        try:
+            # Save to Supabase (primary storage), then cache in Redis
+            response = await run_in_threadpool(
+                lambda: supabase.table("chat_messages").insert(message_data).execute()
+            )
+            saved_message = response.data[0]
+            chat_cache.cache_message(user_id, saved_message)
+            schedule_summary_refresh(llm_gateway, chat_cache, user_id)
+            yield format_sse("done", saved_message)
+        except Exception as e:
+            print(f"Error saving streamed chat message: {e}")
+            yield format_sse("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # disable proxy buffering so tokens arrive immediately
+        }
+    )
+
 @app.get("/api/chat/rate-limit")
 async def get_rate_limit_status(current_user = Depends(get_current_user)):
     """Get current rate limit status for the user"""
     try:
         chat_cache = get_chat_cache()
-        is_allowed, remaining = chat_cache.check_rate_limit(current_user.id)
+        is_allowed, remaining = chat_cache.check_rate_limit(current_user.id, consume=False)
         
         return {
             "allowed": is_allowed,
             "remaining": remaining,
-            "limit": 10,
-            "window_seconds": 60
+            "limit": chat_cache.RATE_LIMIT_MAX,
+            "window_seconds": chat_cache.RATE_LIMIT_WINDOW
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1851,60 +1992,82 @@ async def get_selected_wards():
 
 @app.get("/api/aqi/daily")
 async def get_daily_aqi_data(
+    response: Response,
     ward_no: Optional[str] = Query(None, description="Filter by ward number"),
     start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
-    limit: int = Query(100, description="Maximum number of records")
+    limit: int = Query(100, description="Maximum number of records"),
+    cursor: Optional[str] = Query(None, description="Keyset cursor from the X-Next-Cursor header of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    response_format: str = Query("rows", alias="format", description="Response format: rows, columnar, or arrow")
 ):
-    """Get daily average AQI data from Supabase"""
+    """
+    Get daily average AQI data from Supabase
+    Paginate with the cursor returned in the X-Next-Cursor header
+    """
+    validate_format(response_format)
     try:
-        query = supabase.table("ward_aqi_daily").select("*")
-        
-        if ward_no:
-            query = query.eq("ward_no", ward_no)
-        
-        if start_date:
-            query = query.gte("date", start_date)
-        
-        if end_date:
-            query = query.lte("date", end_date)
-        
-        query = query.order("date", desc=True).limit(limit)
-        response = query.execute()
-        
-        return response.data
+        history = get_daily_history_service()
+        page = history.query(
+            ward_no=ward_no,
+            start_date=start_date,
+            end_date=end_date,
+            columns=history.parse_columns(fields),
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    result = format_rows(page["rows"], response_format)
+    if page["next_cursor"]:
+        target = result if isinstance(result, Response) else response
+        target.headers["X-Next-Cursor"] = page["next_cursor"]
+        target.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor"
+    return result
 
 @app.get("/api/aqi/daily/{ward_no}")
 async def get_ward_daily_aqi(
     ward_no: str,
-    days: int = Query(30, description="Number of days to retrieve")
+    days: int = Query(30, description="Number of days to retrieve"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    response_format: str = Query("rows", alias="format", description="Response format: rows, columnar, or arrow")
 ):
     """Get daily AQI data for a specific ward"""
+    validate_format(response_format)
     try:
+        history = get_daily_history_service()
         start_date = (date.today() - timedelta(days=days)).isoformat()
         
-        response = supabase.table("ward_aqi_daily")\
-            .select("*")\
-            .eq("ward_no", ward_no)\
-            .gte("date", start_date)\
-            .order("date", desc=True)\
-            .execute()
-        
-        return response.data
+        page = history.query(
+            ward_no=ward_no,
+            start_date=start_date,
+            columns=history.parse_columns(fields),
+            limit=None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return format_rows(page["rows"], response_format)
+
+# Column order for columnar/arrow hourly responses
+HOURLY_READING_COLUMNS = ("time", "hour", "date", "aqi", "pm25", "pm10", "no2", "o3", "timestamp", "epoch")
 
 @app.get("/api/aqi/hourly/{ward_no}")
 async def get_ward_hourly_aqi(
     ward_no: str,
-    hours: int = Query(24, description="Number of hours to retrieve (max 48)")
+    hours: int = Query(24, description="Number of hours to retrieve (max 48)"),
+    response_format: str = Query("rows", alias="format", description="Response format: rows, columnar, or arrow")
 ):
     """
     Get hourly AQI data for a specific ward from Redis
     Returns hourly readings for the last N hours
     """
+    validate_format(response_format)
     try:
         # Use singleton instance to avoid creating new connections
         collector = get_collector()
@@ -1916,120 +2079,109 @@ async def get_ward_hourly_aqi(
         today = date.today()
         yesterday = today - timedelta(days=1)
         
-        all_readings = []
-        
-        # Get today's data
+        # Series are pre-formatted per ward-day (epoch/IST bucket stamped at ingest)
+        # and already ordered oldest first, so no parsing or sorting is needed
+        today_series = []
         try:
-            today_readings = collector.get_hourly_data_from_redis(ward_no, today)
-            if today_readings and isinstance(today_readings, list):
-                all_readings.extend(today_readings)
+            today_series = collector.get_hourly_series(ward_no, today)
         except Exception as e:
             logging.warning(f"Error fetching today's data for ward {ward_no}: {e}")
         
-        # Get yesterday's data if needed
-        if hours > len(all_readings):
+        yesterday_series = []
+        if hours > len(today_series):
             try:
-                yesterday_readings = collector.get_hourly_data_from_redis(ward_no, yesterday)
-                if yesterday_readings and isinstance(yesterday_readings, list):
-                    all_readings.extend(yesterday_readings)
+                yesterday_series = collector.get_hourly_series(ward_no, yesterday)
             except Exception as e:
                 logging.warning(f"Error fetching yesterday's data for ward {ward_no}: {e}")
         
-        # Sort by timestamp (oldest first) - handle missing timestamps
-        def get_sort_key(x):
-            if not isinstance(x, dict):
-                return ""
-            return x.get("fetched_at") or x.get("timestamp") or x.get("time") or ""
-        
-        all_readings.sort(key=get_sort_key)
+        all_readings = yesterday_series + today_series
         
         # Get last N hours
-        recent_readings = all_readings[-hours:] if len(all_readings) > hours else all_readings
-        
-        # Format for frontend
-        formatted_data = []
-        for reading in recent_readings:
-            if not isinstance(reading, dict):
-                logging.warning(f"Skipping invalid reading format: {type(reading)}")
-                continue
-                
-            # Get timestamp - try multiple fields
-            fetched_at = reading.get("fetched_at") or reading.get("timestamp") or reading.get("time")
-            
-            # If no timestamp found, skip this reading
-            if not fetched_at:
-                logging.warning(f"Skipping reading without timestamp: {reading}")
-                continue
-            
-            # Ensure fetched_at is a string
-            if not isinstance(fetched_at, str):
-                fetched_at = str(fetched_at)
-            
-            try:
-                # Parse datetime - handle different formats
-                dt = None
-                if 'Z' in fetched_at:
-                    dt = datetime.fromisoformat(fetched_at.replace('Z', '+00:00'))
-                elif '+' in fetched_at or fetched_at.count('-') >= 3:
-                    try:
-                        dt = datetime.fromisoformat(fetched_at)
-                    except ValueError:
-                        # Try parsing as timestamp
-                        try:
-                            dt = datetime.fromtimestamp(float(fetched_at))
-                        except (ValueError, TypeError):
-                            logging.warning(f"Could not parse timestamp: {fetched_at}")
-                            continue
-                else:
-                    # Fallback: try parsing as simple format
-                    try:
-                        dt = datetime.fromisoformat(fetched_at)
-                    except ValueError:
-                        logging.warning(f"Could not parse timestamp format: {fetched_at}")
-                        continue
-                
-                if dt is None:
-                    continue
-                
-                # Convert to IST (UTC+5:30) if timezone-aware, otherwise assume UTC
-                if dt.tzinfo is None:
-                    # Assume UTC if no timezone info
-                    dt = dt.replace(tzinfo=None)
-                    ist_offset = timedelta(hours=5, minutes=30)
-                    dt_ist = dt + ist_offset
-                else:
-                    # Convert from UTC to IST
-                    ist_offset = timedelta(hours=5, minutes=30)
-                    dt_utc = dt.replace(tzinfo=None) if dt.tzinfo else dt
-                    dt_ist = dt_utc + ist_offset
-                
-                formatted_data.append({
-                    "time": dt_ist.strftime("%H:00"),
-                    "hour": dt_ist.hour,
-                    "date": dt_ist.strftime("%Y-%m-%d"),
-                    "aqi": round(reading.get("aqi", 0), 1) if reading.get("aqi") is not None else None,
-                    "pm25": round(reading.get("pm25", 0), 1) if reading.get("pm25") is not None else None,
-                    "pm10": round(reading.get("pm10", 0), 1) if reading.get("pm10") is not None else None,
-                    "no2": round(reading.get("no2", 0), 1) if reading.get("no2") is not None else None,
-                    "o3": round(reading.get("o3", 0), 1) if reading.get("o3") is not None else None,
-                    "timestamp": fetched_at
-                })
-            except Exception as e:
-                logging.warning(f"Error formatting reading: {e}, reading: {reading}")
-                continue
+        formatted_data = all_readings[-hours:] if len(all_readings) > hours else all_readings
+        
+        if response_format == "arrow":
+            return to_arrow_response(
+                formatted_data,
+                HOURLY_READING_COLUMNS,
+                metadata={"ward_no": ward_no, "hours_requested": hours}
+            )
         
         return {
             "ward_no": ward_no,
-            "readings": formatted_data,
+            "readings": to_columnar(formatted_data, HOURLY_READING_COLUMNS) if response_format == "columnar" else formatted_data,
             "total_readings": len(formatted_data),
             "hours_requested": hours
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error getting hourly data for ward {ward_no}: {e}")
         logging.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error fetching hourly data: {str(e)}")
 
+@app.get("/api/aqi/export")
+def export_aqi_history(
+    from_date: str = Query(..., alias="from", description="Start date (YYYY-MM-DD, IST for hourly)"),
+    to_date: str = Query(..., alias="to", description="End date (YYYY-MM-DD, inclusive)"),
+    wards: Optional[str] = Query(None, description="Comma-separated ward numbers (default: all)"),
+    granularity: str = Query("daily", description="hourly or daily"),
+    export_format: str = Query("csv", alias="format", description="csv, ndjson, or parquet"),
+    gzip: bool = Query(True, description="Gzip-compress csv/ndjson output")
+):
+    """
+    Stream historical AQI data as a single download.
+    Rows are paged from the store in bounded chunks, so memory use is
+    constant regardless of the requested range.
+    """
+    if granularity not in aqi_export.EXPORT_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be one of: hourly, daily")
+    if export_format not in aqi_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be one of: csv, ndjson, parquet")
+    if export_format == "parquet" and not aqi_export.parquet_available():
+        raise HTTPException(status_code=400, detail="format=parquet is not available on this server (pyarrow not installed)")
+    
+    try:
+        start = date.fromisoformat(from_date)
+        end = date.fromisoformat(to_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from and to must be dates in YYYY-MM-DD format")
+    if end < start:
+        raise HTTPException(status_code=400, detail="to must not be before from")
+    if (end - start).days + 1 > aqi_export.EXPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"A single export may cover at most {aqi_export.EXPORT_MAX_DAYS} days")
+    
+    ward_list = [w.strip() for w in wards.split(",") if w.strip()] if wards else None
+    
+    local_store = get_local_store()
+    if granularity == "hourly":
+        if local_store:
+            chunks = aqi_export.iter_local_hourly(local_store, start, end, ward_list)
+        else:
+            chunks = aqi_export.iter_redis_hourly(get_collector(), start, end, ward_list)
+    else:
+        if local_store and local_store.covers_daily(supabase):
+            chunks = aqi_export.iter_local_daily(local_store, start, end, ward_list)
+        else:
+            chunks = aqi_export.iter_supabase_daily(supabase, start, end, ward_list)
+    
+    columns = aqi_export.export_columns(granularity)
+    body = aqi_export.ENCODERS[export_format](chunks, columns)
+    
+    filename = f"jandrishti_aqi_{granularity}_{start.isoformat()}_{end.isoformat()}.{export_format}"
+    media_type = aqi_export.MEDIA_TYPES[export_format]
+    if gzip and export_format != "parquet":
+        # Parquet is already compressed internally
+        body = aqi_export.gzip_stream(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.get("/api/aqi/scheduler/status")
 async def get_scheduler_status():
     """Get status of the AQI data collection scheduler"""
@@ -2055,275 +2207,63 @@ async def get_scheduler_status():
 async def get_ai_forecast(
     ward_no: str,
     period: str = Query("7d", description="Forecast period: 24h, 7d, or 30d"),
-    metric: str = Query("aqi", description="Metric to forecast: aqi, pm25, pm10, no2, o3")
+    metric: str = Query("aqi", description="Metric to forecast: aqi, pm25, pm10, no2, o3"),
+    narrative: bool = Query(False, description="Add a short AI-written summary of the forecast")
 ):
     """
-    Get AI-powered pollution forecast for a specific ward using Groq API
-    Analyzes historical data and generates predictions
+    Get pollution forecast for a specific ward
+    Fits seasonal-naive / Holt-Winters models to the ward's history locally;
+    Groq is only used for the optional narrative text
     """
     try:
         # Validate inputs
-        if period not in ["24h", "7d", "30d"]:
+        if period not in forecasting.PERIODS:
             raise AppException("Period must be one of: 24h, 7d, 30d", status_code=400)
-        if metric not in ["aqi", "pm25", "pm10", "no2", "o3"]:
+        if metric not in forecasting.METRICS:
             raise AppException("Metric must be one of: aqi, pm25, pm10, no2, o3", status_code=400)
         
         # Use singleton instance
         collector = get_collector()
         
         # Find ward
-        ward = next((w for w in collector.selected_wards if w.get("ward_no") == ward_no), None)
+        ward = collector.get_ward(ward_no)
         if not ward:
             raise AppException(f"Ward {ward_no} not found", status_code=404)
         
-        # Get historical data based on period
-        today = date.today()
-        historical_data = []
-        
-        if period == "24h":
-            # Get last 7 days of hourly data for pattern analysis
-            for i in range(7):
-                target_date = today - timedelta(days=i)
-                day_data = collector.get_hourly_data_from_redis(ward_no, target_date)
-                historical_data.extend(day_data)
-        elif period == "7d":
-            # Get last 30 days of daily averages
-            try:
-                response = supabase.table("ward_aqi_daily")\
-                    .select("*")\
-                    .eq("ward_no", ward_no)\
-                    .order("date", desc=True)\
-                    .limit(30)\
-                    .execute()
-                historical_data = response.data or []
-            except Exception as e:
-                logger.warning(f"Could not fetch daily data from Supabase: {e}")
-                # Fallback to hourly data
-                for i in range(30):
-                    target_date = today - timedelta(days=i)
-                    day_data = collector.get_hourly_data_from_redis(ward_no, target_date)
-                    if day_data:
-                        # Calculate average for the day
-                        avg_aqi = sum(r.get("aqi", 0) for r in day_data if r.get("aqi")) / len(day_data) if day_data else None
-                        if avg_aqi:
-                            historical_data.append({
-                                "date": target_date.isoformat(),
-                                "aqi": avg_aqi,
-                                "pm25": sum(r.get("pm25", 0) for r in day_data if r.get("pm25")) / len([r for r in day_data if r.get("pm25")]) if any(r.get("pm25") for r in day_data) else None,
-                                "pm10": sum(r.get("pm10", 0) for r in day_data if r.get("pm10")) / len([r for r in day_data if r.get("pm10")]) if any(r.get("pm10") for r in day_data) else None,
-                                "no2": sum(r.get("no2", 0) for r in day_data if r.get("no2")) / len([r for r in day_data if r.get("no2")]) if any(r.get("no2") for r in day_data) else None,
-                                "o3": sum(r.get("o3", 0) for r in day_data if r.get("o3")) / len([r for r in day_data if r.get("o3")]) if any(r.get("o3") for r in day_data) else None,
-                            })
-        else:  # 30d
-            # Get last 90 days of daily averages
-            try:
-                response = supabase.table("ward_aqi_daily")\
-                    .select("*")\
-                    .eq("ward_no", ward_no)\
-                    .order("date", desc=True)\
-                    .limit(90)\
-                    .execute()
-                historical_data = response.data or []
-            except Exception as e:
-                logger.warning(f"Could not fetch daily data from Supabase: {e}")
-        
-        if not historical_data:
-            raise AppException(
-                "Insufficient historical data for forecast. Please wait for more data to be collected.",
-                status_code=404
-            )
-        
-        # Prepare data for Groq analysis
-        historical_summary = []
-        for data_point in historical_data[-20:]:  # Last 20 data points for context
-            value = data_point.get(metric)
-            if value is not None:
-                historical_summary.append({
-                    "date": data_point.get("date") or data_point.get("fetched_at", ""),
-                    "value": float(value)
-                })
-        
-        if not historical_summary:
-            raise AppException(f"No historical data available for {metric}", status_code=404)
-        
-        # Calculate basic statistics
-        values = [d["value"] for d in historical_summary]
-        avg_value = sum(values) / len(values)
-        min_value = min(values)
-        max_value = max(values)
-        recent_trend = "increasing" if len(values) > 1 and values[-1] > values[-2] else "decreasing" if len(values) > 1 and values[-1] < values[-2] else "stable"
-        
-        # Create prompt for Groq
-        forecast_prompt = f"""You are an AI environmental analyst. Analyze the following historical {metric.upper()} data for {ward.get('ward_name')} (Ward {ward_no}) and generate a {period} forecast.
-
-Historical Data (last {len(historical_summary)} readings):
-{chr(10).join([f"- {d['date']}: {d['value']:.1f}" for d in historical_summary[-10:]])}
-
-Statistics:
-- Average: {avg_value:.1f}
-- Minimum: {min_value:.1f}
-- Maximum: {max_value:.1f}
-- Recent Trend: {recent_trend}
-
-Generate a {period} forecast with the following requirements:
-1. Analyze patterns, trends, and seasonality in the data
-2. Predict future values for {metric.upper()}
-3. Consider typical pollution patterns (morning peaks, evening peaks, weekly patterns, etc.)
-4. Provide realistic predictions based on historical patterns
-5. Include confidence scores (0-100%) for each prediction
-
-Return ONLY a JSON array with this exact format:
-[
-  {{"time": "HH:MM" or "Day", "{metric}": <predicted_value>, "confidence": <0-100>}},
-  ...
-]
-
-For 24h: Provide hourly predictions (24 data points)
-For 7d: Provide daily predictions (7 data points, use day names: Mon, Tue, Wed, etc.)
-For 30d: Provide daily predictions (30 data points, use day names)
-
-IMPORTANT: Return ONLY valid JSON, no explanations, no markdown, just the array."""
-        
-        # Call Groq API
-        try:
-            chat_completion = groq_client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert environmental data analyst. You analyze air quality data and generate accurate forecasts. Always respond with valid JSON arrays only."
-                    },
-                    {
-                        "role": "user",
-                        "content": forecast_prompt
-                    }
-                ],
-                model="llama-3.3-70b-versatile",
-                temperature=0.3,  # Lower temperature for more consistent predictions
-                max_tokens=2000
-            )
-            
-            ai_response = chat_completion.choices[0].message.content
-            
-            # Parse JSON response
-            # Try to extract JSON from response (in case it's wrapped in markdown)
-            if "```json" in ai_response:
-                ai_response = ai_response.split("```json")[1].split("```")[0].strip()
-            elif "```" in ai_response:
-                ai_response = ai_response.split("```")[1].split("```")[0].strip()
-            
-            # Try parsing as array or object
-            try:
-                forecast_data = json.loads(ai_response)
-                # If it's an object with a key, extract the array
-                if isinstance(forecast_data, dict):
-                    for key in forecast_data:
-                        if isinstance(forecast_data[key], list):
-                            forecast_data = forecast_data[key]
-                            break
-            except json.JSONDecodeError:
-                # Try to extract array from text
-                array_match = re.search(r'\[.*\]', ai_response, re.DOTALL)
-                if array_match:
-                    forecast_data = json.loads(array_match.group())
-                else:
-                    raise ValueError("Could not parse forecast data from AI response")
-            
-            # Validate and format forecast data
-            if not isinstance(forecast_data, list):
-                raise ValueError("Forecast data is not a list")
-            
-            # Ensure all required fields
-            formatted_forecast = []
-            for item in forecast_data:
-                if isinstance(item, dict):
-                    formatted_forecast.append({
-                        "time": item.get("time", ""),
-                        "day": item.get("day", item.get("time", "")),
-                        metric: float(item.get(metric, item.get("value", avg_value))),
-                        "confidence": float(item.get("confidence", 85.0))
-                    })
-            
-            # If we don't have enough data points, generate them
-            expected_points = 24 if period == "24h" else (7 if period == "7d" else 30)
-            if len(formatted_forecast) < expected_points:
-                # Use the last value and trend to generate remaining points
-                last_value = formatted_forecast[-1][metric] if formatted_forecast else avg_value
-                trend_factor = 1.02 if recent_trend == "increasing" else 0.98 if recent_trend == "decreasing" else 1.0
-                
-                for i in range(len(formatted_forecast), expected_points):
-                    if period == "24h":
-                        hour = i
-                        time_str = f"{hour:02d}:00"
-                    else:
-                        days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-                        day_idx = i % 7
-                        time_str = days[day_idx]
-                    
-                    # Apply slight variation
-                    variation = (i % 3 - 1) * (max_value - min_value) * 0.05
-                    predicted_value = last_value * (trend_factor ** (i - len(formatted_forecast))) + variation
-                    predicted_value = max(min_value * 0.8, min(max_value * 1.2, predicted_value))  # Keep within reasonable bounds
-                    
-                    formatted_forecast.append({
-                        "time": time_str,
-                        "day": time_str,
-                        metric: round(predicted_value, 1),
-                        "confidence": max(70.0, 95.0 - (i * 0.5))  # Decreasing confidence for further predictions
-                    })
-            
-            # Calculate overall confidence
-            avg_confidence = sum(f.get("confidence", 85) for f in formatted_forecast) / len(formatted_forecast)
-            
-            return {
-                "ward_no": ward_no,
-                "ward_name": ward.get("ward_name"),
-                "period": period,
-                "metric": metric,
-                "forecast": formatted_forecast[:expected_points],
-                "confidence": round(avg_confidence, 1),
-                "historical_data_points": len(historical_summary),
-                "trend": recent_trend,
-                "generated_at": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating AI forecast with Groq: {e}", exc_info=True)
-            # Fallback: Generate simple forecast based on statistics
-            expected_points = 24 if period == "24h" else (7 if period == "7d" else 30)
-            fallback_forecast = []
+        # Serve the precomputed forecast; compute and store it only if missing or stale
+        result = forecasting.get_precomputed_forecast(collector, ward_no, period, metric)
+        if not result:
+            historical_data = forecasting.load_forecast_history(collector, ward_no, period)
+            if not historical_data:
+                raise AppException(
+                    "Insufficient historical data for forecast. Please wait for more data to be collected.",
+                    status_code=404
+                )
             
-            for i in range(expected_points):
-                if period == "24h":
-                    time_str = f"{i:02d}:00"
-                else:
-                    days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-                    time_str = days[i % 7] if period == "7d" else f"Day {i+1}"
-                
-                # Simple trend-based prediction
-                trend_factor = 1.01 if recent_trend == "increasing" else 0.99 if recent_trend == "decreasing" else 1.0
-                base_value = values[-1] if values else avg_value
-                predicted_value = base_value * (trend_factor ** i)
-                predicted_value = max(min_value * 0.9, min(max_value * 1.1, predicted_value))
-                
-                fallback_forecast.append({
-                    "time": time_str,
-                    "day": time_str,
-                    metric: round(predicted_value, 1),
-                    "confidence": max(70.0, 90.0 - (i * 0.3))
-                })
+            result = forecasting.build_forecast(period, metric, historical_data)
+            if not result:
+                raise AppException(f"No historical data available for {metric}", status_code=404)
             
-            return {
-                "ward_no": ward_no,
-                "ward_name": ward.get("ward_name"),
-                "period": period,
-                "metric": metric,
-                "forecast": fallback_forecast,
-                "confidence": 75.0,
-                "historical_data_points": len(historical_summary),
-                "trend": recent_trend,
-                "generated_at": datetime.utcnow().isoformat(),
-                "note": "Fallback forecast (AI service unavailable)"
-            }
+            result["generated_at"] = datetime.utcnow().isoformat()
+            forecasting.store_forecasts(collector, period, {ward_no: {metric: result}}, result["generated_at"])
+        
+        response = {
+            "ward_no": ward_no,
+            "ward_name": ward.get("ward_name"),
+            "period": period,
+            "metric": metric,
+            "forecast": result["forecast"],
+            "confidence": result["confidence"],
+            "historical_data_points": result["historical_data_points"],
+            "trend": result["trend"],
+            "model": result["model"],
+            "generated_at": result["generated_at"]
+        }
+        
+        if narrative:
+            response["narrative"] = await generate_forecast_narrative(ward.get("ward_name"), period, metric, result)
+        
+        return response
         
     except AppException:
         raise
@@ -2334,6 +2274,44 @@ IMPORTANT: Return ONLY valid JSON, no explanations, no markdown, just the array.
             status_code=500
         )
 
+async def generate_forecast_narrative(ward_name: str, period: str, metric: str, result: dict) -> Optional[str]:
+    """Ask Groq for a 2-3 sentence summary of a computed forecast. Returns None if unavailable."""
+    points = result["forecast"]
+    peak = max(points, key=lambda p: p[metric])
+    cleanest = min(points, key=lambda p: p[metric])
+    stats = result["stats"]
+    
+    prompt = f"""Summarize this {period} {metric.upper()} forecast for {ward_name}, Delhi in 2-3 short sentences for residents.
+
+- Recent average: {stats['average']:.1f} (min {stats['minimum']:.1f}, max {stats['maximum']:.1f})
+- Trend: {result['trend']}
+- Forecast peak: {peak[metric]:.1f} at {peak['time']} ({peak['day']})
+- Forecast low: {cleanest[metric]:.1f} at {cleanest['time']} ({cleanest['day']})
+- Forecast confidence: {result['confidence']:.0f}%
+
+Mention when air will be worst and best, and one practical precaution. Do not invent numbers."""
+    
+    try:
+        narrative = await llm_gateway.complete(
+            [
+                {
+                    "role": "system",
+                    "content": "You are an expert environmental data analyst who explains air quality forecasts clearly and concisely."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            model="llama-3.3-70b-versatile",
+            temperature=0.3,
+            max_tokens=200
+        )
+        return narrative.strip()
+    except LLMUnavailableError as e:
+        logger.warning(f"Could not generate forecast narrative: {e}")
+        return None
+
 @app.post("/api/aqi/scheduler/trigger/hourly")
 async def trigger_hourly_collection():
     """Manually trigger hourly AQI data collection"""
@@ -2354,6 +2332,16 @@ async def trigger_daily_calculation():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/aqi/scheduler/trigger/forecasts")
+async def trigger_forecast_precompute():
+    """Manually trigger forecast precomputation for all wards, periods and metrics"""
+    try:
+        scheduler = get_scheduler()
+        scheduler.trigger_forecast_precompute()
+        return {"message": "Forecast precomputation triggered successfully"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # WhatsApp Subscription Endpoints
 @app.post("/api/whatsapp/subscribe")
 async def subscribe_whatsapp(
@@ -2374,9 +2362,9 @@ async def subscribe_whatsapp(
         phone_number = subscription.phone_number
         if not phone_number:
             try:
-                profile = supabase.table("profiles").select("phone").eq("id", current_user.id).single().execute()
-                if profile.data and profile.data.get("phone"):
-                    phone_number = profile.data.get("phone")
+                profile = profile_repository.get(current_user.id)
+                if profile and profile.get("phone"):
+                    phone_number = profile.get("phone")
                 else:
                     raise HTTPException(
                         status_code=400,
@@ -2451,8 +2439,8 @@ Stay informed, stay safe! 🌱"""
                 if email_service.is_configured:
                     # Get user email
                     try:
-                        profile = supabase.table("profiles").select("email").eq("id", current_user.id).single().execute()
-                        user_email = profile.data.get("email") if profile.data else current_user.email
+                        profile = profile_repository.get(current_user.id)
+                        user_email = profile.get("email") if profile else current_user.email
                     except:
                         user_email = current_user.email
                     
@@ -2598,8 +2586,8 @@ async def quick_subscribe_whatsapp(
     """Quick subscribe using phone from profile"""
     try:
         # Get phone from profile
-        profile = supabase.table("profiles").select("phone").eq("id", current_user.id).single().execute()
-        phone_number = profile.data.get("phone") if profile.data else None
+        profile = profile_repository.get(current_user.id)
+        phone_number = profile.get("phone") if profile else None
         
         if not phone_number:
             raise HTTPException(
@@ -2793,6 +2781,11 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """LLM gateway token, latency, cache and circuit breaker counters"""
+    return llm_gateway.get_stats()
+
 # Test endpoint to verify Vercel routing
 @app.get("/test")
 async def test():
@@ -1,121 +1,481 @@
 """
 Response caching middleware for AQI endpoints
-Uses Redis to cache responses and reduce external API calls
+Uses Redis to cache responses and reduce external API calls.
+Entries hold the raw response bytes (gzip-compressed when large) behind a
+compact binary header envelope, so neither hits nor misses do any JSON work.
+Entries are tagged with the data they depend on (ward readings, daily
+averages, dates, the published snapshot) and stay fresh until a cache event
+reports a change to that data; untagged routes use a fixed CACHE_TTL. Stale
+entries are served (up to the hard TTL) while one request, holding a Redis
+lock, refreshes them in the background; identical concurrent misses in a
+worker share one upstream request.
+Fresh entries are also kept in an in-process LRU (bounded by size) so hot
+endpoints are served from memory; it is kept coherent across workers by the
+cache event channel, which drops only the entries tagged with changed data.
 """
-from fastapi import Request
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
-import json
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import gzip
+import time
+import threading
+import uuid
+import struct
+import asyncio
 import hashlib
 import logging
+from datetime import date, datetime, timedelta
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from chat_cache import get_chat_cache
+from cache_events import (
+    TAG_CHANGES_KEY, SNAPSHOT_TAG, DAILY_TAG,
+    ward_tag, daily_tag, date_tag, get_cache_event_subscriber
+)
 
 logger = logging.getLogger(__name__)
 
-# Cache configuration
+# Fresh lifetime of tagged entries: they are invalidated by cache events, and
+# additionally expire at local midnight, when date-relative queries roll over
+EVENT_TTL = 86400
+
+# Cache configuration (fresh TTLs)
 CACHE_TTL = {
-    "/api/aqi/feed/": 300,  # 5 minutes for feed data
-    "/api/aqi/hourly/": 60,  # 1 minute for hourly data
-    "/api/aqi/daily": 3600,  # 1 hour for daily data
+    "/api/aqi/feed/": 300,  # 5 minutes for feed data (external, no change events)
+    "/api/aqi/hourly/": EVENT_TTL,  # until the ward's next hourly reading
+    "/api/aqi/daily": EVENT_TTL,  # until a daily average is written
     "/api/aqi/wards": 60,  # 1 minute for wards list (reduced for faster updates)
+    "/api/delhi-aqi": EVENT_TTL,  # until the next snapshot or daily average for today
+}
+
+# Data each cached route depends on, as cache event tags; "{ward_no}" is the last
+# path segment and "{today}" the local date. The first matching prefix wins.
+CACHE_TAGS = {
+    "/api/aqi/hourly/": (ward_tag("{ward_no}"),),
+    "/api/aqi/daily/": (daily_tag("{ward_no}"),),
+    "/api/aqi/daily": (DAILY_TAG,),
+    "/api/delhi-aqi": (SNAPSHOT_TAG, date_tag("{today}")),
 }
 
-class CacheMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+# Stale entries are kept (and served while refreshing) until STALE_TTL_FACTOR x the fresh TTL,
+# but never longer than MAX_ENTRY_TTL
+STALE_TTL_FACTOR = 10
+MAX_ENTRY_TTL = 86400 * 2
+REFRESH_LOCK_TTL = 30  # seconds a worker may hold the refresh lock
+COALESCE_TIMEOUT = 30  # seconds a request waits for an identical in-flight miss
+
+# In-process tier: total size of the entries kept per worker, and the largest single entry
+LOCAL_MAX_BYTES = 32 * 1024 * 1024
+LOCAL_MAX_ENTRY_BYTES = 2 * 1024 * 1024
+SUBSCRIBE_RETRY_INTERVAL = 30  # seconds between attempts to join the cache event channel
+
+# Bodies at least this large are stored gzip-compressed
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 5
+
+# Headers not replayed from cached responses (recomputed for the cached body)
+UNCACHED_HEADERS = {b"content-length", b"content-encoding", b"transfer-encoding", b"x-cache", b"vary"}
+
+# Envelope: version (1 byte), flags (1), status (2), stored-at epoch (8), fresh-until epoch (8),
+# header count (2), then per header key length (2), key, value length (2), value; the body follows
+ENVELOPE_VERSION = 3
+FLAG_GZIP = 0x01
+_PREFIX = struct.Struct(">BBHddH")
+_LENGTH = struct.Struct(">H")
+
+
+def encode_entry(status_code: int, headers, body: bytes, stored_at: float, fresh_until: float) -> bytes:
+    """Pack a response into a cache entry, compressing large bodies"""
+    flags = 0
+    if len(body) >= COMPRESS_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
+        flags |= FLAG_GZIP
+    parts = [_PREFIX.pack(ENVELOPE_VERSION, flags, status_code, stored_at, fresh_until, len(headers))]
+    for key, value in headers:
+        parts.append(_LENGTH.pack(len(key)))
+        parts.append(key)
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(value)
+    parts.append(body)
+    return b"".join(parts)
+
+
+def decode_entry(entry: bytes):
+    """Unpack a cache entry into (status_code, headers, body, gzipped, stored_at, fresh_until)"""
+    version, flags, status_code, stored_at, fresh_until, header_count = _PREFIX.unpack_from(entry, 0)
+    if version != ENVELOPE_VERSION:
+        raise ValueError(f"Unknown cache entry version {version}")
+    offset = _PREFIX.size
+    headers = []
+    for _ in range(header_count):
+        (length,) = _LENGTH.unpack_from(entry, offset)
+        key = entry[offset + 2:offset + 2 + length]
+        offset += 2 + length
+        (length,) = _LENGTH.unpack_from(entry, offset)
+        value = entry[offset + 2:offset + 2 + length]
+        offset += 2 + length
+        headers.append((key, value))
+    return status_code, headers, entry[offset:], bool(flags & FLAG_GZIP), stored_at, fresh_until
+
+
+def cache_tags(path: str) -> Tuple[str, ...]:
+    """Cache event tags of the data a cached path depends on"""
+    for prefix, tags in CACHE_TAGS.items():
+        if path.startswith(prefix):
+            ward_no = path.rstrip("/").rsplit("/", 1)[-1]
+            today = date.today().isoformat()
+            return tuple(tag.format(ward_no=ward_no, today=today) for tag in tags)
+    return ()
+
+
+def freshness_deadline(started_at: float, cache_ttl: int, tags: Tuple[str, ...]) -> float:
+    """When an entry stops being fresh; tagged entries also expire at the next local midnight"""
+    expires_at = started_at + cache_ttl
+    if tags:
+        midnight = datetime.combine(date.fromtimestamp(started_at) + timedelta(days=1), datetime.min.time())
+        expires_at = min(expires_at, midnight.timestamp())
+    return expires_at
+
+
+class LocalResponseCache:
+    """
+    In-process LRU of decoded cache entries, evicted by total size.
+    Also remembers when each tag was last invalidated, so entries read back
+    from Redis that predate a data change are not treated as fresh.
+    """
+    def __init__(self, max_bytes: int = LOCAL_MAX_BYTES, max_entry_bytes: int = LOCAL_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, Tuple[tuple, int, Tuple[str, ...]]]" = OrderedDict()
+        self._tagged: Dict[str, set] = {}
+        self._invalidated_at: Dict[str, float] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def get(self, cache_key: str) -> Optional[tuple]:
+        """Fresh decoded entry for a key, or None"""
+        with self._lock:
+            item = self._entries.get(cache_key)
+            if item is None:
+                return None
+            if time.time() >= item[0][-1]:
+                self._remove(cache_key)
+                return None
+            self._entries.move_to_end(cache_key)
+            return item[0]
+    
+    def set(self, cache_key: str, entry: tuple, size: int, tags: Tuple[str, ...], stored_at: float):
+        """Keep a decoded entry unless it is too large or its data changed after stored_at"""
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            if self._invalidated_since(tags, stored_at):
+                return
+            self._remove(cache_key)
+            self._entries[cache_key] = (entry, size, tags)
+            self._size += size
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(cache_key)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+    
+    def _remove(self, cache_key: str):
+        item = self._entries.pop(cache_key, None)
+        if item is None:
+            return
+        _, size, tags = item
+        self._size -= size
+        for tag in tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(cache_key)
+                if not keys:
+                    del self._tagged[tag]
+    
+    def invalidate(self, tags: Optional[List[str]], event: Optional[Dict] = None):
+        """Drop entries tagged with any of tags (every entry if tags is None, merging the event's tag changes)"""
+        changed_at = float((event or {}).get("changed_at") or time.time())
+        if tags is None:
+            with self._lock:
+                self._entries.clear()
+                self._tagged.clear()
+                self._size = 0
+            self.note_changes((event or {}).get("changes") or {})
+            return
+        with self._lock:
+            for tag in tags:
+                self._invalidated_at[tag] = max(self._invalidated_at.get(tag, 0), changed_at)
+                for cache_key in list(self._tagged.get(tag, ())):
+                    self._remove(cache_key)
+    
+    def note_changes(self, changes: Dict[str, float]):
+        """Merge tag change times read from Redis (covers events this worker missed)"""
+        with self._lock:
+            for tag, changed_at in changes.items():
+                if changed_at > self._invalidated_at.get(tag, 0):
+                    self._invalidated_at[tag] = changed_at
+    
+    def invalidated_since(self, tags: Tuple[str, ...], stored_at: float) -> bool:
+        """Whether any of tags was invalidated after an entry was stored"""
+        with self._lock:
+            return self._invalidated_since(tags, stored_at)
+    
+    def _invalidated_since(self, tags: Tuple[str, ...], stored_at: float) -> bool:
+        return any(self._invalidated_at.get(tag, 0) > stored_at for tag in tags)
+
+
+class CacheMiddleware:
+    """
+    Pure ASGI response cache: hits are answered from Redis; on a miss the
+    response streams through unchanged while a copy of the body is collected
+    and stored once the last chunk has been sent.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # In-flight misses in this worker: cache key -> future of (status, headers, body)
+        self._in_flight = {}
+        # Keep references to background refreshes so they are not garbage collected
+        self._refreshes = set()
+        # In-process tier, used while this worker receives cache events
+        self.local = LocalResponseCache()
+        self._subscriber = None
+        self._subscribed = False
+        self._subscribe_retry_at = 0.0
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         # Only cache GET requests
-        if request.method != "GET":
-            return await call_next(request)
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        
+        query_string = scope.get("query_string", b"").decode("latin-1")
         
         # Allow cache bypass with ?nocache=true query parameter
-        if request.url.query and "nocache=true" in request.url.query:
-            return await call_next(request)
+        if "nocache=true" in query_string:
+            await self.app(scope, receive, send)
+            return
         
         # Check if this endpoint should be cached
+        path = scope["path"]
         cache_ttl = None
-        for path, ttl in CACHE_TTL.items():
-            if request.url.path.startswith(path):
+        for prefix, ttl in CACHE_TTL.items():
+            if path.startswith(prefix):
                 cache_ttl = ttl
                 break
         
         if not cache_ttl:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
         
         # Generate cache key from request
-        cache_key = self._generate_cache_key(request)
+        cache_key = self._generate_cache_key(path, query_string)
+        tags = cache_tags(path)
+        started_at = time.time()
+        
+        # In-process tier: fresh entries are served without touching Redis
+        if self._ensure_subscribed():
+            local_entry = self.local.get(cache_key)
+            if local_entry is not None:
+                status_code, headers, body, gzipped, _, _ = local_entry
+                await self._send_cached(scope, send, status_code, headers, body, gzipped, b"HIT-LOCAL")
+                return
         
         try:
             chat_cache = get_chat_cache()
             
-            # Try to get from cache
-            cached_response = chat_cache.redis_client.get(cache_key)
-            if cached_response:
-                logger.debug(f"Cache hit for {request.url.path}")
-                cached_data = json.loads(cached_response)
-                return JSONResponse(
-                    content=cached_data["content"],
-                    status_code=cached_data["status_code"],
-                    headers={**cached_data.get("headers", {}), "X-Cache": "HIT"}
-                )
+            # Try to get from cache, with the last change time of the entry's data
+            pipe = chat_cache.binary_client.pipeline(transaction=False)
+            pipe.get(cache_key)
+            if tags:
+                pipe.hmget(TAG_CHANGES_KEY, list(tags))
+            cached_response, *changed = pipe.execute()
+            if changed:
+                self.local.note_changes({
+                    tag: float(value) for tag, value in zip(tags, changed[0]) if value is not None
+                })
+            cached_entry = decode_entry(cached_response) if cached_response else None
+        except Exception as e:
+            logger.error(f"Cache middleware error: {e}")
+            # If caching fails, just process request normally
+            await self.app(scope, receive, send)
+            return
+        
+        if cached_entry:
+            status_code, headers, body, gzipped, stored_at, fresh_until = cached_entry
+            # Entries stored before a change to their data are stale even within their TTL
+            if started_at < fresh_until and not self.local.invalidated_since(tags, stored_at):
+                logger.debug(f"Cache hit for {path}")
+                if self._local_enabled():
+                    self.local.set(cache_key, cached_entry, len(cached_response), tags, stored_at)
+                await self._send_cached(scope, send, status_code, headers, body, gzipped, b"HIT")
+                return
             
-            # Cache miss - process request
-            response = await call_next(request)
+            # Stale: serve it now, and let one request across workers refresh it
+            logger.debug(f"Stale cache hit for {path}")
+            self._refresh_in_background(chat_cache, cache_key, cache_ttl, scope, path, tags)
+            await self._send_cached(scope, send, status_code, headers, body, gzipped, b"STALE")
+            return
+        
+        # Identical miss already in flight in this worker: share its response
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            try:
+                status_code, headers, body = await asyncio.wait_for(asyncio.shield(in_flight), COALESCE_TIMEOUT)
+            except Exception:
+                # The leading request failed or was not cacheable - run our own
+                await self.app(scope, receive, send)
+                return
+            await self._send_cached(scope, send, status_code, headers, body, False, b"COALESCED")
+            return
+        
+        # Cache miss - process request, collecting a copy of successful bodies
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        start_message = {}
+        body_parts = []
+        
+        async def send_and_collect(message: Message):
+            if message["type"] == "http.response.start":
+                start_message.update(message)
+                if message["status"] == 200:
+                    MutableHeaders(scope=message)["X-Cache"] = "MISS"
+            elif message["type"] == "http.response.body" and start_message.get("status") == 200:
+                body_parts.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    entry = self._store(chat_cache, cache_key, cache_ttl, start_message, b"".join(body_parts), path, tags, started_at)
+                    if entry is not None and not future.done():
+                        future.set_result(entry)
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_and_collect)
+        finally:
+            self._in_flight.pop(cache_key, None)
+            if not future.done():
+                future.set_exception(RuntimeError("Response not cacheable"))
+                # Mark retrieved so waiter-less futures don't log "exception never retrieved"
+                future.exception()
+    
+    def _local_enabled(self) -> bool:
+        """Whether the in-process tier is in use: subscribed, and not missing events after a connection loss"""
+        return self._subscribed and self._subscriber.connected
+    
+    def _ensure_subscribed(self) -> bool:
+        """Join the cache event channel; the in-process tier is only used while subscribed"""
+        if self._subscribed:
+            return self._local_enabled()
+        now = time.monotonic()
+        if now < self._subscribe_retry_at:
+            return False
+        self._subscribe_retry_at = now + SUBSCRIBE_RETRY_INTERVAL
+        try:
+            subscriber = get_cache_event_subscriber()
+            subscriber.add_listener(self.local.invalidate)
+            subscriber.start()
+            self._subscriber = subscriber
+            self._subscribed = True
+        except Exception as e:
+            logger.warning(f"Cache event subscription failed, serving from Redis only: {e}")
+        return self._local_enabled()
+    
+    def _refresh_in_background(self, chat_cache, cache_key: str, cache_ttl: int, scope: Scope, path: str, tags: Tuple[str, ...]):
+        """Re-run the request in the background if this worker wins the refresh lock"""
+        lock_key = f"{cache_key}:refresh"
+        token = uuid.uuid4().hex
+        try:
+            if not chat_cache.redis_client.set(lock_key, token, nx=True, ex=REFRESH_LOCK_TTL):
+                return
+        except Exception as e:
+            logger.warning(f"Cache refresh lock error: {e}")
+            return
+        
+        async def refresh():
+            started_at = time.time()
+            start_message = {}
+            body_parts = []
             
-            # Cache successful responses only
-            if response.status_code == 200:
+            async def receive() -> Message:
+                return {"type": "http.request", "body": b"", "more_body": False}
+            
+            async def collect(message: Message):
+                if message["type"] == "http.response.start":
+                    start_message.update(message)
+                elif message["type"] == "http.response.body":
+                    body_parts.append(message.get("body", b""))
+            
+            try:
+                await self.app(dict(scope), receive, collect)
+                if start_message.get("status") == 200:
+                    self._store(chat_cache, cache_key, cache_ttl, start_message, b"".join(body_parts), path, tags, started_at)
+            except Exception as e:
+                logger.warning(f"Background cache refresh failed for {path}: {e}")
+            finally:
                 try:
-                    # Read response body
-                    response_body = b""
-                    async for chunk in response.body_iterator:
-                        response_body += chunk
-                    
-                    # Parse JSON
-                    response_data = json.loads(response_body)
-                    
-                    # Store in cache
-                    cache_data = {
-                        "content": response_data,
-                        "status_code": response.status_code,
-                        "headers": dict(response.headers)
-                    }
-                    chat_cache.redis_client.setex(
-                        cache_key,
-                        cache_ttl,
-                        json.dumps(cache_data)
-                    )
-                    
-                    logger.debug(f"Cached response for {request.url.path}")
-                    
-                    # Return response with cache header
-                    return JSONResponse(
-                        content=response_data,
-                        status_code=response.status_code,
-                        headers={**response.headers, "X-Cache": "MISS"}
-                    )
-                except Exception as e:
-                    logger.warning(f"Error caching response: {e}")
-                    # Return original response if caching fails
-                    return Response(
-                        content=response_body,
-                        status_code=response.status_code,
-                        headers=response.headers
-                    )
+                    # Release the lock only if it is still ours
+                    if chat_cache.redis_client.get(lock_key) == token:
+                        chat_cache.redis_client.delete(lock_key)
+                except Exception:
+                    pass
+        
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+    
+    async def _send_cached(self, scope: Scope, send: Send, status_code: int, headers, body: bytes, gzipped: bool, cache_status: bytes):
+        """Send a cached entry as-is; compressed bodies go out compressed if the client accepts gzip"""
+        if gzipped:
+            if "gzip" in Headers(scope=scope).get("accept-encoding", ""):
+                headers = headers + [(b"content-encoding", b"gzip")]
+            else:
+                body = gzip.decompress(body)
+            headers = headers + [(b"vary", b"Accept-Encoding")]
+        
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": headers + [
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"x-cache", cache_status),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+    
+    def _store(self, chat_cache, cache_key: str, cache_ttl: int, start_message: Message, body: bytes, path: str,
+               tags: Tuple[str, ...], started_at: float):
+        """
+        Cache successful responses only
+        Freshness counts from when the request started, before its data was read
+        Returns the stored (status, headers, body) or None if the response was not cached
+        """
+        try:
+            headers = [
+                (key.lower(), value)
+                for key, value in start_message.get("headers", [])
+                if key.lower() not in UNCACHED_HEADERS
+            ]
+            # Bodies already encoded by the app are not cached
+            if any(key.lower() == b"content-encoding" for key, _ in start_message.get("headers", [])):
+                return None
             
-            return response
+            # Store in cache: fresh until its deadline (or a change to its data), kept (stale) until the hard TTL
+            entry = encode_entry(start_message["status"], headers, body, started_at, freshness_deadline(started_at, cache_ttl, tags))
+            chat_cache.binary_client.setex(cache_key, min(cache_ttl * STALE_TTL_FACTOR, MAX_ENTRY_TTL), entry)
+            if self._local_enabled():
+                self.local.set(cache_key, decode_entry(entry), len(entry), tags, started_at)
             
+            logger.debug(f"Cached response for {path}")
+            return start_message["status"], headers, body
         except Exception as e:
-            logger.error(f"Cache middleware error: {e}")
-            # If caching fails, just process request normally
-            return await call_next(request)
+            logger.warning(f"Error caching response: {e}")
+            return None
     
-    def _generate_cache_key(self, request: Request) -> str:
+    def _generate_cache_key(self, path: str, query_string: str) -> str:
         """Generate cache key from request path and query params"""
-        key_parts = [request.url.path]
-        if request.url.query:
+        key_parts = [path]
+        if query_string:
             # Sort query params for consistent keys
-            sorted_params = sorted(request.url.query.split("&"))
+            sorted_params = sorted(query_string.split("&"))
             key_parts.extend(sorted_params)
         
         key_string = "|".join(key_parts)
         key_hash = hashlib.md5(key_string.encode()).hexdigest()
-        return f"cache:api:{key_hash}"
+        return f"cache:api:v{ENVELOPE_VERSION}:{key_hash}"
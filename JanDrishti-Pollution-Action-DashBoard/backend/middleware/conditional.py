@@ -0,0 +1,185 @@
+"""
+Conditional request middleware for read endpoints
+Pure ASGI: ETag and Last-Modified are derived from the version stamps of the
+data a route is built from (cache event tag change times, source file
+mtimes), never from the response body, so a matching If-None-Match is
+answered with 304 before the endpoint loads any data. Each route also gets
+its Cache-Control policy.
+"""
+from email.utils import formatdate, parsedate_to_datetime
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import os
+import time
+import hashlib
+import logging
+from datetime import date, datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+from chat_cache import get_chat_cache
+from cache_events import (
+    TAG_CHANGES_KEY, SNAPSHOT_TAG, DAILY_TAG, REPORTS_TAG,
+    ward_tag, daily_tag, date_tag
+)
+from rate_limit import PolicyTrie
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds to skip validators after Redis could not be reached
+REDIS_RETRY_INTERVAL = 30
+
+# Headers naming the data version; not added to bodies the response cache serves stale,
+# which predate the current stamps
+VALIDATOR_HEADERS = {"ETag", "Last-Modified"}
+
+
+class ConditionalPolicy(NamedTuple):
+    cache_control: str
+    # Cache event tags the response is built from ("{ward_no}" is the last path segment, "{today}" the local date)
+    tags: Tuple[str, ...] = ()
+    # Source files the response is built from, relative to the backend directory (or its parent)
+    files: Tuple[str, ...] = ()
+    # Validators also change every N seconds, bounding staleness from writes that publish
+    # no cache event; None renews them at local midnight, when date-relative queries roll over
+    revalidate_period: Optional[int] = None
+
+
+# Per-route policies; the longest matching path prefix wins
+CONDITIONAL_ROUTES = PolicyTrie({
+    "/api/delhi-aqi": ConditionalPolicy("public, max-age=60", tags=(SNAPSHOT_TAG, date_tag("{today}"))),
+    "/api/aqi/wards": ConditionalPolicy("public, max-age=3600", files=("selected_wards.json", "Delhi_Wards.geojson")),
+    "/api/aqi/daily": ConditionalPolicy("public, max-age=300", tags=(DAILY_TAG,)),
+    "/api/aqi/daily/": ConditionalPolicy("public, max-age=300", tags=(daily_tag("{ward_no}"),)),
+    "/api/aqi/hourly/": ConditionalPolicy("public, max-age=60", tags=(ward_tag("{ward_no}"),)),
+    "/api/reports": ConditionalPolicy("public, no-cache", tags=(REPORTS_TAG,), revalidate_period=60),
+})
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class ConditionalRequestMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._redis_retry_at = 0.0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        policy = CONDITIONAL_ROUTES.match(path)
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        validators = self._validators(policy, path, scope.get("query_string", b"").decode("latin-1"))
+        if validators is None:
+            # Data version unknown: only the Cache-Control policy applies
+            await self.app(scope, receive, self._with_headers(send, {"Cache-Control": policy.cache_control}))
+            return
+
+        etag, last_modified = validators
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(last_modified, usegmt=True),
+            "Cache-Control": policy.cache_control,
+        }
+
+        if self._not_modified(Headers(scope=scope), etag, last_modified):
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        await self.app(scope, receive, self._with_headers(send, headers))
+
+    @staticmethod
+    def _with_headers(send: Send, headers: Dict[str, str]) -> Send:
+        """Add headers to successful responses that do not set them already (no validators on stale bodies)"""
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                response_headers = MutableHeaders(scope=message)
+                stale = response_headers.get("x-cache") == "STALE"
+                for key, value in headers.items():
+                    if stale and key in VALIDATOR_HEADERS:
+                        continue
+                    if key not in response_headers:
+                        response_headers[key] = value
+            await send(message)
+        return send_with_headers
+
+    @staticmethod
+    def _not_modified(request_headers: Headers, etag: str, last_modified: float) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-Modified-Since is ignored when If-None-Match is present
+            return etag_matches(if_none_match, etag)
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _validators(self, policy: ConditionalPolicy, path: str, query_string: str) -> Optional[Tuple[str, float]]:
+        """(etag, last_modified epoch) from the data version stamps, or None if they are unknown"""
+        stamps = []
+
+        if policy.tags:
+            if time.monotonic() < self._redis_retry_at:
+                return None
+            ward_no = path.rstrip("/").rsplit("/", 1)[-1]
+            today = date.today().isoformat()
+            tags = [tag.format(ward_no=ward_no, today=today) for tag in policy.tags]
+            try:
+                changes = get_chat_cache().redis_client.hmget(TAG_CHANGES_KEY, tags)
+            except Exception as e:
+                logger.warning(f"Conditional request validators unavailable: {e}")
+                self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+                return None
+            # Until one of the route's tags has been announced its writers may not be
+            # publishing events yet, so without a renewal period no validators are issued
+            if all(change is None for change in changes) and policy.revalidate_period is None:
+                return None
+            stamps.extend(float(change) if change is not None else 0.0 for change in changes)
+
+        for name in policy.files:
+            for directory in (BACKEND_DIR, os.path.dirname(BACKEND_DIR)):
+                try:
+                    stamps.append(os.stat(os.path.join(directory, name)).st_mtime)
+                    break
+                except OSError:
+                    continue
+        if policy.files and not stamps:
+            return None
+
+        if policy.revalidate_period:
+            period_start = time.time() // policy.revalidate_period * policy.revalidate_period
+            period = str(int(period_start))
+        else:
+            period_start = datetime.combine(date.today(), datetime.min.time()).timestamp()
+            period = date.today().isoformat()
+
+        # Same request normalization as the response cache keys
+        key_parts = [path, period] + sorted(query_string.split("&") if query_string else [])
+        key_parts.extend(repr(stamp) for stamp in stamps)
+        digest = hashlib.md5("|".join(key_parts).encode()).hexdigest()
+        return f'W/"{digest}"', max(stamps + [period_start])
@@ -0,0 +1,53 @@
+"""
+CORS middleware for FastAPI
+Pure ASGI: answers preflight requests and adds CORS headers to the response
+start message; response bodies (including streams) pass through untouched
+"""
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ALLOW_METHODS = "GET, POST, PUT, DELETE, OPTIONS, PATCH, HEAD"
+
+class CORSHeaderMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Get origin from request
+        origin = Headers(scope=scope).get("origin")
+
+        # Handle preflight OPTIONS requests
+        if scope["method"] == "OPTIONS":
+            response = Response(
+                status_code=200,
+                headers={
+                    "Access-Control-Allow-Origin": origin if origin else "*",
+                    "Access-Control-Allow-Methods": ALLOW_METHODS,
+                    "Access-Control-Allow-Headers": "*",
+                    "Access-Control-Allow-Credentials": "true" if origin else "false",
+                    "Access-Control-Max-Age": "3600",
+                }
+            )
+            await response(scope, receive, send)
+            return
+
+        async def send_with_cors(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if origin:
+                    headers["Access-Control-Allow-Origin"] = origin
+                    headers["Access-Control-Allow-Credentials"] = "true"
+                else:
+                    # Allow all origins if no origin header (but can't use credentials)
+                    headers["Access-Control-Allow-Origin"] = "*"
+                headers["Access-Control-Allow-Methods"] = ALLOW_METHODS
+                headers["Access-Control-Allow-Headers"] = "*"
+                headers["Access-Control-Expose-Headers"] = "*"
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
@@ -1,13 +1,20 @@
 """
 Rate limiting middleware for FastAPI
 Uses Redis for distributed rate limiting
+Clients are identified by IP address. Behind reverse proxies (Vercel, nginx)
+every request arrives from the proxy, so TRUSTED_PROXY_HOPS must be set to
+the number of proxies in front of the app; the client address is then read
+from X-Forwarded-For. With the default of 0 the peer address is used as is.
 """
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response, JSONResponse
+from fastapi import status
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import os
 import time
 import logging
 from chat_cache import get_chat_cache
+from rate_limit import LocalRateLimiter, PolicyTrie
 
 logger = logging.getLogger(__name__)
 
@@ -21,74 +28,102 @@ RATE_LIMITS = {
     "default": {"requests": 100, "window": 60}  # 100 requests per minute for other endpoints
 }
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+# Policies compiled once into a prefix trie (longest matching prefix wins)
+RATE_LIMIT_POLICIES = PolicyTrie(RATE_LIMITS)
+
+# Reverse proxies in front of the app; each appends the address it received the request from
+# to X-Forwarded-For, so the client is that many entries from the right (0: no proxy)
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# Paths never rate limited
+EXEMPT_PATHS = {"/", "/api/health", "/docs", "/redoc", "/openapi.json"}
+
+# In-process pre-filter in front of the Redis limiter
+_local_limiter = None
+
+def get_local_limiter() -> LocalRateLimiter:
+    """Get or create the process-wide local rate limiter"""
+    global _local_limiter
+    if _local_limiter is None:
+        _local_limiter = LocalRateLimiter(get_chat_cache().rate_limiter)
+    return _local_limiter
+
+def client_address(scope: Scope, trusted_hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """Client IP address, read from X-Forwarded-For behind trusted_hops proxies"""
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if trusted_hops > 0:
+        forwarded = Headers(scope=scope).get("x-forwarded-for", "")
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            # Entries left of the trusted proxies' own are client-supplied and not trusted
+            address = hops[-trusted_hops] if len(hops) >= trusted_hops else hops[0]
+    return address
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI rate limiter: rejects over-limit requests with 429 and adds
+    X-RateLimit-* headers to the response start; bodies pass through untouched.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         # Skip rate limiting for health checks
-        if request.url.path in ["/", "/api/health", "/docs", "/redoc", "/openapi.json"]:
-            return await call_next(request)
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        
+        path = scope["path"]
         
         # Get rate limit config for this endpoint
-        rate_limit = RATE_LIMITS.get("default")
-        for path, config in RATE_LIMITS.items():
-            if path != "default" and request.url.path.startswith(path):
-                rate_limit = config
-                break
+        rate_limit = RATE_LIMIT_POLICIES.match(path)
         
-        # Get client identifier (IP address or user ID)
-        client_id = request.client.host if request.client else "unknown"
+        # Get client identifier (IP address, forwarded by trusted proxies)
+        client_id = client_address(scope)
         
         # Check if user is authenticated (for user-based rate limiting)
-        auth_header = request.headers.get("Authorization")
+        auth_header = Headers(scope=scope).get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
-            try:
-                # Extract user ID from token if possible
-                # For now, use IP + path as identifier
-                client_id = f"{client_id}:{request.url.path}"
-            except:
-                pass
+            # For now, use IP + path as identifier
+            client_id = f"{client_id}:{path}"
         
-        # Check rate limit
+        # Check rate limit (locally while far from the limit, otherwise one atomic Redis call)
         try:
-            chat_cache = get_chat_cache()
-            rate_limit_key = f"ratelimit:{request.url.path}:{client_id}"
-            
-            # Get current count
-            current_count = chat_cache.redis_client.get(rate_limit_key)
-            
-            if current_count is None:
-                # First request in window
-                chat_cache.redis_client.setex(rate_limit_key, rate_limit["window"], "1")
-                remaining = rate_limit["requests"] - 1
-            else:
-                count = int(current_count)
-                if count >= rate_limit["requests"]:
-                    # Rate limit exceeded
-                    logger.warning(f"Rate limit exceeded for {client_id} on {request.url.path}")
-                    return JSONResponse(
-                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                        content={
-                            "error": "Rate Limit Exceeded",
-                            "message": f"Too many requests. Limit: {rate_limit['requests']} per {rate_limit['window']} seconds",
-                            "retry_after": rate_limit["window"]
-                        },
-                        headers={"Retry-After": str(rate_limit["window"])}
-                    )
-                else:
-                    # Increment counter
-                    chat_cache.redis_client.incr(rate_limit_key)
-                    remaining = rate_limit["requests"] - count - 1
-            
-            # Process request
-            response = await call_next(request)
-            
-            # Add rate limit headers
-            response.headers["X-RateLimit-Limit"] = str(rate_limit["requests"])
-            response.headers["X-RateLimit-Remaining"] = str(remaining)
-            response.headers["X-RateLimit-Reset"] = str(int(time.time()) + rate_limit["window"])
-            
-            return response
-            
+            result = get_local_limiter().check(
+                f"ratelimit:{path}:{client_id}",
+                rate_limit["requests"],
+                rate_limit["window"]
+            )
         except Exception as e:
             # If rate limiting fails, allow request but log error
             logger.error(f"Rate limiting error: {e}")
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
+        
+        if not result.allowed:
+            # Rate limit exceeded
+            logger.warning(f"Rate limit exceeded for {client_id} on {path}")
+            response = JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={
+                    "error": "Rate Limit Exceeded",
+                    "message": f"Too many requests. Limit: {rate_limit['requests']} per {rate_limit['window']} seconds",
+                    "retry_after": result.retry_after
+                },
+                headers={"Retry-After": str(result.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        
+        async def send_with_headers(message: Message):
+            # Add rate limit headers
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-RateLimit-Limit"] = str(result.limit)
+                headers["X-RateLimit-Remaining"] = str(result.remaining)
+                headers["X-RateLimit-Reset"] = str(int(time.time()) + result.reset_after)
+            await send(message)
+        
+        # Process request
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,116 @@
+"""
+Profile Repository
+Cached lookups of the profiles table.
+One read returns every field the API uses (email, full_name, phone) through an
+in-process LRU and a read-through Redis cache; Supabase is queried only on a
+miss. Writers call invalidate() after updating a profile.
+"""
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from chat_cache import get_chat_cache
+
+logger = logging.getLogger(__name__)
+
+# Columns cached for each profile
+PROFILE_COLUMNS = "id,email,full_name,phone,updated_at"
+
+
+class ProfileRepository:
+    def __init__(self, supabase_client):
+        """Initialize the repository with the Supabase client used for reads"""
+        self.supabase = supabase_client
+
+        # Configuration
+        self.REDIS_TTL = 3600  # 1 hour
+        self.MISSING_TTL = 60  # profiles not created yet are rechecked after a minute
+        self.LOCAL_TTL = 30  # short, other workers cannot invalidate this process's copy
+        self.LOCAL_MAX_ENTRIES = 1024
+
+        self._local: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._local_lock = threading.Lock()
+
+    def _get_profile_key(self, user_id: str) -> str:
+        """Get Redis key for a cached profile"""
+        return f"profile:{user_id}"
+
+    # ------------------------------------------------------------------
+    # In-process LRU
+    # ------------------------------------------------------------------
+    def _local_get(self, user_id: str):
+        """(hit, profile) from the in-process cache"""
+        with self._local_lock:
+            entry = self._local.get(user_id)
+            if entry is None:
+                return False, None
+            expires_at, profile = entry
+            if expires_at <= time.monotonic():
+                del self._local[user_id]
+                return False, None
+            self._local.move_to_end(user_id)
+            return True, profile
+
+    def _local_set(self, user_id: str, profile: Optional[Dict]):
+        with self._local_lock:
+            self._local[user_id] = (time.monotonic() + self.LOCAL_TTL, profile)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.LOCAL_MAX_ENTRIES:
+                self._local.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Reads and invalidation
+    # ------------------------------------------------------------------
+    def get(self, user_id: str) -> Optional[Dict]:
+        """Profile row (email, full_name, phone) for a user, or None if it does not exist"""
+        hit, profile = self._local_get(user_id)
+        if hit:
+            return profile
+
+        redis_client = None
+        try:
+            redis_client = get_chat_cache().redis_client
+            cached = redis_client.get(self._get_profile_key(user_id))
+            if cached is not None:
+                profile = json.loads(cached)
+                self._local_set(user_id, profile)
+                return profile
+        except Exception as e:
+            logger.warning(f"Profile cache read failed for {user_id}: {e}")
+
+        response = self.supabase.table("profiles").select(PROFILE_COLUMNS).eq("id", user_id).limit(1).execute()
+        profile = response.data[0] if response.data else None
+
+        self._local_set(user_id, profile)
+        if redis_client is not None:
+            try:
+                redis_client.setex(
+                    self._get_profile_key(user_id),
+                    self.REDIS_TTL if profile else self.MISSING_TTL,
+                    json.dumps(profile)
+                )
+            except Exception as e:
+                logger.warning(f"Profile cache write failed for {user_id}: {e}")
+        return profile
+
+    def invalidate(self, user_id: str):
+        """Drop a user's cached profile after it was written"""
+        with self._local_lock:
+            self._local.pop(user_id, None)
+        try:
+            get_chat_cache().redis_client.delete(self._get_profile_key(user_id))
+        except Exception as e:
+            logger.warning(f"Profile cache invalidation failed for {user_id}: {e}")
+
+
+# Global instance
+_profile_repository_instance = None
+
+def get_profile_repository(supabase_client) -> ProfileRepository:
+    """Get or create the global profile repository"""
+    global _profile_repository_instance
+    if _profile_repository_instance is None:
+        _profile_repository_instance = ProfileRepository(supabase_client)
+    return _profile_repository_instance
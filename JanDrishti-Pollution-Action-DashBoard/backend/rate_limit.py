@@ -0,0 +1,248 @@
+"""
+Rate Limit Engine
+Atomic GCRA (generic cell rate algorithm) rate limiting in one Redis Lua script.
+Each check is a single round trip that returns allowed/remaining/reset; the
+state is one timestamp per key, so concurrent requests cannot slip through
+between a read and a write. Shared by the HTTP middleware and the chat limiter.
+LocalRateLimiter puts an in-process pre-filter in front of it for the middleware.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# KEYS[1]: limiter key
+# ARGV: limit (requests per period), period (seconds), cost (0 = peek without consuming),
+#       admitted (requests already admitted elsewhere, charged unconditionally)
+# Returns {allowed, remaining, reset_after_ms, retry_after_ms}
+GCRA_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local admitted = tonumber(ARGV[4] or '0')
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local interval = period / limit
+
+-- Theoretical arrival time: when the bucket would be empty again
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+if admitted > 0 then
+    tat = math.min(tat + admitted * interval, now + period)
+end
+
+-- A peek (cost 0) reports whether one more request would be allowed
+local allow_at = tat + math.max(cost, 1) * interval - period
+local new_tat = tat + cost * interval
+
+if allow_at > now + 0.000001 then
+    if admitted > 0 then
+        redis.call('SET', KEYS[1], string.format('%.6f', tat), 'PX', math.max(1, math.ceil((tat - now) * 1000)))
+    end
+    local remaining = math.floor((now - (tat - period)) / interval + 0.000001)
+    return {0, remaining, math.ceil((tat - now) * 1000), math.ceil((allow_at - now) * 1000)}
+end
+
+if cost > 0 or admitted > 0 then
+    redis.call('SET', KEYS[1], string.format('%.6f', new_tat), 'PX', math.max(1, math.ceil((new_tat - now) * 1000)))
+end
+
+local remaining = math.floor((now - (new_tat - period)) / interval + 0.000001)
+return {1, remaining, math.ceil((new_tat - now) * 1000), 0}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: int  # seconds until the full limit is available again
+    retry_after: int  # seconds until a denied request would be allowed (0 if allowed)
+
+
+class RateLimiter:
+    def __init__(self, redis_client):
+        """Register the GCRA script on a Redis client"""
+        self.redis_client = redis_client
+        self._script = redis_client.register_script(GCRA_SCRIPT)
+
+    def check(self, key: str, limit: int, period: int, cost: int = 1, admitted: int = 0) -> RateLimitResult:
+        """
+        Consume `cost` requests from key's allowance of `limit` per `period` seconds.
+        With cost=0 the current state is returned without consuming anything.
+        `admitted` requests (already let through elsewhere) are charged first, unconditionally.
+        """
+        return self._result(limit, self._script(keys=[key], args=[limit, period, cost, admitted]))
+
+    def charge_batch(self, charges: List[Tuple[str, int, int, int]]) -> List[RateLimitResult]:
+        """Charge admitted requests for many keys in one pipeline: [(key, limit, period, admitted)]"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key, limit, period, admitted in charges:
+            self._script(keys=[key], args=[limit, period, 0, admitted], client=pipe)
+        return [self._result(charge[1], reply) for charge, reply in zip(charges, pipe.execute())]
+
+    @staticmethod
+    def _result(limit: int, reply) -> RateLimitResult:
+        allowed, remaining, reset_after_ms, retry_after_ms = reply
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=limit,
+            remaining=max(0, min(limit, int(remaining))),
+            reset_after=math.ceil(int(reset_after_ms) / 1000),
+            retry_after=math.ceil(int(retry_after_ms) / 1000),
+        )
+
+
+class _LocalState:
+    __slots__ = ("limit", "period", "remaining", "pending", "synced_at")
+
+    def __init__(self, limit: int, period: int, remaining: int, synced_at: float):
+        self.limit = limit
+        self.period = period
+        self.remaining = remaining
+        self.pending = 0
+        self.synced_at = synced_at
+
+
+class LocalRateLimiter:
+    """
+    Two-tier limiter: an in-process estimate of each key's remaining allowance
+    admits requests locally while the key is far from its limit. Locally admitted
+    requests are charged to Redis in one pipelined batch per flush interval;
+    keys near their limit (or not seen recently) are checked synchronously.
+    Every worker process may admit up to its local headroom between flushes, so
+    small limits (e.g. logins) are always checked in Redis.
+    """
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+        # Configuration
+        self.LOCAL_HEADROOM = 0.5  # decide locally while more than half the allowance is left
+        self.LOCAL_MIN_LIMIT = 20  # limits below this are never decided locally
+        self.FLUSH_INTERVAL = 1.0  # seconds between batched charges to Redis
+        self.STATE_TTL = 5.0  # re-check with Redis if a key has not synced for this long
+        self.MAX_KEYS = 10000
+
+        self._state: "OrderedDict[str, _LocalState]" = OrderedDict()
+        self._evicted: Dict[str, _LocalState] = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def check(self, key: str, limit: int, period: int) -> RateLimitResult:
+        """Consume one request for key, locally when it is far from its limit"""
+        now = time.monotonic()
+        if now - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+        if limit < self.LOCAL_MIN_LIMIT:
+            return self.limiter.check(key, limit, period)
+
+        with self._lock:
+            state = self._state.get(key)
+            if (state is not None and state.limit == limit and now - state.synced_at < self.STATE_TTL
+                    and state.remaining > limit * self.LOCAL_HEADROOM):
+                state.remaining -= 1
+                state.pending += 1
+                self._state.move_to_end(key)
+                return RateLimitResult(
+                    allowed=True,
+                    limit=limit,
+                    remaining=state.remaining,
+                    reset_after=math.ceil((limit - state.remaining) * period / limit),
+                    retry_after=0,
+                )
+            # Near the limit: the pending local requests are charged with this check
+            admitted = state.pending if state is not None else 0
+            if state is not None:
+                state.pending = 0
+
+        try:
+            result = self.limiter.check(key, limit, period, admitted=admitted)
+        except Exception:
+            # Keep the local charges for the next flush
+            with self._lock:
+                if state is not None:
+                    state.pending += admitted
+            raise
+
+        with self._lock:
+            self._remember(key, limit, period, result.remaining, time.monotonic())
+        return result
+
+    def _remember(self, key: str, limit: int, period: int, remaining: int, synced_at: float):
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = _LocalState(limit, period, remaining, synced_at)
+        else:
+            # Requests admitted locally since the sync are still pending
+            state.limit = limit
+            state.period = period
+            state.remaining = max(0, remaining - state.pending)
+            state.synced_at = synced_at
+        self._state.move_to_end(key)
+        while len(self._state) > self.MAX_KEYS:
+            evicted_key, evicted = self._state.popitem(last=False)
+            if evicted.pending:
+                self._evicted[evicted_key] = evicted
+
+    def flush(self):
+        """Charge all locally admitted requests to Redis in one pipeline and refresh the estimates"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            charges = []
+            for key, state in list(self._state.items()) + list(self._evicted.items()):
+                if state.pending:
+                    charges.append((key, state.limit, state.period, state.pending))
+                    state.pending = 0
+            self._evicted.clear()
+        if not charges:
+            return
+
+        try:
+            results = self.limiter.charge_batch(charges)
+        except Exception:
+            # Put the charges back so they are retried on the next flush
+            with self._lock:
+                for key, limit, period, admitted in charges:
+                    state = self._state.get(key)
+                    if state is None:
+                        state = self._evicted.setdefault(key, _LocalState(limit, period, 0, 0.0))
+                    state.pending += admitted
+            raise
+
+        synced_at = time.monotonic()
+        with self._lock:
+            for (key, limit, period, _), result in zip(charges, results):
+                if key in self._state:
+                    self._remember(key, limit, period, result.remaining, synced_at)
+
+
+class PolicyTrie:
+    """Per-route rate limit policies compiled into a character trie of path prefixes"""
+
+    def __init__(self, policies: Dict[str, Dict]):
+        self.default = policies.get("default")
+        self._root: Dict = {}
+        for prefix, policy in policies.items():
+            if prefix == "default":
+                continue
+            node = self._root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = policy
+
+    def match(self, path: str) -> Optional[Dict]:
+        """Policy of the longest configured prefix of path, or the default policy"""
+        node, policy = self._root, self.default
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                policy = node[None]
+        return policy
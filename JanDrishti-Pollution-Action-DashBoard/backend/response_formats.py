@@ -0,0 +1,73 @@
+"""
+Response formats for time-series endpoints
+Builds columnar (one array per column) and Arrow IPC payloads from query rows
+"""
+from fastapi import HTTPException
+from fastapi.responses import Response
+from typing import Dict, List, Optional, Sequence
+
+# Supported values for the `format` query parameter
+RESPONSE_FORMATS = ("rows", "columnar", "arrow")
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def validate_format(response_format: str) -> str:
+    """Validate the requested response format"""
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"format must be one of: {', '.join(RESPONSE_FORMATS)}"
+        )
+    return response_format
+
+
+def to_columns(rows: List[Dict], columns: Optional[Sequence[str]] = None) -> Dict[str, list]:
+    """
+    Pivot query rows into one list per column.
+    If columns is not given, the keys of the first row are used.
+    """
+    if columns is None:
+        columns = list(rows[0].keys()) if rows else []
+    return {column: [row.get(column) for row in rows] for column in columns}
+
+
+def to_columnar(rows: List[Dict], columns: Optional[Sequence[str]] = None) -> Dict:
+    """Build a columnar JSON payload: {"columns": [...], "data": {...}, "count": n}"""
+    data = to_columns(rows, columns)
+    return {
+        "columns": list(data.keys()),
+        "data": data,
+        "count": len(rows)
+    }
+
+
+def to_arrow_response(rows: List[Dict], columns: Optional[Sequence[str]] = None,
+                      metadata: Optional[Dict[str, str]] = None) -> Response:
+    """Serialize rows as an Arrow IPC stream (requires pyarrow)"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(
+            status_code=400,
+            detail="format=arrow is not available on this server (pyarrow not installed)"
+        )
+
+    table = pa.table(to_columns(rows, columns))
+    if metadata:
+        table = table.replace_schema_metadata({k: str(v) for k, v in metadata.items()})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return Response(content=sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE)
+
+
+def format_rows(rows: List[Dict], response_format: str, columns: Optional[Sequence[str]] = None):
+    """Return rows in the requested format (rows are returned unchanged by default)"""
+    if response_format == "columnar":
+        return to_columnar(rows, columns)
+    if response_format == "arrow":
+        return to_arrow_response(rows, columns)
+    return rows
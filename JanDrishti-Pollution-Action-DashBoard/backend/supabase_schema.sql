@@ -69,6 +69,22 @@ CREATE POLICY "Service role can insert AQI data" ON ward_aqi_daily
 CREATE POLICY "Service role can update AQI data" ON ward_aqi_daily
     FOR UPDATE USING (true);
 
+-- Table to store precomputed ward forecasts (written by the AQI scheduler)
+CREATE TABLE IF NOT EXISTS ward_aqi_forecasts (
+    ward_no VARCHAR(50) NOT NULL,
+    period VARCHAR(10) NOT NULL,
+    metric VARCHAR(10) NOT NULL,
+    forecast JSONB NOT NULL,
+    generated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (ward_no, period, metric)
+);
+
+ALTER TABLE ward_aqi_forecasts ENABLE ROW LEVEL SECURITY;
+
+-- Policy: Allow public read access to forecasts
+CREATE POLICY "Public read access for forecasts" ON ward_aqi_forecasts
+    FOR SELECT USING (true);
+
 -- Table to cache AQI station data (used by edge function)
 CREATE TABLE IF NOT EXISTS aqi_cache (
     id BIGSERIAL PRIMARY KEY,
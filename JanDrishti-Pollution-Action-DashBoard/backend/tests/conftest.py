@@ -0,0 +1,8 @@
+"""
+Pytest configuration
+Makes the backend modules importable from the tests directory.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,70 @@
+"""
+Tests for the cache event subscriber's connection loss handling
+Run against fakeredis, so no Redis server is needed.
+"""
+import time
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import cache_events
+from cache_events import CacheEventSubscriber, ward_tag
+from middleware.cache import LocalResponseCache
+
+
+class FakePubSub:
+    def __init__(self, reachable: bool):
+        self.reachable = reachable
+
+    def ping(self):
+        if not self.reachable:
+            raise ConnectionError("still down")
+
+
+@pytest.fixture(autouse=True)
+def no_reconnect_delay(monkeypatch):
+    monkeypatch.setattr(cache_events, "RECONNECT_DELAY", 0)
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def cached_entry(local: LocalResponseCache, cache_key: str, tags, stored_at: float):
+    local.set(cache_key, (200, [], b"{}", False, stored_at, time.time() + 3600), 2, tags, stored_at)
+
+
+def test_stays_disconnected_until_resubscribed(redis_client):
+    subscriber = CacheEventSubscriber(redis_client)
+    subscriber._connected.set()
+    events = []
+    subscriber.add_listener(lambda tags, event: events.append((tags, event)))
+
+    subscriber._handle_error(ConnectionError("lost"), FakePubSub(reachable=False), None)
+
+    assert not subscriber.connected
+    assert events == [(None, {"event": "reset"})]
+
+
+def test_reconnect_resets_with_missed_changes(redis_client):
+    subscriber = CacheEventSubscriber(redis_client)
+    subscriber._connected.set()
+    local = LocalResponseCache()
+    subscriber.add_listener(local.invalidate)
+
+    # Change published while the subscriber was down: no event reaches the listener
+    cached_entry(local, "hourly:72", (ward_tag("72"),), stored_at=1000.0)
+    assert local.get("hourly:72") is not None
+    redis_client.hset(cache_events.TAG_CHANGES_KEY, ward_tag("72"), repr(2000.0))
+
+    subscriber._handle_error(ConnectionError("lost"), FakePubSub(reachable=True), None)
+
+    assert subscriber.connected
+    assert local.get("hourly:72") is None
+    # Entries read back from Redis that predate the missed change are not kept
+    assert local.invalidated_since((ward_tag("72"),), 1500.0)
+    cached_entry(local, "hourly:72", (ward_tag("72"),), stored_at=1500.0)
+    assert local.get("hourly:72") is None
+    cached_entry(local, "hourly:72", (ward_tag("72"),), stored_at=2500.0)
+    assert local.get("hourly:72") is not None
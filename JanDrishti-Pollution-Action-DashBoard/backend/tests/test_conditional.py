@@ -0,0 +1,76 @@
+"""
+Tests for conditional requests in front of the response cache
+Run against fakeredis, so no Redis server is needed.
+"""
+import types
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import cache_events
+import middleware.cache as cache_middleware
+import middleware.conditional as conditional_middleware
+
+
+@pytest.fixture
+def chat_cache(monkeypatch):
+    server = fakeredis.FakeServer()
+    chat_cache = types.SimpleNamespace(
+        redis_client=fakeredis.FakeRedis(server=server, decode_responses=True),
+        binary_client=fakeredis.FakeRedis(server=server),
+    )
+    monkeypatch.setattr(cache_middleware, "get_chat_cache", lambda: chat_cache)
+    monkeypatch.setattr(conditional_middleware, "get_chat_cache", lambda: chat_cache)
+
+    # Serve from Redis only, so the stale entry is not hidden by the in-process tier
+    def no_subscriber():
+        raise ConnectionError("no cache events in tests")
+    monkeypatch.setattr(cache_middleware, "get_cache_event_subscriber", no_subscriber)
+    return chat_cache
+
+
+@pytest.fixture
+def client(chat_cache):
+    app = FastAPI()
+    readings = {"aqi": 100}
+
+    @app.get("/api/aqi/hourly/{ward_no}")
+    def hourly(ward_no: str):
+        return {"ward_no": ward_no, "aqi": readings["aqi"]}
+
+    # Same order as main.py: the cache inside the validators
+    app.add_middleware(cache_middleware.CacheMiddleware)
+    app.add_middleware(conditional_middleware.ConditionalRequestMiddleware)
+    app.readings = readings
+    return TestClient(app)
+
+
+def test_unchanged_data_is_not_modified(chat_cache, client):
+    cache_events.publish_ward_updated(chat_cache.redis_client, "72")
+    first = client.get("/api/aqi/hourly/72")
+
+    second = client.get("/api/aqi/hourly/72", headers={"If-None-Match": first.headers["etag"]})
+
+    assert second.status_code == 304
+
+
+def test_stale_body_gets_no_validators(chat_cache, client):
+    cache_events.publish_ward_updated(chat_cache.redis_client, "72")
+    first = client.get("/api/aqi/hourly/72")
+    assert first.headers["x-cache"] == "MISS"
+
+    # New reading: the cached body is stale but still served while it is refreshed
+    client.app.readings["aqi"] = 250
+    cache_events.publish_ward_updated(chat_cache.redis_client, "72")
+    stale = client.get("/api/aqi/hourly/72", headers={"If-None-Match": first.headers["etag"]})
+
+    assert stale.status_code == 200
+    assert stale.headers["x-cache"] == "STALE"
+    assert "etag" not in stale.headers
+    assert "last-modified" not in stale.headers
+
+    # The client still holds the old ETag, so it keeps getting bodies until it has the new one
+    again = client.get("/api/aqi/hourly/72", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 200
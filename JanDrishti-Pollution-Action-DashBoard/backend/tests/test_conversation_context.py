@@ -0,0 +1,88 @@
+"""
+Tests for token-budgeted chat history and the rolling summary
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import conversation_context
+from conversation_context import RECENT_MESSAGES, build_history, refresh_summary
+
+
+class FakeChatCache:
+    """The chat cache methods conversation_context uses, in memory"""
+
+    def __init__(self):
+        self.messages = []
+        self.summary = None
+
+    def get_conversation_context(self, user_id, max_messages=10):
+        return self.messages[-max_messages:]
+
+    def get_conversation_summary(self, user_id):
+        return self.summary["summary"] if self.summary else None
+
+    def get_conversation_summary_data(self, user_id):
+        return self.summary
+
+    def cache_conversation_summary(self, user_id, summary, through=None):
+        self.summary = {"summary": summary, "through": through}
+
+
+class FakeGateway:
+    """Records the turns sent for summarization"""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def complete(self, messages, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        return f"summary {len(self.prompts)}"
+
+
+def add_turn(chat_cache, n):
+    created_at = datetime(2026, 1, 1) + timedelta(minutes=n)
+    chat_cache.messages.append({
+        "user_message": f"question {n}",
+        "bot_response": f"answer {n}",
+        "created_at": created_at.isoformat(),
+    })
+
+
+def test_turns_past_the_message_cap_are_summarized():
+    chat_cache, gateway = FakeChatCache(), FakeGateway()
+
+    for n in range(15):
+        add_turn(chat_cache, n)
+        asyncio.run(refresh_summary(gateway, chat_cache, "user-1"))
+
+    # The 15 short turns fit the token budget, but only RECENT_MESSAGES stay verbatim
+    summarized = "\n".join(gateway.prompts)
+    for n in range(15 - RECENT_MESSAGES):
+        assert f"question {n}\n" in summarized
+    for n in range(15 - RECENT_MESSAGES, 15):
+        assert f"question {n}\n" not in summarized
+
+    summary, recent = build_history(chat_cache, "user-1")
+    assert summary == f"summary {len(gateway.prompts)}"
+    assert [m["user_message"] for m in recent] == [f"question {n}" for n in range(15 - RECENT_MESSAGES, 15)]
+
+
+def test_nothing_to_summarize_within_the_window():
+    chat_cache, gateway = FakeChatCache(), FakeGateway()
+
+    for n in range(RECENT_MESSAGES):
+        add_turn(chat_cache, n)
+
+    assert not asyncio.run(refresh_summary(gateway, chat_cache, "user-1"))
+    assert gateway.prompts == []
+
+
+def test_recent_turns_fit_the_token_budget():
+    chat_cache = FakeChatCache()
+    for n in range(3):
+        add_turn(chat_cache, n)
+    chat_cache.messages[1]["bot_response"] = "x" * 4 * conversation_context.HISTORY_TOKEN_BUDGET
+
+    _, recent = build_history(chat_cache, "user-1")
+
+    assert [m["user_message"] for m in recent] == ["question 2"]
@@ -0,0 +1,99 @@
+"""
+Tests for the local store's daily coverage and Supabase pulls
+"""
+import pytest
+
+from local_store import LocalAQIStore
+
+
+class FakeQuery:
+    """The subset of the Supabase query builder the local store uses, over a list of rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.orders = []
+        self.bounds = None
+
+    def select(self, columns):
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: (row.get(column) or "") >= value)
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.bounds = (0, count - 1)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def execute(self):
+        rows = [row for row in self.rows if all(f(row) for f in self.filters)]
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda row: row.get(column) or "", reverse=desc)
+        if self.bounds:
+            rows = rows[self.bounds[0]:self.bounds[1] + 1]
+        return type("Response", (), {"data": [dict(row) for row in rows]})()
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.daily = []
+
+    def table(self, name):
+        assert name == "ward_aqi_daily"
+        return FakeQuery(self.daily)
+
+
+def daily_row(ward_no, day, updated_at):
+    return {"ward_no": ward_no, "date": day, "avg_aqi": 150.0, "updated_at": updated_at}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalAQIStore(str(tmp_path / "aqi.db"))
+    store.REMOTE_CHECK_TTL = 0
+    return store
+
+
+def test_not_covered_before_the_first_pull(store):
+    assert not store.covers_daily(FakeSupabase())
+
+
+def test_rows_written_elsewhere_after_the_pull_end_coverage(store):
+    supabase = FakeSupabase()
+    supabase.daily.append(daily_row("72", "2026-10-17", "2026-10-18T00:01:00"))
+    assert store.pull_daily_from_supabase(supabase) == 1
+    assert store.covers_daily(supabase)
+
+    # Another instance writes the next day's averages to Supabase
+    supabase.daily.append(daily_row("72", "2026-10-18", "2026-10-19T00:01:00"))
+    assert not store.covers_daily(supabase)
+
+    # The next pull only reads rows from the watermark on and restores coverage
+    assert store.pull_daily_from_supabase(supabase) == 2
+    assert store.covers_daily(supabase)
+    assert [row["date"] for row in store.query_daily(["date"], ward_no="72")] == ["2026-10-18", "2026-10-17"]
+
+
+def test_rows_pushed_from_this_store_keep_coverage(store):
+    supabase = FakeSupabase()
+    store.pull_daily_from_supabase(supabase)
+
+    store.upsert_daily(daily_row("72", "2026-10-18", "2026-10-19T00:01:00"), synced=True)
+    supabase.daily.append(daily_row("72", "2026-10-18", "2026-10-19T00:01:00"))
+
+    assert store.covers_daily(supabase)
+
+
+def test_hourly_rows_get_their_utc_date(store):
+    store.append_hourly("72", {"epoch": 1792355400, "ist_date": "2026-10-19", "ist_hour": 2, "aqi": 120})
+
+    assert store.get_hourly_range("72", 0)[0]["utc_date"] == "2026-10-18"
@@ -0,0 +1,158 @@
+"""
+Tests for the GCRA rate limit script and the two-tier local limiter
+Run against fakeredis (with Lua support), so no Redis server is needed.
+"""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from rate_limit import RateLimiter, LocalRateLimiter
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def limiter(redis_client):
+    return RateLimiter(redis_client)
+
+
+def test_allows_up_to_limit_then_denies(limiter):
+    results = [limiter.check("user:1", limit=5, period=60) for _ in range(6)]
+
+    assert [r.allowed for r in results] == [True] * 5 + [False]
+    assert [r.remaining for r in results[:5]] == [4, 3, 2, 1, 0]
+    assert results[5].remaining == 0
+
+
+def test_denied_request_reports_retry_after(limiter):
+    for _ in range(5):
+        limiter.check("user:1", limit=5, period=60)
+    result = limiter.check("user:1", limit=5, period=60)
+
+    assert not result.allowed
+    # One request is freed every period / limit = 12 seconds
+    assert 1 <= result.retry_after <= 12
+    assert 48 <= result.reset_after <= 60
+
+
+def test_keys_are_independent(limiter):
+    for _ in range(5):
+        limiter.check("user:1", limit=5, period=60)
+
+    assert limiter.check("user:2", limit=5, period=60).allowed
+
+
+def test_peek_does_not_consume(limiter):
+    for _ in range(3):
+        peek = limiter.check("user:1", limit=5, period=60, cost=0)
+    assert peek.allowed
+    assert peek.remaining == 5
+    assert peek.retry_after == 0
+
+    assert limiter.check("user:1", limit=5, period=60).remaining == 4
+
+
+def test_peek_reports_denied_when_exhausted(limiter):
+    for _ in range(5):
+        limiter.check("user:1", limit=5, period=60)
+    peek = limiter.check("user:1", limit=5, period=60, cost=0)
+
+    assert not peek.allowed
+    assert peek.remaining == 0
+    assert peek.retry_after >= 1
+
+
+def test_admitted_requests_are_charged_before_the_check(limiter):
+    result = limiter.check("user:1", limit=5, period=60, admitted=4)
+    assert result.allowed
+    assert result.remaining == 0
+
+    assert not limiter.check("user:1", limit=5, period=60).allowed
+
+
+def test_charge_batch(limiter):
+    results = limiter.charge_batch([("user:1", 5, 60, 2), ("user:2", 10, 60, 10), ("user:3", 5, 60, 9)])
+
+    assert [r.remaining for r in results] == [3, 0, 0]
+    assert limiter.check("user:1", limit=5, period=60, cost=0).remaining == 3
+    assert not limiter.check("user:2", limit=10, period=60, cost=0).allowed
+    # Charges beyond the limit are capped at one period
+    assert limiter.check("user:3", limit=5, period=60, cost=0).retry_after <= 12
+
+
+def test_local_limiter_admits_locally_and_charges_on_flush(limiter):
+    local = LocalRateLimiter(limiter)
+    local.FLUSH_INTERVAL = 3600
+
+    results = [local.check("ip:1", limit=100, period=60) for _ in range(10)]
+    assert all(r.allowed for r in results)
+    # Only the first check went to Redis; the rest are pending locally
+    assert limiter.check("ip:1", limit=100, period=60, cost=0).remaining == 99
+
+    local.flush()
+    assert limiter.check("ip:1", limit=100, period=60, cost=0).remaining == 90
+
+
+def test_local_limiter_denies_at_limit(limiter):
+    local = LocalRateLimiter(limiter)
+    local.FLUSH_INTERVAL = 3600
+
+    results = [local.check("ip:1", limit=40, period=60) for _ in range(41)]
+
+    assert [r.allowed for r in results] == [True] * 40 + [False]
+    assert results[-1].retry_after >= 1
+
+
+def test_local_limiters_share_the_limit(limiter):
+    workers = [LocalRateLimiter(limiter) for _ in range(3)]
+    for worker in workers:
+        worker.FLUSH_INTERVAL = 3600
+
+    allowed = sum(worker.check("ip:1", limit=40, period=60).allowed for _ in range(20) for worker in workers)
+    for worker in workers:
+        worker.flush()
+
+    # Each worker may over-admit by at most its local headroom between flushes
+    assert 40 <= allowed <= 40 + 3 * int(40 * workers[0].LOCAL_HEADROOM)
+    assert not limiter.check("ip:1", limit=40, period=60, cost=0).allowed
+
+
+def test_local_limiter_checks_small_limits_in_redis(limiter):
+    workers = [LocalRateLimiter(limiter) for _ in range(3)]
+    for worker in workers:
+        worker.FLUSH_INTERVAL = 3600
+
+    allowed = sum(worker.check("ip:1", limit=10, period=60).allowed for _ in range(5) for worker in workers)
+
+    assert allowed == 10
+
+
+def test_interval_below_clock_resolution(limiter):
+    # period / limit is smaller than the precision of an epoch timestamp
+    results = [limiter.check("user:1", limit=10 ** 9, period=60) for _ in range(3)]
+
+    assert all(r.allowed for r in results)
+
+
+def forwarded_scope(peer, forwarded_for=None):
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return {"type": "http", "client": (peer, 443), "headers": headers}
+
+
+def test_client_address_without_proxy_ignores_forwarded_for():
+    from middleware.rate_limiter import client_address
+
+    assert client_address(forwarded_scope("10.0.0.1", "1.2.3.4"), trusted_hops=0) == "10.0.0.1"
+
+
+def test_client_address_behind_trusted_proxies():
+    from middleware.rate_limiter import client_address
+
+    assert client_address(forwarded_scope("10.0.0.1", "1.2.3.4"), trusted_hops=1) == "1.2.3.4"
+    # A client-supplied entry left of the proxy's own is not trusted
+    assert client_address(forwarded_scope("10.0.0.1", "6.6.6.6, 1.2.3.4"), trusted_hops=1) == "1.2.3.4"
+    assert client_address(forwarded_scope("10.0.0.2", "6.6.6.6, 1.2.3.4, 10.0.0.1"), trusted_hops=2) == "1.2.3.4"
+    assert client_address(forwarded_scope("10.0.0.1"), trusted_hops=1) == "10.0.0.1"
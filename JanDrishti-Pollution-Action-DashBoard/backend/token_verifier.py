@@ -0,0 +1,187 @@
+"""
+Token Verifier
+Local verification of Supabase Auth access tokens with python-jose.
+Signature, expiry, audience and issuer are checked against the project's JWT
+secret (HS256) or its published JWKS (asymmetric keys, cached), and verified
+claims are cached by token hash, so authenticated requests need no Auth round trip.
+"""
+import os
+import time
+import hashlib
+import threading
+import logging
+import requests
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from jose import JWTError, jwt
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")  # Project Settings > API > JWT Secret
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+
+# Algorithms accepted per key; never taken from the token header
+SECRET_ALGORITHMS = ["HS256"]
+JWKS_ALGORITHMS = {"RSA": ["RS256"], "EC": ["ES256"]}
+
+
+class TokenVerificationError(Exception):
+    """Raised when a token is malformed, expired or fails signature/claim checks"""
+    pass
+
+
+class TokenKeyUnavailableError(TokenVerificationError):
+    """Raised when no local key can verify the token (e.g. HS256 without SUPABASE_JWT_SECRET)"""
+    pass
+
+
+class AuthenticatedUser:
+    """User identity from verified token claims, with the attributes the API reads from Supabase users"""
+
+    def __init__(self, claims: Dict):
+        self.id = claims["sub"]
+        self.email = claims.get("email")
+        self.phone = claims.get("phone")
+        self.role = claims.get("role")
+        self.user_metadata = claims.get("user_metadata") or {}
+        self.app_metadata = claims.get("app_metadata") or {}
+        self.claims = claims
+
+
+class TokenVerifier:
+    def __init__(self, supabase_url: str, jwt_secret: Optional[str] = None, audience: str = SUPABASE_JWT_AUDIENCE):
+        """Configure the expected issuer, audience and key sources"""
+        self.issuer = f"{supabase_url.rstrip('/')}/auth/v1"
+        self.jwks_url = f"{self.issuer}/.well-known/jwks.json"
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+
+        # Configuration
+        self.CLAIMS_CACHE_MAX = 4096  # verified tokens kept in memory
+        self.CLAIMS_CACHE_TTL = 300  # re-verify at least every 5 minutes
+        self.JWKS_TTL = 600  # 10 minutes
+        self.JWKS_MIN_REFRESH = 30  # minimum seconds between refetches for unknown key ids
+        self.JWKS_TIMEOUT = 5
+
+        self._claims: "OrderedDict[str, Tuple[float, float, AuthenticatedUser]]" = OrderedDict()
+        self._claims_lock = threading.Lock()
+        self._jwks: Dict[str, Dict] = {}
+        self._jwks_fetched_at = 0.0
+        self._jwks_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Claims cache
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _token_hash(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get_cached_user(self, token: str) -> Optional[AuthenticatedUser]:
+        """User for a token verified recently and not yet expired, or None"""
+        key = self._token_hash(token)
+        with self._claims_lock:
+            entry = self._claims.get(key)
+            if entry is None:
+                return None
+            cached_until, expires_at, user = entry
+            if cached_until <= time.monotonic() or expires_at <= time.time():
+                del self._claims[key]
+                return None
+            self._claims.move_to_end(key)
+            return user
+
+    def _cache_user(self, token: str, user: AuthenticatedUser):
+        key = self._token_hash(token)
+        with self._claims_lock:
+            self._claims[key] = (
+                time.monotonic() + self.CLAIMS_CACHE_TTL,
+                float(user.claims.get("exp", 0)),
+                user
+            )
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.CLAIMS_CACHE_MAX:
+                self._claims.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Signing keys
+    # ------------------------------------------------------------------
+    def _fetch_jwks(self):
+        response = requests.get(self.jwks_url, timeout=self.JWKS_TIMEOUT)
+        response.raise_for_status()
+        self._jwks = {key.get("kid"): key for key in response.json().get("keys", [])}
+        self._jwks_fetched_at = time.monotonic()
+
+    def _signing_key(self, header: Dict) -> Tuple[object, list]:
+        """
+        (key, allowed algorithms) for a token header: the JWT secret for HS256,
+        otherwise the JWKS entry for its kid with the algorithms of its key type
+        """
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.jwt_secret:
+                raise TokenKeyUnavailableError("SUPABASE_JWT_SECRET is not set")
+            return self.jwt_secret, SECRET_ALGORITHMS
+
+        kid = header.get("kid")
+        with self._jwks_lock:
+            age = time.monotonic() - self._jwks_fetched_at
+            # Refresh on expiry, or early when an unknown key id appears (key rotation)
+            if age > self.JWKS_TTL or (kid not in self._jwks and age > self.JWKS_MIN_REFRESH):
+                try:
+                    self._fetch_jwks()
+                except Exception as e:
+                    logger.warning(f"Could not fetch JWKS from {self.jwks_url}: {e}")
+            key = self._jwks.get(kid)
+        if key is None:
+            raise TokenKeyUnavailableError(f"No signing key for kid {kid}")
+        algorithms = JWKS_ALGORITHMS.get(key.get("kty"))
+        if algorithms is None:
+            raise TokenVerificationError(f"Unsupported key type {key.get('kty')} for kid {kid}")
+        return key, algorithms
+
+    # ------------------------------------------------------------------
+    # Verification
+    # ------------------------------------------------------------------
+    def verify(self, token: str) -> AuthenticatedUser:
+        """
+        Verify a token and return its user.
+        Raises TokenKeyUnavailableError if no local key applies, TokenVerificationError if invalid.
+        """
+        user = self.get_cached_user(token)
+        if user is not None:
+            return user
+
+        try:
+            header = jwt.get_unverified_header(token)
+            key, algorithms = self._signing_key(header)
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=algorithms,
+                audience=self.audience,
+                issuer=self.issuer,
+                options={"require_exp": True, "require_sub": True}
+            )
+        except JWTError as e:
+            raise TokenVerificationError(str(e)) from e
+
+        user = AuthenticatedUser(claims)
+        self._cache_user(token, user)
+        return user
+
+
+# Global instance
+_token_verifier_instance = None
+
+def get_token_verifier() -> TokenVerifier:
+    """Get or create the global token verifier instance"""
+    global _token_verifier_instance
+    if _token_verifier_instance is None:
+        if not SUPABASE_URL:
+            raise ValueError("SUPABASE_URL must be set in environment variables")
+        _token_verifier_instance = TokenVerifier(SUPABASE_URL, SUPABASE_JWT_SECRET)
+    return _token_verifier_instance
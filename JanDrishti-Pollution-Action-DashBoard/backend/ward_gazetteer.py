@@ -0,0 +1,239 @@
+"""
+Ward Gazetteer
+Recognizes Delhi ward names and numbers in free text.
+Names from Delhi_Wards.geojson and the selected wards are normalized into a
+token trie with aliases, so every ward is matched in one pass over the message;
+misspelled tokens are corrected by fuzzy matching against the name vocabulary.
+"""
+import os
+import re
+import json
+import difflib
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Words too generic to identify a ward on their own
+GENERIC_TOKENS = {
+    "delhi", "new", "old", "east", "west", "north", "south", "nagar", "vihar", "park",
+    "colony", "enclave", "garden", "gardens", "extension", "extn", "village", "puri",
+    "pur", "bagh", "camp", "marg", "road", "market", "charge", "cantt", "town",
+    "model", "green", "city", "place", "kalan", "khurd", "main", "block", "phase",
+}
+
+# Tokens in messages that are never ward-name typos
+COMMON_WORDS = {
+    "what", "where", "when", "which", "there", "today", "tomorrow", "quality", "pollution",
+    "level", "levels", "about", "should", "could", "would", "outside", "please", "index",
+}
+
+# Spelling variants seen in ward names (normalized token -> alternatives)
+TOKEN_VARIANTS = {
+    "nagar": ("ngr",),
+    "extension": ("extn", "ext"),
+    "enclave": ("encl",),
+    "cantt": ("cantonment", "cant"),
+    "mandir": ("mandi",),
+}
+
+WARD_NUMBER_PATTERN = re.compile(r"\bward\s*(?:no\.?|number|#)?\s*[:\-]?\s*([a-z]*_?\d+)\b", re.IGNORECASE)
+
+FUZZY_CUTOFF = 0.85
+
+# Spelling corrections remembered per gazetteer
+CORRECTION_CACHE_SIZE = 4096
+
+# Most adjacent message tokens joined and looked up as one word ("vasant kunj" -> VASANTKUNJ)
+MAX_JOINED_TOKENS = 3
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9]+", " ", text.lower())).strip()
+
+
+class WardGazetteer:
+    def __init__(self, wards: List[Dict]):
+        """Build the ward_no index, alias trie and token vocabulary from ward dicts"""
+        self.by_no: Dict[str, Dict] = {}
+        for ward in wards:
+            if ward.get("ward_no") and ward.get("ward_name"):
+                self.by_no[str(ward["ward_no"])] = ward
+        self._by_no_lower = {ward_no.lower(): ward_no for ward_no in self.by_no}
+
+        # Trie over name tokens; a node's "$" entry holds the ward_no of a complete alias
+        self._trie: Dict = {}
+        self._vocabulary = set()
+        for ward_no, alias in self._aliases():
+            node = self._trie
+            for token in alias:
+                node = node.setdefault(token, {})
+                self._vocabulary.add(token)
+            node.setdefault("$", ward_no)
+        self._vocabulary_list = sorted(self._vocabulary)
+        # Token -> correction, oldest first
+        self._corrections: Dict[str, str] = {}
+        self._corrections_lock = threading.Lock()
+
+    def _aliases(self):
+        """
+        Yield (ward_no, alias tokens) for every ward: full names and variants of
+        all wards first, so a shorter alias never shadows another ward's name,
+        then leading parts of names and distinctive words
+        """
+        token_wards: Dict[str, set] = {}
+        names = {}
+        for ward_no, ward in self.by_no.items():
+            tokens = tuple(normalize(ward["ward_name"]).split())
+            names[ward_no] = tokens
+            for token in set(tokens):
+                token_wards.setdefault(token, set()).add(ward_no)
+        joined_names = {ward_no: "".join(tokens) for ward_no, tokens in names.items()}
+
+        for ward_no, tokens in names.items():
+            yield ward_no, tokens
+            # Spelling variants of the full name
+            for i, token in enumerate(tokens):
+                for variant in TOKEN_VARIANTS.get(token, ()):
+                    yield ward_no, tokens[:i] + (variant,) + tokens[i + 1:]
+            # Full name written as one word ("modeltown")
+            if len(tokens) > 1:
+                yield ward_no, (joined_names[ward_no],)
+
+        for ward_no, tokens in sorted(names.items()):
+            # Name without its trailing words ("janak puri", "janakpuri" -> JANAK PURI NORTH)
+            for k in range(2, len(tokens)):
+                if not all(token in GENERIC_TOKENS for token in tokens[:k]):
+                    yield ward_no, tokens[:k]
+                    yield ward_no, ("".join(tokens[:k]),)
+            # A word that names exactly one ward ("sakravati" -> NANGLI SAKRAVATI), unless
+            # it starts another ward's name written as one word ("vasant" -> VASANTKUNJ)
+            for token in tokens:
+                if (len(tokens) > 1 and len(token) >= 5 and token not in GENERIC_TOKENS
+                        and not token.isdigit() and token_wards[token] == {ward_no}
+                        and not any(joined.startswith(token) for other, joined in joined_names.items()
+                                    if other != ward_no)):
+                    yield ward_no, (token,)
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+    def get(self, ward_no: str) -> Optional[Dict]:
+        """O(1) ward lookup by ward number (case-insensitive)"""
+        ward = self.by_no.get(ward_no)
+        if ward is None and ward_no:
+            canonical = self._by_no_lower.get(str(ward_no).lower())
+            ward = self.by_no.get(canonical) if canonical else None
+        return ward
+
+    def _correct(self, token: str) -> str:
+        """Closest vocabulary token for a likely misspelling, or the token itself"""
+        if token in self._vocabulary or len(token) < 5 or token in COMMON_WORDS or token.isdigit():
+            return token
+        corrected = self._corrections.get(token)
+        if corrected is None:
+            match = difflib.get_close_matches(token, self._vocabulary_list, n=1, cutoff=FUZZY_CUTOFF)
+            corrected = match[0] if match else token
+            with self._corrections_lock:
+                if len(self._corrections) >= CORRECTION_CACHE_SIZE:
+                    del self._corrections[next(iter(self._corrections))]
+                self._corrections[token] = corrected
+        return corrected
+
+    def _scan(self, tokens: List[str]) -> List[Tuple[int, int, str]]:
+        """
+        Longest, leftmost non-overlapping alias matches as (start, end, ward_no);
+        adjacent tokens are also matched joined together against one-word aliases
+        """
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node, best = self._trie, None
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if "$" in node:
+                    best = (i, j + 1, node["$"])
+            for j in range(i + 2, min(i + MAX_JOINED_TOKENS, len(tokens)) + 1):
+                node = self._trie.get("".join(tokens[i:j]))
+                if node and "$" in node and (best is None or j > best[1]):
+                    best = (i, j, node["$"])
+            if best:
+                matches.append(best)
+                i = best[1]
+            else:
+                i += 1
+        return matches
+
+    def match(self, message: str) -> List[Dict]:
+        """
+        All wards mentioned in a message, in order of appearance.
+        Explicit ward numbers ("ward 72") come first; names are matched exactly,
+        then with misspelled tokens corrected if nothing matched exactly.
+        """
+        found: List[str] = []
+        for number in WARD_NUMBER_PATTERN.findall(message):
+            ward = self.get(number)
+            if ward and ward["ward_no"] not in found:
+                found.append(ward["ward_no"])
+
+        tokens = normalize(message).split()
+        matches = self._scan(tokens)
+        if not matches:
+            matches = self._scan([self._correct(token) for token in tokens])
+        for _, _, ward_no in matches:
+            if ward_no not in found:
+                found.append(ward_no)
+
+        return [self.by_no[ward_no] for ward_no in found]
+
+    def detect(self, message: str) -> Tuple[Optional[str], Optional[str]]:
+        """First ward mentioned in a message as (ward_name, ward_no), or (None, None)"""
+        wards = self.match(message)
+        if not wards:
+            return None, None
+        return wards[0]["ward_name"], wards[0]["ward_no"]
+
+
+def load_geojson_wards() -> List[Dict]:
+    """Ward names and numbers from Delhi_Wards.geojson (backend or project root)"""
+    for path in (
+        os.path.join(os.path.dirname(__file__), "Delhi_Wards.geojson"),
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "Delhi_Wards.geojson")),
+    ):
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                features = json.load(f).get("features", [])
+            wards = []
+            for feature in features:
+                properties = feature.get("properties", {})
+                ward_name = properties.get("Ward_Name") or properties.get("ward_name")
+                ward_no = properties.get("Ward_No") or properties.get("ward_no")
+                if ward_name and ward_no:
+                    wards.append({"ward_no": str(ward_no), "ward_name": ward_name})
+            return wards
+    logger.warning("Delhi_Wards.geojson not found; ward gazetteer covers selected wards only")
+    return []
+
+
+# Global instance
+_gazetteer_instance = None
+_gazetteer_lock = threading.Lock()
+
+def get_ward_gazetteer(selected_wards: Optional[List[Dict]] = None) -> WardGazetteer:
+    """
+    Get or create the global ward gazetteer.
+    Selected wards (with coordinates and quadrant) take precedence over GeoJSON entries.
+    """
+    global _gazetteer_instance
+    if _gazetteer_instance is None:
+        with _gazetteer_lock:
+            if _gazetteer_instance is None:
+                wards = {w["ward_no"]: w for w in load_geojson_wards()}
+                for ward in selected_wards or []:
+                    wards[str(ward["ward_no"])] = ward
+                _gazetteer_instance = WardGazetteer(list(wards.values()))
+    return _gazetteer_instance
@@ -133,13 +133,30 @@ export default function ChatbotAssistant() {
     setInputValue("")
     setIsTyping(true)
 
+    // Bot message filled in as tokens stream in
+    const botMessageId = `stream-${Date.now()}`
+
     try {
-      // Send message to API
-      const response = await chatAPI.sendMessage(content)
+      const response = await chatAPI.streamMessage(content, (token) => {
+        setIsTyping(false)
+        setMessages(prev => {
+          if (!prev.some(m => m.id === botMessageId)) {
+            return [...prev, {
+              id: botMessageId,
+              user_id: user?.id || "",
+              user_message: content,
+              bot_response: token,
+              type: "bot",
+              created_at: new Date().toISOString()
+            }]
+          }
+          return prev.map(m => m.id === botMessageId ? { ...m, bot_response: (m.bot_response || "") + token } : m)
+        })
+      })
       
-      // Remove temp user message and add the bot response
+      // Replace the temp messages with the saved ones
       setMessages(prev => {
-        const filtered = prev.filter(m => m.id !== userMessage.id)
+        const filtered = prev.filter(m => m.id !== userMessage.id && m.id !== botMessageId)
         return [
           ...filtered,
           // Add user message
@@ -168,8 +185,8 @@ export default function ChatbotAssistant() {
       })
     } catch (error: any) {
       toast.error("Failed to send message: " + (error.message || "Unknown error"))
-      // Remove the optimistic message on error
-      setMessages(prev => prev.filter(m => m.id !== userMessage.id))
+      // Remove the optimistic messages on error
+      setMessages(prev => prev.filter(m => m.id !== userMessage.id && m.id !== botMessageId))
     } finally {
       setIsTyping(false)
     }
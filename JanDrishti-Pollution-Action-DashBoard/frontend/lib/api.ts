@@ -186,7 +186,7 @@ export const reportsService = {
 
 // Chat API - use this in your components
 export const chatAPI = {
-  async getMessages(params?: { limit?: number; offset?: number }) {
+  async getMessages(params?: { limit?: number; offset?: number; before?: string }) {
     const response = await api.get('/api/chat/messages', { params })
     return response.data
   },
@@ -194,6 +194,45 @@ export const chatAPI = {
   async sendMessage(message: string) {
     const response = await api.post('/api/chat/messages', { message })
     return response.data
+  },
+
+  // Stream the reply as Server-Sent Events; resolves with the saved message
+  async streamMessage(message: string, onToken: (token: string) => void) {
+    const token = localStorage.getItem('access_token')
+    const response = await fetch(`${API_BASE_URL}/api/chat/messages/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify({ message }),
+    })
+
+    if (!response.ok || !response.body) {
+      const error = await response.json().catch(() => ({}))
+      throw new Error(error.detail || `Request failed with status ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      const events = buffer.split('\n\n')
+      buffer = events.pop() || ''
+      for (const raw of events) {
+        const event = raw.match(/^event: (.*)$/m)?.[1]
+        const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}')
+        if (event === 'token') onToken(data.content)
+        else if (event === 'done') return data
+        else if (event === 'error') throw new Error(data.detail || 'Failed to save message')
+      }
+    }
+    throw new Error('Stream ended unexpectedly')
   }
 }
 
@@ -276,12 +315,13 @@ export interface WardData {
 }
 
 export interface DailyAQIData {
-  id: string
+  // id, quadrant, coordinates and timestamps are only returned when requested via `fields`
+  id?: string
   ward_name: string
   ward_no: string
-  quadrant: string
-  latitude: number
-  longitude: number
+  quadrant?: string
+  latitude?: number
+  longitude?: number
   date: string
   avg_aqi: number
   avg_pm25: number | null
@@ -291,8 +331,8 @@ export interface DailyAQIData {
   min_aqi: number
   max_aqi: number
   hourly_readings_count: number
-  created_at: string
-  updated_at: string
+  created_at?: string
+  updated_at?: string
 }
 
 // AQI Service
@@ -318,9 +358,8 @@ export const aqiService = {
 
   async getWards(): Promise<WardData[]> {
     try {
-      // Add nocache parameter to bypass cache during development
+      // No cache-busting parameter: the browser revalidates with the ETag and gets a 304 when unchanged
       const response = await api.get('/api/aqi/wards', {
-        params: { _t: Date.now() }, // Cache busting timestamp
         timeout: 10000 // 10 second timeout
       })
       
@@ -528,7 +567,9 @@ export const aqiService = {
     confidence: number
     historical_data_points: number
     trend: string
+    model?: string
     generated_at: string
+    narrative?: string | null
     note?: string
   }> {
     try {